@@ -0,0 +1,429 @@
+"""
+Benchmarks for the perception pipeline on the recorded test dataset.
+
+Run from the code directory:
+
+    python benchmark.py
+    python benchmark.py --save baseline.json
+    python benchmark.py --compare baseline.json
+
+The suite times its stages in rounds of one pass each, after a warm-up
+pass, and reports the median pass of every stage. --compare exits with
+status 1 when a stage got slower than the baseline by more than
+--threshold, and by more than NOISE_MARGIN times the spread of its
+passes.
+
+    python benchmark.py --verify-roi
+
+checks that the ROI-cropped perception_step gives the same outputs as
+the full frame, exiting with status 1 if any differ.
+
+"""
+
+
+import sys
+import glob
+import json
+import time
+import base64
+import platform
+import argparse
+import tracemalloc
+from io import BytesIO
+from functools import partial
+
+import cv2
+
+import numpy as np
+from PIL import Image
+
+import perception
+from frame_loader import FrameLoader
+from replay import read_log, update_from_log
+from rover_state import RoverState
+from supporting_functions import decode_camera_image, create_output_images
+
+
+IMG_PATTERN = '../test_dataset/IMG/*.jpg'
+LOG_PATH = '../test_dataset/robot_log.csv'
+CALIBRATION_PATTERN = '../calibration_images/example_*.jpg'
+
+
+def load_images(pattern=IMG_PATTERN):
+    """Decode every dataset image into a uint8 RGB array."""
+    return [np.asarray(Image.open(path)) for path in sorted(glob.glob(pattern))]
+
+
+# A suite stage only counts as slower than the baseline past this many
+# times the relative spread of its passes (in the baseline or now)
+NOISE_MARGIN = 5.0
+
+# Input of the reference work timed alongside the suite stages
+_reference_image = np.random.default_rng(0).random((160, 320, 3)).astype(np.float32)
+
+
+def reference_work(_):
+    # Fixed work that does not depend on the repo's code, so its time
+    # only follows the speed of the machine
+    blurred = cv2.GaussianBlur(_reference_image, (5, 5), 0)
+    return np.cumsum(blurred, axis=0)
+
+
+def pass_times(func, inputs, repeat=5, warmup=1, fresh=False):
+    """
+    Return the per-call times (s) of repeat timed passes of func over all
+    inputs, run after warmup untimed passes.
+
+    For stages that keep state between calls, fresh=True makes func a
+    factory called before every pass (outside the timing) to return the
+    function to run, so that every pass starts from the same state.
+
+    """
+    times = [timed_pass(func, inputs, fresh) for _ in range(warmup + repeat)]
+    return times[warmup:]
+
+
+def timed_pass(func, inputs, fresh=False):
+    # Per-call time (s) of one pass of func over all inputs
+    run = func() if fresh else func
+    start = time.perf_counter()
+    for item in inputs:
+        run(item)
+    return (time.perf_counter() - start)/len(inputs)
+
+
+def seconds_per_call(func, inputs, repeat=5, warmup=1, fresh=False):
+    """Return the median per-call time of func over all inputs."""
+    return float(np.median(pass_times(func, inputs, repeat, warmup, fresh)))
+
+
+def peak_memory(func, inputs):
+    """Return the peak bytes allocated (as seen by tracemalloc) by one pass."""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        for item in inputs:
+            func(item)
+        return tracemalloc.get_traced_memory()[1] - baseline
+    finally:
+        tracemalloc.stop()
+
+
+def perception_frame(Rover, frame, crop=True):
+    # Replay one (log row, image) frame through perception_step
+    row, img = frame
+    Rover.img = img
+    update_from_log(Rover, row)
+    perception.perception_step(Rover, crop=crop)
+
+
+def measure(stages, repeat=9, warmup=1, reference_calls=300):
+    """
+    Time stages given as {name: (func, inputs, fresh)} in pass_times()
+    terms, and return their suite entries.
+
+    Every round runs one pass of each stage and of reference_work(). An
+    entry holds the median per-call time and the rate it allows, the
+    median of the pass times relative to the reference pass of the same
+    round with its spread (median absolute deviation over the median),
+    and the peak memory. The relative times follow the machine getting
+    faster or slower between and during runs, which moves every stage
+    alike.
+
+    """
+    stages = dict(stages, reference=(reference_work, range(reference_calls), False))
+    times = {name: [] for name in stages}
+    for idx in range(warmup + repeat):
+        for name, (func, inputs, fresh) in stages.items():
+            seconds = timed_pass(func, inputs, fresh)
+            if idx >= warmup:
+                times[name].append(seconds)
+
+    reference = np.array(times.pop('reference'))
+    results = {}
+    for name, (func, inputs, fresh) in stages.items():
+        if name == 'reference':
+            continue
+        seconds = float(np.median(times[name]))
+        relative = np.array(times[name])/reference
+        median = float(np.median(relative))
+        results[name] = {'ns_per_call': seconds*1e9,
+                         'frames_per_s': 1./seconds,
+                         'relative': median,
+                         'spread': float(np.median(np.abs(relative - median)))/median,
+                         'peak_kib': peak_memory(func() if fresh else func, inputs)/1024.}
+    return results
+
+
+def bench_suite(images, log_path=LOG_PATH, repeat=9, warmup=1):
+    """
+    Time each stage of the perception and rendering pipeline separately.
+
+    The individual transforms run on images (dataset frames plus the
+    calibration examples). perception_step replays the robot log frames
+    in order through a new RoverState on every pass, and
+    create_output_images renders the map of one full replay.
+
+    """
+    src = perception.CALIB_SRC
+    dst = perception.calibration_dst(images[0].shape)
+    warped_images = [perception.perspect_transform(img, src, dst)[0] for img in images]
+    threshed_images = [perception.color_thresh(warped) for warped in warped_images]
+    rover_pixels = [perception.rover_coords(threshed) for threshed in threshed_images]
+    # Pair every frame's pixels with a logged pose for the world transform
+    rows = list(read_log(log_path))
+    poses = [(row['pos'], row['yaw']) for row in rows]
+    world_inputs = [(pixels, poses[idx % len(poses)])
+                    for idx, pixels in enumerate(rover_pixels)]
+
+    frames = [(row, np.asarray(Image.open(row['path']))) for row in rows]
+
+    def fresh_perception():
+        return partial(perception_frame, RoverState())
+
+    # Render the map of a full replay
+    Rover = RoverState()
+    for frame in frames:
+        perception_frame(Rover, frame)
+    Rover.total_time = 0.
+
+    return measure({
+        'perspect_transform': (
+            lambda img: perception.perspect_transform(img, src, dst), images, False),
+        'color_thresh': (perception.color_thresh, warped_images, False),
+        'rock_thresh': (perception.rock_thresh, warped_images, False),
+        'rover_coords': (perception.rover_coords, threshed_images, False),
+        'to_polar_coords': (
+            lambda pixels: perception.to_polar_coords(*pixels), rover_pixels, False),
+        'pix_to_world': (
+            lambda item: perception.pix_to_world(item[0], *item[1]), world_inputs, False),
+        'perception_step': (fresh_perception, frames, True),
+        'create_output_images': (
+            lambda _: create_output_images(Rover), range(len(frames)//4 or 1), False),
+    }, repeat, warmup)
+
+
+def print_suite(results):
+    print('Pipeline stages')
+    for name, stats in results.items():
+        print('  {:<22} {:12.0f} ns/call {:10.1f} frames/s {:6.1%} spread {:10.1f} KiB peak'.format(
+            name, stats['ns_per_call'], stats['frames_per_s'], stats['spread'],
+            stats['peak_kib']))
+
+
+def save_baseline(path, results, images):
+    baseline = {
+        'images': images,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'results': results,
+    }
+    with open(path, 'w') as baseline_file:
+        json.dump(baseline, baseline_file, indent=2)
+
+
+def compare_to_baseline(results, path, threshold=0.20):
+    """
+    Print the change of every stage against a saved baseline and return
+    the names of the stages slower by more than their margin: threshold
+    (a fraction), or NOISE_MARGIN times the larger relative spread of
+    the stage's passes in the baseline and now if that is wider.
+
+    Stages are compared by their time relative to the reference work, so
+    a machine running slower than when the baseline was saved does not
+    read as a regression.
+
+    """
+    with open(path) as baseline_file:
+        baseline = json.load(baseline_file)['results']
+    regressions = []
+    print('Compared to {}'.format(path))
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        if 'relative' in baseline[name]:
+            change = stats['relative']/baseline[name]['relative'] - 1
+        else:
+            # Baseline saved before the reference work was timed
+            change = stats['ns_per_call']/baseline[name]['ns_per_call'] - 1
+        spread = max(stats['spread'], baseline[name].get('spread', 0.))
+        margin = max(threshold, NOISE_MARGIN*spread)
+        regressed = change > margin
+        if regressed:
+            regressions.append(name)
+        print('  {:<22} {:+7.1%} (margin {:5.1%}){}'.format(
+            name, change, margin, '  REGRESSION' if regressed else ''))
+    return regressions
+
+
+def bench_classify(images, repeat=5, warmup=1):
+    """Compare the fused classifier with color_thresh/rock_thresh/obstacle math."""
+    warp_context = perception.get_warp_context(images[0])
+    mask = warp_context.mask
+    warped_images = [warp_context.warp(img).copy() for img in images]
+
+    def three_function_path(warped):
+        navigable = perception.color_thresh(warped)
+        obstacle = np.abs(np.float32(navigable) - 1) * mask
+        rock = perception.rock_thresh(warped)
+        return navigable, obstacle, rock
+
+    def fused_path(warped):
+        return perception.classify_pixels(warped, mask)
+
+    baseline = seconds_per_call(three_function_path, warped_images, repeat, warmup)
+    fused = seconds_per_call(fused_path, warped_images, repeat, warmup)
+    return {'three_function_path': baseline, 'fused_classifier': fused}
+
+
+# Per-frame outputs of perception_step compared by verify_roi
+ROI_OUTPUTS = ('vision_image', 'vision_threshed', 'x_nav', 'y_nav', 'nav_dists',
+               'nav_angles', 'nav_angles_left', 'obs_dists', 'obs_angles',
+               'rock_dists', 'rock_angles', 'clearance', 'worldmap')
+
+
+def replay_frames(log_path=LOG_PATH):
+    return [(row, np.asarray(Image.open(row['path']))) for row in read_log(log_path)]
+
+
+def verify_roi(frames):
+    """
+    Check that ROI-cropped perception matches the full-frame path.
+
+    Replays the frames through perception_step with and without crop
+    and returns the names of the outputs that differ on any frame:
+    the ROI_OUTPUTS arrays, the map updates and occupancy grid must be
+    identical, the tracked sample positions equal to rounding.
+
+    """
+    cropped, full = RoverState(), RoverState()
+    mismatches = set()
+    for row, img in frames:
+        for Rover, crop in ((cropped, True), (full, False)):
+            Rover.img = img
+            update_from_log(Rover, row)
+            perception.perception_step(Rover, crop=crop)
+        for name in ROI_OUTPUTS:
+            if not np.array_equal(getattr(cropped, name), getattr(full, name)):
+                mismatches.add(name)
+        if not all(np.array_equal(a, b) for a, b in zip(cropped.map_update, full.map_update)):
+            mismatches.add('map_update')
+        tracks = [(cropped.sample_tracker.tracks, full.sample_tracker.tracks)]
+        if any(len(a) != len(b) or not all(np.allclose(x.pos, y.pos) for x, y in zip(a, b))
+               for a, b in tracks):
+            mismatches.add('sample_tracker')
+    for name in ('log_odds', 'rock_evidence'):
+        if not np.array_equal(getattr(cropped.occupancy, name), getattr(full.occupancy, name)):
+            mismatches.add(name)
+    return sorted(mismatches)
+
+
+def bench_roi(frames, repeat=5, warmup=1):
+    """Compare full-frame perception_step with the ROI-cropped one."""
+    results = {}
+    for name, crop in (('full_frame', False), ('roi_cropped', True)):
+
+        def fresh_perception():
+            return partial(perception_frame, RoverState(), crop=crop)
+
+        results[name] = seconds_per_call(fresh_perception, frames, repeat, warmup,
+                                         fresh=True)
+    return results
+
+
+def bench_loader(pattern=IMG_PATTERN, workers=(1, None)):
+    """Compare sequential PIL decoding with the threaded FrameLoader."""
+    paths = sorted(glob.glob(pattern))
+
+    def run(frames):
+        start = time.perf_counter()
+        for _ in frames:
+            pass
+        return (time.perf_counter() - start)/len(paths)
+
+    results = {'pil_sequential': run(np.asarray(Image.open(path)) for path in paths)}
+    for count in workers:
+        loader = FrameLoader(paths, workers=count)
+        results['frame_loader_{}_workers'.format(loader.workers)] = run(loader)
+    return results
+
+
+def bench_telemetry_decode(pattern=IMG_PATTERN, repeat=5, warmup=1):
+    """Compare the PIL telemetry image decode with decoding into a buffer."""
+    payloads = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, 'rb') as image_file:
+            payloads.append(base64.b64encode(image_file.read()).decode('utf-8'))
+    buffer = np.zeros((160, 320, 3), dtype=np.uint8)
+
+    def pil_path(payload):
+        return np.asarray(Image.open(BytesIO(base64.b64decode(payload))))
+
+    def buffer_path(payload):
+        return decode_camera_image(base64.b64decode(payload), out=buffer)
+
+    return {'pil_decode': seconds_per_call(pil_path, payloads, repeat, warmup),
+            'decode_into_buffer': seconds_per_call(buffer_path, payloads, repeat, warmup)}
+
+
+def print_results(title, results):
+    print(title)
+    reference = next(iter(results.values()))
+    for name, seconds in results.items():
+        print('  {:<24} {:9.1f} us/frame  {:5.2f}x'.format(
+            name, seconds * 1e6, reference / seconds))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Perception benchmarks')
+    parser.add_argument('--images', default=IMG_PATTERN,
+                        help='Glob pattern of the images to benchmark on.')
+    parser.add_argument('--calibration', default=CALIBRATION_PATTERN,
+                        help='Glob pattern of extra images for the transform stages.')
+    parser.add_argument('--log', default=LOG_PATH,
+                        help='Robot log replayed for perception_step.')
+    parser.add_argument('--repeat', type=int, default=9,
+                        help='Timed passes per stage; the median is reported.')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='Untimed passes per stage before the timed ones.')
+    parser.add_argument('--save', default=None,
+                        help='Save the pipeline stage results as a JSON baseline.')
+    parser.add_argument('--compare', default=None,
+                        help='JSON baseline to compare the pipeline stages against.')
+    parser.add_argument('--threshold', type=float, default=0.20,
+                        help='Least slowdown (fraction) reported as a regression.')
+    parser.add_argument('--suite-only', action='store_true',
+                        help='Skip the before/after comparison benchmarks.')
+    parser.add_argument('--verify-roi', action='store_true',
+                        help='Only check ROI-cropped perception against the full frame.')
+    args = parser.parse_args()
+
+    if args.verify_roi:
+        frames = replay_frames(args.log)
+        mismatches = verify_roi(frames)
+        print('ROI-cropped perception on {} frames: {}'.format(
+            len(frames), 'differs in ' + ', '.join(mismatches) if mismatches else 'identical'))
+        sys.exit(1 if mismatches else 0)
+
+    images = load_images(args.images)
+    print('Loaded {} images'.format(len(images)))
+    suite = bench_suite(images + load_images(args.calibration), args.log, args.repeat,
+                        args.warmup)
+    print_suite(suite)
+    if args.save:
+        save_baseline(args.save, suite, args.images)
+    regressions = []
+    if args.compare:
+        regressions = compare_to_baseline(suite, args.compare, args.threshold)
+    if args.suite_only:
+        sys.exit(1 if regressions else 0)
+
+    print_results('Pixel classification', bench_classify(images, args.repeat, args.warmup))
+    print_results('Perception ROI', bench_roi(replay_frames(args.log), args.repeat,
+                                              args.warmup))
+    print_results('Image decoding', bench_loader(args.images))
+    print_results('Telemetry image decoding',
+                  bench_telemetry_decode(args.images, args.repeat, args.warmup))
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,106 @@
+"""
+Free distance ahead of the rover along each steering angle.
+
+"""
+import numpy as np
+import cv2
+
+
+# Steering angles (degrees, left positive) of the clearance bins
+STEER_ANGLES = np.linspace(-15, 15, 13)
+
+# Rays are followed from MIN_DIST out to MAX_CLEARANCE warped-image pixels
+# (10 pixels per meter), and stop where they pass closer than HALF_WIDTH
+# to an obstacle pixel, so a clear ray leaves room for the rover body on
+# both sides. The first meter is skipped: the camera only sees the ground
+# from the calibration bottom offset (6 pixels) on, and the warp smears
+# the few rows after that, which are often labeled obstacle wrongly.
+MIN_DIST = 10
+MAX_CLEARANCE = 80
+HALF_WIDTH = 4
+
+
+class SteeringRays():
+    """
+    Pixels of the warped image along the ray of every steering bin.
+
+    The rover sits at the bottom centre of the warped image, so the rays
+    are computed once per image shape and a frame only gathers the
+    distance transform at these pixels.
+
+    With crop, the distance transform only runs on the bounding box of
+    the rays grown by margin pixels. The distance transform of a pixel
+    only drops below half_width because of obstacles nearer than that,
+    so a margin a little wider than half_width (the 3x3 L2 transform
+    underestimates distances by up to 5%) gives the same clearance as
+    the full image.
+
+    """
+
+    def __init__(self, img_shape, half_width, crop=True, angles=STEER_ANGLES,
+                 max_dist=MAX_CLEARANCE):
+        rows, cols = img_shape[:2]
+        self.dists = np.arange(MIN_DIST, max_dist, dtype=np.float32)
+        radians = np.deg2rad(angles)[:, None]
+        # Rover frame is x forward and y left of the rover
+        x_rover = self.dists*np.cos(radians)
+        y_rover = self.dists*np.sin(radians)
+        img_rows = np.clip(np.round(rows - x_rover), 0, rows - 1).astype(np.intp)
+        img_cols = np.clip(np.round(rows - y_rover), 0, cols - 1).astype(np.intp)
+
+        if crop:
+            margin = int(np.ceil(half_width*1.05)) + 1
+            top, left = max(img_rows.min() - margin, 0), max(img_cols.min() - margin, 0)
+            bottom = min(img_rows.max() + margin + 1, rows)
+            right = min(img_cols.max() + margin + 1, cols)
+        else:
+            top, left, bottom, right = 0, 0, rows, cols
+        self.rows, self.cols = slice(top, bottom), slice(left, right)
+        # (bins, samples) flat indices into the cropped image
+        self.pixels = (img_rows - top)*(right - left) + img_cols - left
+
+        self.free = np.zeros((bottom - top, right - left), dtype=np.uint8)
+        self.clearance = np.zeros(len(angles), dtype=np.float32)
+
+
+_steering_rays = {}
+
+
+def steering_clearance(labels, obstacle_flag, half_width=HALF_WIDTH, crop=True):
+    """
+    Return the clearance (warped-image pixels) of every STEER_ANGLES bin.
+
+    Pixels of the label image with obstacle_flag set are obstacles; those
+    out of the camera view are not. The distance transform of the other
+    pixels gives each pixel's distance to the nearest obstacle, and a
+    bin's clearance is how far its ray runs before that distance drops
+    below half_width. crop=False transforms the full image instead of the
+    rays' neighbourhood. The returned array is reused on the next call.
+
+    """
+    key = (labels.shape, half_width, crop)
+    rays = _steering_rays.get(key)
+    if rays is None:
+        rays = SteeringRays(labels.shape, half_width, crop)
+        _steering_rays[key] = rays
+
+    obstacle = cv2.bitwise_and(labels[rays.rows, rays.cols], obstacle_flag,
+                               dst=rays.free)
+    free = cv2.compare(obstacle, 0, cv2.CMP_EQ, dst=rays.free)
+    obstacle_dist = cv2.distanceTransform(free, cv2.DIST_L2, 3)
+
+    blocked = obstacle_dist.ravel()[rays.pixels] < half_width
+    first_blocked = np.argmax(blocked, axis=1)
+    np.copyto(rays.clearance, rays.dists[first_blocked])
+    rays.clearance[~blocked.any(axis=1)] = MAX_CLEARANCE
+    return rays.clearance
+
+
+# Bins ordered from straight ahead outwards, so that among equally clear
+# bins the smallest steering angle is picked
+_CENTRE_FIRST = np.argsort(np.abs(STEER_ANGLES), kind='stable')
+
+
+def clearest_bin(clearance):
+    """Index of the bin with the most clearance."""
+    return _CENTRE_FIRST[np.argmax(clearance[_CENTRE_FIRST])]
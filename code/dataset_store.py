@@ -0,0 +1,167 @@
+"""
+Columnar binary store of a robot_log.csv dataset.
+
+Converting a log once turns its text rows and folder of JPEGs into a
+directory of:
+
+    store.json         frame count, columns and source log
+    <column>.npy       one float64 array per telemetry column
+    time_order.npy     frames sorted by capture time
+    time_sorted.npy    seconds since the run start of the frames in time_order
+    image_offsets.npy  (frames + 1) byte offsets into images.bin
+    images.bin         the frame JPEGs, back to back and unmodified
+
+Columns are loaded memory-mapped and only when used. Run from the code
+directory:
+
+    python dataset_store.py ../test_dataset/robot_log.csv ../test_dataset/store
+
+"""
+import os
+import json
+import argparse
+
+import numpy as np
+
+from supporting_functions import decode_camera_image
+
+
+MANIFEST = 'store.json'
+
+# Telemetry columns, in the naming of replay.read_log rows
+COLUMNS = ('time', 'steer', 'throttle', 'brake', 'speed', 'x', 'y',
+           'pitch', 'yaw', 'roll')
+
+
+def convert(log_path, store_path):
+    """Convert a robot log and its images into a store; return the frame count."""
+    from replay import read_log  # replay reads stores, so import it late
+    os.makedirs(store_path, exist_ok=True)
+    columns = {name: [] for name in COLUMNS}
+    offsets = [0]
+    with open(os.path.join(store_path, 'images.bin'), 'wb') as images_file:
+        for row in read_log(log_path):
+            for name in COLUMNS:
+                if name in ('x', 'y'):
+                    columns[name].append(row['pos'][name == 'y'])
+                else:
+                    # Capture times come from the image names and may be missing
+                    value = row[name]
+                    columns[name].append(np.nan if value is None else value)
+            with open(row['path'], 'rb') as jpeg_file:
+                offsets.append(offsets[-1] + images_file.write(jpeg_file.read()))
+
+    for name, values in columns.items():
+        np.save(os.path.join(store_path, name + '.npy'),
+                np.array(values, dtype=np.float64))
+    np.save(os.path.join(store_path, 'image_offsets.npy'),
+            np.array(offsets, dtype=np.uint64))
+    # Frames without a capture time sort last
+    times = np.array(columns['time'], dtype=np.float64)
+    order = np.argsort(times, kind='stable')
+    start = np.nanmin(times) if np.isfinite(times).any() else 0.
+    np.save(os.path.join(store_path, 'time_order.npy'), order)
+    np.save(os.path.join(store_path, 'time_sorted.npy'), times[order] - start)
+
+    frames = len(offsets) - 1
+    with open(os.path.join(store_path, MANIFEST), 'w') as manifest_file:
+        json.dump({'frames': frames, 'columns': COLUMNS,
+                   'source': os.path.abspath(log_path)}, manifest_file, indent=2)
+    return frames
+
+
+class DatasetStore():
+    """
+    Read access to a converted dataset.
+
+    store['pitch'] returns a column as a read-only memory-mapped array;
+    each column file is opened on first use. Frames are selected with
+    frames_between() (capture time) and frames_where() (column ranges).
+
+    """
+
+    def __init__(self, store_path):
+        self.path = store_path
+        with open(os.path.join(store_path, MANIFEST)) as manifest_file:
+            manifest = json.load(manifest_file)
+        self.frames = manifest['frames']
+        self.columns = tuple(manifest['columns'])
+        self.loaded = {}
+
+    def __len__(self):
+        return self.frames
+
+    def __getitem__(self, name):
+        column = self.loaded.get(name)
+        if column is None:
+            column = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+            self.loaded[name] = column
+        return column
+
+    def frames_between(self, t0, t1):
+        """Frames captured between t0 and t1 s after the run start, in time order."""
+        elapsed = self['time_sorted']
+        start = np.searchsorted(elapsed, t0, side='left')
+        stop = np.searchsorted(elapsed, t1, side='right')
+        return np.asarray(self['time_order'][start:stop])
+
+    def frames_where(self, **ranges):
+        """
+        Frames whose columns lie in the given (low, high) ranges.
+
+        Either bound may be None, e.g. frames_where(pitch=(None, 0.25)).
+
+        """
+        selected = np.ones(self.frames, dtype=bool)
+        for name, (low, high) in ranges.items():
+            column = self[name]
+            if low is not None:
+                selected &= column >= low
+            if high is not None:
+                selected &= column < high
+        return np.flatnonzero(selected)
+
+    def jpeg(self, frame):
+        """Return the JPEG bytes of a frame (as a memory-mapped array)."""
+        offsets = self['image_offsets']
+        images = self.loaded.get('images.bin')
+        if images is None:
+            images = np.memmap(os.path.join(self.path, 'images.bin'),
+                               dtype=np.uint8, mode='r')
+            self.loaded['images.bin'] = images
+        return images[int(offsets[frame]):int(offsets[frame + 1])]
+
+    def image(self, frame, out=None):
+        """Decode a frame into an RGB uint8 array, reusing out if possible."""
+        return decode_camera_image(self.jpeg(frame), out)
+
+    def rows(self, frames=None):
+        """Yield the frames' telemetry in the dict layout of replay.read_log."""
+        frames = range(self.frames) if frames is None else frames
+        columns = {name: self[name].tolist() for name in COLUMNS}
+        for frame in frames:
+            values = {name: column[frame] for name, column in columns.items()}
+            yield {
+                'frame': int(frame),
+                'time': None if np.isnan(values['time']) else values['time'],
+                'steer': values['steer'],
+                'throttle': values['throttle'],
+                'brake': values['brake'],
+                'speed': values['speed'],
+                'pos': (values['x'], values['y']),
+                'pitch': values['pitch'],
+                'yaw': values['yaw'],
+                'roll': values['roll'],
+            }
+
+    def decode_row(self, row, out=None):
+        # FrameLoader decode function for rows()
+        return self.image(row['frame'], out)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert a robot log to a columnar store')
+    parser.add_argument('log', help='Path to the robot_log.csv of the run.')
+    parser.add_argument('store', help='Directory to write the store to.')
+    args = parser.parse_args()
+    print('Converted {} frames'.format(convert(args.log, args.store)))
@@ -2,17 +2,24 @@
 Main module for decision handling
 
 """
+from collections import deque, namedtuple, Counter
+
 import states
 import transition_actions
+from features import frame_features
+
+
+# One fired transition of the decision trace
+FiredTransition = namedtuple('FiredTransition', ['time', 'source', 'event', 'target'])
 
 
 """Handles switching between states"""
 class DecisionMaker():
 
-    def __init__(self):
+    def __init__(self, trace_size=1000):
 
         self.state = [
-            states.FollowingLeftWall, 
+            states.FollowingLeftWall,
             states.TurningToLeftWall,
             states.AvoidingLeftWall,
             states.AvoidingObstacles,
@@ -20,9 +27,14 @@ class DecisionMaker():
             states.StoppingAtSample,
             states.GettingUnstuck,
             states.ReturningHome,
-            states.ParkingAtHome
-        ]     
+            states.ParkingAtHome,
+            states.ExploringFrontier
+        ]
+        self.transitions = transition_actions.TRANSITIONS
 
+        # Recent fired transitions, and how often each (state, event) fired
+        self.trace = deque(maxlen=trace_size)
+        self.fired = Counter()
 
         self.curr_state = self.state[1]  # TurningToLeftWall
         print(self.curr_state)
@@ -35,20 +47,24 @@ class DecisionMaker():
     def run(self, Rover):
 
         if Rover.nav_angles is not None:
-            # Mapping each handler to its corresponding state
-            select = {
-                self.state[0]: transition_actions.following_left_wall_transitions,
-                self.state[1]: transition_actions.turning_to_left_wall_transitions,
-                self.state[2]: transition_actions.avoiding_left_wall_transitions,
-                self.state[3]: transition_actions.avoiding_obstacles_transitions,
-                self.state[4]: transition_actions.going_to_sample_transitions,
-                self.state[5]: transition_actions.stopping_at_sample_transitions,
-                self.state[6]: transition_actions.getting_unstuck_transitions,
-                self.state[7]: transition_actions.returning_home_transitions,
-                self.state[8]: transition_actions.parking_at_home_transitions
-            }
-            func = select.get(self.curr_state)
-
-            if func is not None:
-                func(self, Rover)
+            # Features read by the events and states, computed once per frame
+            Rover.features = frame_features(Rover)
+            if Rover.frontiers is not None and Rover.total_time is not None:
+                Rover.frontiers.track_coverage(Rover.total_time)
+
+            rules = self.transitions.get(self.curr_state)
+            if rules is not None:
+                rule = transition_actions.fire(Rover, rules)
+                target = transition_actions.next_state(Rover, self.curr_state, rule)
+                if rule is not None:
+                    self.record(Rover, rule, target)
+                self.switch_to_state(Rover, target)
         return Rover
+
+    def record(self, Rover, rule, target):
+        # Add a fired transition to the trace
+        source = self.curr_state.__name__
+        event = rule.event.__name__
+        self.fired[source, event] += 1
+        self.trace.append(FiredTransition(Rover.total_time, source, event,
+                                          target.__name__))
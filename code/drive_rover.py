@@ -5,131 +5,51 @@ Main controller module.
 
 import os
 import time
+import atexit
 import shutil
 import argparse
-from datetime import datetime
 
 # Related third party imports
 import socketio
 import eventlet
 import eventlet.wsgi
 import numpy as np
-import matplotlib.image as mpimg
 from PIL import Image
-from flask import Flask
+from flask import Flask, jsonify
 import matplotlib.pyplot as plt
 from matplotlib.patches import FancyArrow
 global debug_mode
 debug_mode = True
 from perception import perception_step
+from rover_state import RoverState
 import decision
-from supporting_functions import update_rover, create_output_images
+from supporting_functions import update_rover
+from telemetry import RateLimitedPrinter
+from output_renderer import OutputRenderer
+from profiling import StageProfiler
+from recorder import RunRecorder
 
 # Initialize socketio server and Flask application
 # (learn more at: https://python-socketio.readthedocs.io/en/latest/)
 sio = socketio.Server()
 app = Flask(__name__)
 
-# Read in ground truth map and create 3-channel green version for overplotting
-# NOTE: images are read in by default with the origin (0, 0) in the upper left
-# and y-axis increasing downward.
-ground_truth = mpimg.imread('../calibration_images/map_bw.png')
-
-# This next line creates arrays of zeros in the red and blue channels
-# and puts the map into the green channel.  This is why the underlying
-# map output looks green in the display image
-ground_truth_3d = np.dstack(
-    (ground_truth*0, ground_truth*255, ground_truth*0)
-).astype(np.float32)
-
-
-class RoverState():
-    """
-    Create a class to be a container for rover state telemetry values.
-
-    This allows for tracking telemetry values and results from
-    perception analysis
-
-    """
-
-    def __init__(self):
-        """
-        Initialize a RoverState instance to retain parameters.
-
-        NOTE: distances in meters and angles in degrees
-
-        """
-        self.start_time = None  # To record the start time of navigation
-        self.total_time = None  # To record total duration of navigation
-        self.img = np.zeros((160, 320, 3), dtype=float)  # Current camera image
-        self.pos = None  # Current position (x, y)
-        self.yaw = None  # Current yaw angle
-        self.pitch = None  # Current pitch angle
-        self.roll = None  # Current roll angle
-        self.vel = None  # Current velocity (m/s)
-        self.steer = 0  # Current steering angle
-        self.throttle = 0  # Current throttle value
-        self.brake = 0  # Current brake value
-
-        self.MAX_VEL = 2.0
-        self.MIN_VEL = 0.2
-        self.MAX_STEER_RIGHT = -15
-        self.MAX_STEER_LEFT = 15
-        self.MAX_BRAKE = 10
-        self.MIN_ANGLE_LEFT = 20
-        self.MIN_ANGLE_RIGHT = -20
-        self.MAX_STUCK_TIME = 3
-
-        self.start_stuck_time = 0
-        
-        self.nav_dists = None  # Distances to navigable terrain pixels
-        self.nav_angles = None  # Angles of navigable terrain pixels
-        self.nav_angles_left = None  # Nav terrain angles left of rover direction
-
-        self.obs_dists = None  # Distances to obstacle terrain pixels
-        self.obs_angles = None  # Angles of obstacle terrain pixels
-
-        self.rock_dists = None  # Distances to rock terrain pixels
-        self.rock_angles = None  # Angles of rock terrain pixels
-        self.samples_pos = None  # To store the actual sample positions
-        self.samples_to_find = 0  # To store the initial count of samples
-        self.samples_collected = 0  # To count the number of samples collected
-        self.near_sample = 0  # To be set to TLM value data["near_sample"]
-        self.picking_up = 0  # To be set to TLM value data["picking_up"]
-        self.send_pickup = False  # Set to True to trigger rock pickup
-
-        self.x_nav = np.zeros(1)
-        self.y_nav = np.zeros(1)
-
-        self.distance_from_home = None  # Current distance to starting location
-        self.angle_from_home = None  # Current angle to starting location
-        self.going_home = False  # Default rover configuration
-
-        self.timer_on = False  # Timer to determine duration of stuck
-        
-
-        # Rover vision image to be updated with displays of
-        # intermediate analysis steps on screen in autonomous mode
-        self.vision_image = np.zeros((160, 320, 3), dtype=np.float32)
-        self.vision_warped = np.zeros((160, 320, 3), dtype=float)
-        self.vision_threshed = np.zeros((160, 320), dtype=float)
-        self.vision_mask = np.zeros((160, 320), dtype=float)
-        # Worldmap image to be updated with the positions of
-        # ROIs navigable terrain, obstacles and rock samples
-        self.worldmap = np.zeros((200, 200, 3), dtype=np.float32)
-        self.ground_truth = ground_truth_3d  # Ground truth worldmap
-        # To update % of ground truth map successfully found
-        self.perc_mapped = 0
-
-        self.home_coords_world = np.array([99.7]), np.array([85.6])
-
-
 # Initialize our rover
 Rover = RoverState()
 
 # Initialize decision supervisor
 Decider = decision.DecisionMaker()
 
+# Initialize per-stage timing of the telemetry loop
+Profiler = StageProfiler(budget_ms=40.0)
+
+# Background renderer of the inset images sent to the simulator (set on
+# start, once the render rate is known)
+Renderer = None
+
+# Recorder of the run's frames and telemetry (set when recording)
+Recorder = None
+
 # Variables to track frames per second (FPS)
 # Initialize frame counter
 frame_counter = 0
@@ -138,6 +58,9 @@ frame_counter = 0
 second_counter = time.time()
 fps = None
 
+# Print the FPS and state at most once per second
+fps_printer = RateLimitedPrinter(interval=1.0)
+
 # Define telemetry function for what to do with incoming data
 @sio.on('telemetry')
 def telemetry(sid, data):
@@ -155,21 +78,24 @@ def telemetry(sid, data):
         fps = frame_counter
         frame_counter = 0
         second_counter = time.time()
-    print()
-    print("Current FPS: {}".format(fps))
-    print("State:", Decider.curr_state.__name__)
+    fps_printer("\nCurrent FPS: {}\nState: {}".format(
+        fps, Decider.curr_state.__name__))
 
     if data:
         global Rover
+        Profiler.start_frame()
         # Initialize / update Rover with current telemetry
-        Rover, image = update_rover(Rover, data)
+        with Profiler.stage('update_rover'):
+            Rover, image = update_rover(Rover, data)
 
         if np.isfinite(Rover.vel):
 
             # run perception and decision steps to update Rover's telemetry
-            Rover = perception_step(Rover)
+            with Profiler.stage('perception_step'):
+                Rover = perception_step(Rover)
             # Decider.switch_to_state(Rover, Decider.state[1])
-            Rover = Decider.run(Rover)
+            with Profiler.stage('decision'):
+                Rover = Decider.run(Rover)
 
             if debug_mode:
                 im1.set_data(Rover.img)
@@ -194,9 +120,8 @@ def telemetry(sid, data):
                 plt.gcf().canvas.start_event_loop(0.01)
                 # plt.pause(0.1)
 
-            # Create output images to send to server
-            out_image_strings = create_output_images(Rover)
-            out_image_string1, out_image_string2 = out_image_strings
+            # Latest output images finished by the background renderer
+            out_image_string1, out_image_string2 = Renderer.poll()
 
             # The action step!  Send commands to the rover!
 
@@ -205,13 +130,19 @@ def telemetry(sid, data):
             # back in response to the current telemetry data.
 
             # If in a state where want to pickup a rock send pickup command
-            if Rover.send_pickup and not Rover.picking_up:
-                send_pickup()
-                Rover.send_pickup = False  # Reset Rover flags
-            else:
-                # Send commands to the rover!
-                commands = (Rover.throttle, Rover.brake, Rover.steer)
-                send_control(commands, out_image_string1, out_image_string2)
+            with Profiler.stage('send_control'):
+                if Rover.send_pickup and not Rover.picking_up:
+                    send_pickup()
+                    Rover.send_pickup = False  # Reset Rover flags
+                else:
+                    # Send commands to the rover!
+                    commands = (Rover.throttle, Rover.brake, Rover.steer)
+                    send_control(commands, out_image_string1, out_image_string2)
+
+            # With the command on its way, hand the current state over to
+            # the renderer (throttled, dropped while it is still busy)
+            with Profiler.stage('render_submit'):
+                Renderer.submit(Rover)
 
         # In case of invalid telemetry, send null commands
         else:
@@ -219,18 +150,27 @@ def telemetry(sid, data):
             # Send zeros for throttle, brake and steer and empty images
             send_control((0, 0, 0), '', '')
 
-        # To save camera images from autonomous driving, specify a path
+        # To record the run from autonomous driving, specify a path
         # Example: $ python drive_rover.py image_folder_path
-        # Conditional to save image frame if folder was specified
-        if args.image_folder != '':
-            timestamp = datetime.utcnow().strftime('%Y_%m_%d_%H_%M_%S_%f')[:-3]
-            image_filename = os.path.join(args.image_folder, timestamp)
-            image.save('{}.jpg'.format(image_filename))
+        # Queue the camera frame and telemetry if a folder was specified
+        if Recorder is not None:
+            with Profiler.stage('record_frame'):
+                Recorder.record(image.jpeg, Rover, Decider.curr_state.__name__)
+        Profiler.end_frame()
 
     else:
         sio.emit('manual', data={}, skip_sid=True)
 
 
+@app.route('/profile')
+def profile():
+    """Serve the telemetry loop stage timings as JSON."""
+    report = Profiler.report()
+    report['renders_dropped'] = Renderer.dropped
+    report['planner'] = Rover.planner.stats()
+    return jsonify(report)
+
+
 @sio.on('connect')
 def connect(sid, environ):
     """Invoke the connect event handler."""
@@ -279,10 +219,29 @@ if __name__ == '__main__':
         nargs='?',
         default='',
         help='Path to image folder.' +
-        ' This is where the images from the run will be saved.'
+        ' This is where the recording of the run will be saved' +
+        ' (replay it with replay.py).'
     )
     parser.add_argument('-debug', action='store_true', default=False)
+    parser.add_argument(
+        '--render-rate',
+        type=float,
+        default=5.0,
+        help='Rate (Hz) at which the map and vision insets are rendered.'
+    )
+    parser.add_argument(
+        '--profile-out',
+        type=str,
+        default='',
+        help='Write the stage timings to this JSON file on exit.' +
+        ' They are also served at http://localhost:4567/profile'
+    )
     args = parser.parse_args()
+    if args.profile_out:
+        atexit.register(Profiler.dump, args.profile_out)
+    Renderer = OutputRenderer(rate=args.render_rate, profiler=Profiler)
+    # Registered after the dump so that the last render finishes first
+    atexit.register(Renderer.shutdown)
     debug_mode = False
     if args.debug:
         debug_mode = True
@@ -313,6 +272,8 @@ if __name__ == '__main__':
         else:
             shutil.rmtree(args.image_folder)
             os.makedirs(args.image_folder)
+        Recorder = RunRecorder(args.image_folder)
+        atexit.register(Recorder.close)
         print("Recording this run ...")
     else:
         print("NOT recording this run ...")
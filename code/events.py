@@ -13,7 +13,7 @@ def is_stuck(Rover):
                 Rover.timer_on = True
             else:
                 endtime = time.time()
-                exceeded_stucktime = (endtime - Rover.start_stuck_time) > Rover.MAX_STUCK_TIME
+                exceeded_stucktime = (endtime - Rover.start_stuck_time) > Rover.config.MAX_STUCK_TIME
         # no longer stuck. turn off timer
         else:  
             Rover.timer_on = False
@@ -24,8 +24,8 @@ def is_stuck(Rover):
 
 def pointed_along_wall(Rover, safe_pixs=500, wall_angle_offset=-10):
 
-    left_nav_pixs = len(Rover.nav_angles_left)
-    angle_from_left_wall = np.mean(Rover.nav_angles_left)
+    left_nav_pixs = Rover.features.left_count
+    angle_from_left_wall = Rover.features.left_mean
 
     return (left_nav_pixs >= safe_pixs
             and angle_from_left_wall > wall_angle_offset)
@@ -33,26 +33,26 @@ def pointed_along_wall(Rover, safe_pixs=500, wall_angle_offset=-10):
 
 def deviated_from_left_wall(Rover, max_angle_wall=25):
 
-    angle_from_left_wall = np.mean(Rover.nav_angles_left)
+    angle_from_left_wall = Rover.features.left_mean
     return angle_from_left_wall > max_angle_wall
 
 
-def obstacle_at_front(Rover, safe_pixs=600):
+def obstacle_at_front(Rover, min_clearance=20):
 
-    nav_pixs_front = len(Rover.nav_angles)
-    return nav_pixs_front < safe_pixs
+    # No steering angle is clear for 2 m
+    return Rover.features.clearest < min_clearance
 
 
-def obstacle_on_left(Rover, safe_pixs=50):
+def obstacle_on_left(Rover, min_clearance=15):
 
-    left_nav_pixs = len(Rover.nav_angles_left)
-    return left_nav_pixs < safe_pixs
+    # No steering angle to the left is clear for 1.5 m
+    return Rover.features.left_clearance < min_clearance
 
 
 def sample_located(Rover, rock_dist_limit=71, min_left_angle=0.0, max_right_angle=-17):
 
-    rock_angle = np.mean(Rover.rock_angles)
-    rock_distance = np.mean(Rover.rock_dists)
+    rock_angle = Rover.features.rock_mean_angle
+    rock_distance = Rover.features.rock_mean_dist
 
     return ((rock_angle >= min_left_angle or rock_angle > max_right_angle)
             and rock_distance < rock_dist_limit)
@@ -70,9 +70,49 @@ def sample_located(Rover, rock_dist_limit=71, min_left_angle=0.0, max_right_angl
 def completed_mission(Rover, min_samples=5, min_mapped=95):
 
     return (Rover.samples_collected >= min_samples
-            and Rover.perc_mapped >= min_mapped)
+            and Rover.map_stats.perc_mapped >= min_mapped)
+
+
+def coverage_stalled(Rover):
+
+    return Rover.frontiers.coverage_stalled()
+
+
+def frontier_reached(Rover, reach_dist=3):
+
+    # Also done once the goal got mapped past, or when there was no goal
+    goal = Rover.frontiers.goal
+    if goal is None:
+        return True
+    return (not Rover.frontiers.frontier[int(goal[1]), int(goal[0])]
+            or np.hypot(goal[0] - Rover.pos[0], goal[1] - Rover.pos[1]) < reach_dist)
+
+
+def exploring_too_long(Rover, max_time=40):
+
+    return Rover.total_time - Rover.frontiers.goal_time > max_time
 
 
 def reached_home(Rover, max_dist=3):
     
-    return Rover.going_home and Rover.distance_from_home < max_dist
\ No newline at end of file
+    return Rover.going_home and Rover.distance_from_home < max_dist
+
+
+def near_sample(Rover):
+
+    return bool(Rover.near_sample)
+
+
+def pickup_finished(Rover):
+
+    return Rover.picking_up == 0
+
+
+def moving_again(Rover, min_vel=1.0):
+
+    return Rover.vel >= min_vel
+
+
+def always(Rover):
+
+    return True
\ No newline at end of file
@@ -0,0 +1,52 @@
+"""
+Per-frame features shared by the decision events and states.
+
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from clearance import STEER_ANGLES, clearest_bin
+
+
+FrameFeatures = namedtuple('FrameFeatures', [
+    'nav_count',        # Navigable pixels in view (all ahead of the rover)
+    'nav_mean',         # Mean angle of navigable pixels
+    'left_count',       # Navigable pixels left of the rover direction
+    'left_mean',        # Mean angle of those pixels
+    'rock_count',       # Rock pixels within mapping range
+    'rock_mean_angle',  # Mean angle of those pixels
+    'rock_mean_dist',   # Mean distance of all rock pixels in view
+    'clearest_angle',   # Steering angle with the most clearance
+    'clearest',         # Clearance along that angle (warped pixels)
+    'left_clearance',   # Most clearance of the steering angles to the left
+    'right_clearance',  # Most clearance of the steering angles to the right
+])
+
+_LEFT_BINS = STEER_ANGLES > 0
+_RIGHT_BINS = STEER_ANGLES < 0
+
+
+def mean_or_nan(values):
+    # np.mean without the empty-slice warning; nan keeps every comparison
+    # against an empty view False, as before
+    return values.mean() if len(values) else np.nan
+
+
+def frame_features(Rover):
+    """Compute the FrameFeatures of the current perception arrays."""
+    clearance = Rover.clearance
+    best = clearest_bin(clearance)
+    return FrameFeatures(
+        nav_count=len(Rover.nav_angles),
+        nav_mean=mean_or_nan(Rover.nav_angles),
+        left_count=len(Rover.nav_angles_left),
+        left_mean=mean_or_nan(Rover.nav_angles_left),
+        rock_count=len(Rover.rock_angles),
+        rock_mean_angle=mean_or_nan(Rover.rock_angles),
+        rock_mean_dist=mean_or_nan(Rover.rock_dists),
+        clearest_angle=STEER_ANGLES[best],
+        clearest=clearance[best],
+        left_clearance=clearance[_LEFT_BINS].max(),
+        right_clearance=clearance[_RIGHT_BINS].max(),
+    )
@@ -0,0 +1,84 @@
+"""
+Parallel, in-order image decoding for replay and dataset processing.
+
+"""
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+
+_END = object()  # Marks the end of the item stream
+
+
+def decode_image(path, out=None):
+    """
+    Decode an image file into an RGB uint8 array (RoverState.img layout).
+
+    The color conversion writes into out when it has the right shape, so
+    buffers can be recycled between frames.
+
+    """
+    bgr = cv2.imread(path, cv2.IMREAD_COLOR)
+    if bgr is None:
+        raise IOError("Cannot decode image {}".format(path))
+    if out is None or out.shape != bgr.shape:
+        return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+    return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=out)
+
+
+class FrameLoader():
+    """
+    Decodes a stream of images on a thread pool and yields them in order.
+
+    OpenCV releases the GIL while decoding, so worker threads scale with
+    the number of cores. At most readahead frames are decoded ahead of
+    the consumer.
+
+    Iterating yields (item, image) pairs, where path(item) gives the file
+    to decode (items are paths by default), or decode(item, out) decodes
+    the item itself. With reuse_buffers, images
+    come from a ring of readahead + 1 arrays: each yielded image is only
+    valid until the next one is requested, so copy it to keep it.
+
+    """
+
+    def __init__(self, items, path=None, workers=None, readahead=None,
+                 reuse_buffers=True, decode=None):
+        self.items = items
+        self.path = path or (lambda item: item)
+        self.decode = decode or (lambda item, out: decode_image(self.path(item), out))
+        self.workers = workers or os.cpu_count() or 1
+        self.readahead = readahead or 2*self.workers
+        self.reuse_buffers = reuse_buffers
+
+    def __iter__(self):
+        items = iter(self.items)
+        free_buffers = []
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+
+            def fill():
+                # Keep readahead decodes in flight
+                while len(pending) < self.readahead:
+                    item = next(items, _END)
+                    if item is _END:
+                        return
+                    out = free_buffers.pop() if free_buffers else None
+                    pending.append((item, executor.submit(
+                        self.decode, item, out)))
+
+            held = None
+            fill()
+            while pending:
+                item, future = pending.popleft()
+                image = future.result()
+                # The consumer asked for a new frame, so the previous one
+                # can be decoded into again
+                if held is not None and self.reuse_buffers:
+                    free_buffers.append(held)
+                held = image
+                fill()
+                yield item, image
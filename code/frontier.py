@@ -0,0 +1,192 @@
+"""
+Frontiers between mapped and unmapped terrain, as exploration goals.
+
+"""
+from collections import deque
+
+import numpy as np
+import cv2
+
+from planner import BLOCKED_LOG_ODDS
+
+
+# A stretch of exploration stalls when fewer than STALL_MIN_CELLS grid
+# cells got mapped during the last STALL_WINDOW seconds
+STALL_WINDOW = 30.0
+STALL_MIN_CELLS = 40
+
+# (dx, dy) of the neighbours that make a navigable cell a frontier cell
+NEIGHBOURS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+
+
+def is_mapped(log_odds):
+    """
+    Whether cells are mapped navigable or firmly obstacle.
+
+    Obstacle evidence reaches further out than navigable evidence, so the
+    navigable terrain seen so far is ringed by cells with a little obstacle
+    evidence. Those cells count as unmapped until they collect
+    BLOCKED_LOG_ODDS, or the frontier would stop at the ring.
+
+    """
+    return (log_odds > 0) | (log_odds <= -BLOCKED_LOG_ODDS)
+
+
+class FrontierMap():
+    """
+    Navigable cells of the occupancy grid next to unmapped cells.
+
+    A cell can only become or stop being a frontier when it or one of its
+    neighbours changes, so the frontier mask is only re-evaluated around
+    the cells of each MapUpdate. Frontier cells are grouped into 8-connected
+    clusters when a goal is asked for; clusters smaller than min_size are
+    noise along the map edges and are ignored.
+
+    Also tracks how many cells are mapped over time, to tell when the
+    current way of exploring stopped finding new terrain.
+
+    """
+
+    def __init__(self, occupancy, min_size=5, min_distance=5.0,
+                 abandon_radius=5.0):
+        self.occupancy = occupancy
+        self.shape = occupancy.shape
+        self.min_size = min_size
+        self.min_distance = min_distance  # Cells; closer frontiers are skipped
+        self.abandon_radius = abandon_radius
+
+        self.known = is_mapped(occupancy.log_odds)
+        self.known_cells = int(np.count_nonzero(self.known))
+        self.frontier = np.zeros(self.shape, dtype=bool)
+        self.abandoned = np.zeros(self.shape, dtype=bool)  # Around given up goals
+        self.refresh(np.arange(self.known.size))
+
+        self.goal = None  # (x, y) world point of the current goal
+        self.goal_time = None
+        self.coverage = deque()  # (time, known_cells) samples
+
+    def update(self, map_update):
+        """Re-evaluate the frontier around the cells of a MapUpdate."""
+        cells = map_update.cells
+        if not len(cells):
+            return
+        known = self.known.ravel()
+        is_known = is_mapped(self.occupancy.log_odds.ravel()[cells])
+        self.known_cells += int(np.count_nonzero(is_known)
+                                - np.count_nonzero(known[cells]))
+        known[cells] = is_known
+
+        # The changed cells and their neighbours
+        rows, cols = self.shape
+        cell_y, cell_x = np.divmod(cells, cols)
+        around = [cells]
+        for dx, dy in NEIGHBOURS:
+            x, y = cell_x + dx, cell_y + dy
+            inside = (x >= 0) & (x < cols) & (y >= 0) & (y < rows)
+            around.append(y[inside]*cols + x[inside])
+        self.refresh(np.unique(np.concatenate(around)))
+
+    def refresh(self, cells):
+        # Recompute the frontier flag of flat cells
+        rows, cols = self.shape
+        cell_y, cell_x = np.divmod(cells, cols)
+        next_to_unknown = np.zeros(len(cells), dtype=bool)
+        for dx, dy in NEIGHBOURS:
+            x, y = cell_x + dx, cell_y + dy
+            inside = (x >= 0) & (x < cols) & (y >= 0) & (y < rows)
+            next_to_unknown[inside] |= ~self.known[y[inside], x[inside]]
+        navigable = self.occupancy.log_odds.ravel()[cells] > 0
+        self.frontier.ravel()[cells] = navigable & next_to_unknown
+
+    def clusters(self):
+        """
+        Return the (x, y) goal cells and sizes of the frontier clusters.
+
+        The goal of a cluster is its cell nearest to the cluster centroid,
+        so it lies on the frontier even when the cluster is curved.
+
+        """
+        mask = (self.frontier & ~self.abandoned).astype(np.uint8)
+        count, labels, stats, centroids = cv2.connectedComponentsWithStats(
+            mask, connectivity=8)
+        goals, sizes = [], []
+        for label in range(1, count):
+            size = stats[label, cv2.CC_STAT_AREA]
+            if size < self.min_size:
+                continue
+            cell_y, cell_x = np.nonzero(labels == label)
+            nearest = np.argmin(np.hypot(cell_x - centroids[label, 0],
+                                         cell_y - centroids[label, 1]))
+            goals.append((cell_x[nearest], cell_y[nearest]))
+            sizes.append(size)
+        return np.array(goals, dtype=np.intp).reshape(-1, 2), np.array(sizes)
+
+    def reachable_from(self, pos, radius=2):
+        """
+        Return a mask of the navigable cells connected to pos, or None if
+        pos is not on or next to mapped navigable terrain.
+
+        """
+        navigable = (self.occupancy.log_odds > 0).astype(np.uint8)
+        _, labels = cv2.connectedComponents(navigable, connectivity=8)
+        x, y = int(pos[0]), int(pos[1])
+        window = labels[max(y - radius, 0):y + radius + 1,
+                        max(x - radius, 0):x + radius + 1]
+        window = window[window > 0]
+        if not len(window):
+            return None
+        return labels == np.bincount(window).argmax()
+
+    def nearest(self, pos):
+        """
+        Return the (x, y) world point of the nearest reachable frontier
+        cluster from pos, or None if there is none.
+
+        """
+        goals, _ = self.clusters()
+        if not len(goals):
+            return None
+        reachable = self.reachable_from(pos)
+        if reachable is not None:
+            goals = goals[reachable[goals[:, 1], goals[:, 0]]]
+        distances = np.hypot(goals[:, 0] + 0.5 - pos[0], goals[:, 1] + 0.5 - pos[1])
+        far_enough = distances >= self.min_distance
+        if not far_enough.any():
+            return None
+        goals, distances = goals[far_enough], distances[far_enough]
+        x, y = goals[np.argmin(distances)]
+        # Centre of the goal cell
+        return x + 0.5, y + 0.5
+
+    def choose_goal(self, pos, now):
+        """Set the nearest reachable frontier as the goal and return it."""
+        self.goal = self.nearest(pos)
+        self.goal_time = now
+        return self.goal
+
+    def abandon_goal(self):
+        # Never pick the surroundings of the current goal again
+        if self.goal is not None:
+            rows, cols = self.shape
+            y, x = np.ogrid[:rows, :cols]
+            self.abandoned |= np.hypot(x + 0.5 - self.goal[0],
+                                       y + 0.5 - self.goal[1]) <= self.abandon_radius
+        self.goal = self.goal_time = None
+
+    def track_coverage(self, now):
+        """Record the number of mapped cells at time now (s)."""
+        self.coverage.append((now, self.known_cells))
+        # Keep the latest sample at least STALL_WINDOW old as the oldest one
+        while len(self.coverage) > 1 and self.coverage[1][0] <= now - STALL_WINDOW:
+            self.coverage.popleft()
+
+    def reset_coverage(self):
+        self.coverage.clear()
+
+    def coverage_stalled(self):
+        """Whether fewer than STALL_MIN_CELLS cells got mapped in STALL_WINDOW s."""
+        if not self.coverage:
+            return False
+        (start, start_cells), (end, end_cells) = self.coverage[0], self.coverage[-1]
+        return (end - start >= STALL_WINDOW
+                and end_cells - start_cells < STALL_MIN_CELLS)
@@ -0,0 +1,277 @@
+"""
+Log-odds occupancy grid for the rover worldmap.
+
+"""
+from collections import namedtuple
+
+import numpy as np
+
+
+# Log-odds evidence added to a cell for one frame that observes it.
+# Evidence is stored as fixed-point integers so accumulation is exact
+# and independent of the order in which frames are applied.
+LOG_ODDS_SCALE = 256
+NAVIGABLE_HIT = 0.4  # Towards navigable, per navigable observation
+OBSTACLE_HIT = 0.6  # Towards obstacle, per obstacle observation
+ROCK_HIT = 1.0  # Rock sample evidence, per rock observation
+
+# Navigable log-odds are kept within +-LOG_ODDS_BOUND after every frame,
+# so a cell mislabeled for a while (an obstacle hit is worth more than a
+# navigable one) flips back after a few frames instead of needing as
+# many as it has collected
+LOG_ODDS_BOUND = round(2.0*LOG_ODDS_SCALE)
+
+# Readings are fully trusted while pitch and roll (degrees, signed) stay in
+# the band where the flat-ground perspective warp holds. Past it their
+# weight decays as a gaussian of the excess angle, and readings below
+# MIN_CONFIDENCE are dropped.
+STABLE_PITCH = (-1.0, 0.25)
+STABLE_ROLL = (-1.0, 0.37)
+CONFIDENCE_DECAY = 0.5
+MIN_CONFIDENCE = 0.05
+
+# Result of one grid update. cells are the flat indices of the cells that
+# received navigable/obstacle evidence, was_navigable/is_navigable their
+# state before and after, and new_rock_cells the cells that got their
+# first rock evidence.
+MapUpdate = namedtuple('MapUpdate', ['cells', 'was_navigable', 'is_navigable',
+                                     'new_rock_cells'])
+
+NO_UPDATE = MapUpdate(*(np.zeros(0, dtype=dtype)
+                        for dtype in (np.intp, bool, bool, np.intp)))
+
+
+def signed_angle(angle):
+    # Map an angle in [0, 360) to (-180, 180]
+    return angle - 360 if angle > 180 else angle
+
+
+def band_excess(angle, band):
+    # How far (degrees) an angle lies outside a (low, high) band
+    angle = signed_angle(angle)
+    return max(band[0] - angle, angle - band[1], 0.)
+
+
+def reading_confidence(pitch, roll):
+    """
+    Weight in [0, 1] of a frame captured at the given pitch and roll.
+
+    High pitch/roll breaks the flat-ground assumption of the perspective
+    warp, so such frames contribute less evidence instead of none.
+
+    """
+    excess = np.hypot(band_excess(pitch, STABLE_PITCH),
+                      band_excess(roll, STABLE_ROLL))
+    return float(np.exp(-0.5*(excess/CONFIDENCE_DECAY)**2))
+
+
+class OccupancyGrid():
+    """
+    Per-cell log-odds of navigable terrain plus rock sample evidence.
+
+    Positive log-odds means navigable, negative means obstacle and zero
+    means unknown; they saturate at +-LOG_ODDS_BOUND. worldmap mirrors the grid as the RGB image the rest of
+    the code displays (obstacle red, rock green, navigable blue) and is
+    only refreshed at the cells touched by an update.
+
+    """
+
+    def __init__(self, world_size=200):
+        self.shape = (world_size, world_size)
+        self.log_odds = np.zeros(self.shape, dtype=np.int32)
+        self.rock_evidence = np.zeros(self.shape, dtype=np.int32)
+        self.worldmap = np.zeros(self.shape + (3,), dtype=np.float32)
+        self.transfer = None  # (shift, floor, ceiling) when tracked
+
+    def track_transfer(self):
+        """
+        Also keep each cell's log-odds transfer, for merge() into another
+        grid. Every saturating update maps a cell's log-odds x to
+        clip(x + shift, floor, ceiling), and so does any sequence of them,
+        so the three grids give the effect of all updates so far on a
+        grid that started with other evidence. Call before any update.
+
+        """
+        self.transfer = (np.zeros(self.shape, dtype=np.int32),
+                         np.full(self.shape, -LOG_ODDS_BOUND, dtype=np.int32),
+                         np.full(self.shape, LOG_ODDS_BOUND, dtype=np.int32))
+
+    def flat_cells(self, cells):
+        # Unique flat indices of (N, 2) integer (x, y) world cells
+        return np.unique(cells[:, 1]*self.shape[1] + cells[:, 0])
+
+    def update(self, nav_cells, obs_cells, rock_cells, confidence=1.0):
+        """
+        Add one frame of observations given as (N, 2) (x, y) world cells.
+
+        Each cell counts once per frame and class, weighted by the
+        frame's confidence. Returns a MapUpdate of what changed.
+
+        """
+        if confidence < MIN_CONFIDENCE:
+            return NO_UPDATE
+        nav_flat = self.flat_cells(nav_cells)
+        obs_flat = self.flat_cells(obs_cells)
+        rock_flat = self.flat_cells(rock_cells)
+
+        nav_hit = round(confidence*NAVIGABLE_HIT*LOG_ODDS_SCALE)
+        obs_hit = round(confidence*OBSTACLE_HIT*LOG_ODDS_SCALE)
+        rock_hit = round(confidence*ROCK_HIT*LOG_ODDS_SCALE)
+        return self.add_evidence([(nav_flat, nav_hit, obs_flat, obs_hit)],
+                                 rock_flat, rock_hit)
+
+    def update_batch(self, nav, obs, rock, confidences):
+        """
+        Add the observations of several frames at once.
+
+        nav, obs and rock are (frame_idx, cells) pairs giving the frame
+        (index into confidences) of each (N, 2) world cell. The grid ends
+        up exactly as if the frames were passed to update() one by one.
+        Navigable/obstacle evidence saturates, so it is still added frame
+        by frame (on the deduplicated cells of each), while the rock
+        evidence of all frames is applied with a single scatter-add.
+
+        """
+        confidences = np.asarray(confidences, dtype=np.float64)
+        # Per-frame rounding like update(), zero for gated frames
+        hits = [np.array([round(confidence*hit*LOG_ODDS_SCALE)
+                          if confidence >= MIN_CONFIDENCE else 0
+                          for confidence in confidences], dtype=np.int64)
+                for hit in (NAVIGABLE_HIT, OBSTACLE_HIT, ROCK_HIT)]
+
+        nav_frames, nav_flat = self.frame_cells(*nav, hits[0])
+        obs_frames, obs_flat = self.frame_cells(*obs, hits[1])
+        nav_bounds = np.searchsorted(nav_frames, np.arange(len(confidences) + 1))
+        obs_bounds = np.searchsorted(obs_frames, np.arange(len(confidences) + 1))
+        steps = [(nav_flat[nav_bounds[frame]:nav_bounds[frame + 1]], hits[0][frame],
+                  obs_flat[obs_bounds[frame]:obs_bounds[frame + 1]], hits[1][frame])
+                 for frame in range(len(confidences))
+                 if nav_bounds[frame] < nav_bounds[frame + 1]
+                 or obs_bounds[frame] < obs_bounds[frame + 1]]
+
+        rock_frames, rock_flat = self.frame_cells(*rock, hits[2])
+        totals = np.bincount(rock_flat, weights=hits[2][rock_frames],
+                             minlength=self.log_odds.size)
+        rock_flat = np.unique(rock_flat)
+        return self.add_evidence(steps, rock_flat, totals[rock_flat].astype(np.int64))
+
+    def frame_cells(self, frame_idx, cells, frame_hits):
+        # Frames and flat indices of the unique (frame, cell) pairs, sorted
+        # by frame, counting each cell once per frame as update() does and
+        # skipping frames without hits
+        keep = frame_hits[frame_idx] > 0
+        frame_idx, cells = frame_idx[keep], cells[keep]
+        size = self.log_odds.size
+        keys = np.unique(frame_idx*size + cells[:, 1]*self.shape[1] + cells[:, 0])
+        return np.divmod(keys, size)
+
+    def merge(self, shift, floor, ceiling, rock_evidence):
+        """
+        Apply the evidence of a grid accumulated separately with
+        track_transfer(), e.g. by another process over a later part of
+        the run.
+
+        The grid ends up exactly as if it had been updated with that
+        grid's frames, so the parts of a run are merged in frame order.
+
+        """
+        shift, floor, ceiling = np.ravel(shift), np.ravel(floor), np.ravel(ceiling)
+        cells = np.flatnonzero((shift != 0) | (floor != -LOG_ODDS_BOUND)
+                               | (ceiling != LOG_ODDS_BOUND))
+        log_odds = self.log_odds.ravel()
+        was_navigable = log_odds[cells] > 0
+        log_odds[cells] = np.clip(log_odds[cells] + shift[cells],
+                                  floor[cells], ceiling[cells])
+        rock_flat = np.flatnonzero(rock_evidence)
+        return self.refresh(cells, was_navigable, rock_flat,
+                            np.ravel(rock_evidence)[rock_flat])
+
+    def add_evidence(self, steps, rock_flat, rock_hit):
+        # Each of steps adds the (nav_flat, nav_hit, obs_flat, obs_hit)
+        # evidence of one frame at unique flat cells (hits may be scalars
+        # or per-cell arrays); then rock evidence is added
+        cells = np.unique(np.concatenate(
+            [np.zeros(0, dtype=np.intp)]
+            + [flat for nav_flat, _, obs_flat, _ in steps for flat in (nav_flat, obs_flat)]))
+        was_navigable = self.log_odds.ravel()[cells] > 0
+        for nav_flat, nav_hit, obs_flat, obs_hit in steps:
+            self.saturating_add(nav_flat, nav_hit)
+            self.saturating_add(obs_flat, -obs_hit)
+        return self.refresh(cells, was_navigable, rock_flat, rock_hit)
+
+    def saturating_add(self, flat, hit):
+        # Add hit to the log-odds of unique flat cells, within +-LOG_ODDS_BOUND
+        log_odds = self.log_odds.ravel()
+        log_odds[flat] = np.clip(log_odds[flat] + hit, -LOG_ODDS_BOUND, LOG_ODDS_BOUND)
+        if self.transfer is not None:
+            shift, floor, ceiling = (grid.ravel() for grid in self.transfer)
+            shift[flat] += hit
+            floor[flat] = np.clip(floor[flat] + hit, -LOG_ODDS_BOUND, LOG_ODDS_BOUND)
+            ceiling[flat] = np.clip(ceiling[flat] + hit, -LOG_ODDS_BOUND, LOG_ODDS_BOUND)
+
+    def refresh(self, cells, was_navigable, rock_flat, rock_hit):
+        # Add rock evidence and refresh the worldmap where the grid changed
+        log_odds = self.log_odds.ravel()
+        rock_evidence = self.rock_evidence.ravel()
+        is_navigable = log_odds[cells] > 0
+
+        had_rock = rock_evidence[rock_flat] > 0
+        rock_evidence[rock_flat] += rock_hit
+        new_rock_cells = rock_flat[~had_rock & (rock_evidence[rock_flat] > 0)]
+
+        worldmap = self.worldmap.reshape(-1, 3)
+        worldmap[cells, 0] = 255*(log_odds[cells] < 0)
+        worldmap[cells, 2] = 255*is_navigable
+        worldmap[new_rock_cells, 1] = 255
+
+        return MapUpdate(cells, was_navigable, is_navigable, new_rock_cells)
+
+    def is_navigable(self, x, y):
+        """Return whether world cell (x, y) is more likely navigable."""
+        return self.log_odds[y, x] > 0
+
+    def probability(self, x, y):
+        """Return the probability that world cell (x, y) is navigable."""
+        return 1./(1. + np.exp(-self.log_odds[y, x]/LOG_ODDS_SCALE))
+
+
+class MapStats():
+    """
+    Mapped and fidelity percentages against the ground truth map.
+
+    Counts of navigable cells are kept up to date from each MapUpdate,
+    so the cost is proportional to the cells written in a frame rather
+    than to the size of the map.
+
+    """
+
+    def __init__(self, ground_truth):
+        # ground_truth: 2D map, nonzero where the terrain is navigable
+        self.truth = np.ravel(ground_truth) > 0
+        self.tot_map_pix = int(np.count_nonzero(self.truth))
+        self.tot_nav_pix = 0  # Cells mapped as navigable
+        self.good_nav_pix = 0  # Of those, cells navigable in ground truth
+
+    def update(self, map_update):
+        change = (map_update.is_navigable.astype(np.int8)
+                  - map_update.was_navigable)
+        changed = change != 0
+        change = change[changed]
+        self.tot_nav_pix += int(change.sum())
+        self.good_nav_pix += int(change[self.truth[map_update.cells[changed]]].sum())
+
+    @property
+    def bad_nav_pix(self):
+        return self.tot_nav_pix - self.good_nav_pix
+
+    @property
+    def perc_mapped(self):
+        # Percentage of the ground truth map successfully found
+        return round(100*self.good_nav_pix/self.tot_map_pix, 1)
+
+    @property
+    def fidelity(self):
+        # Percentage of cells mapped as navigable that are navigable
+        if self.tot_nav_pix > 0:
+            return round(100*self.good_nav_pix/self.tot_nav_pix, 1)
+        return 0
@@ -0,0 +1,66 @@
+"""
+Background rendering of the inset images sent back to the simulator.
+
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from supporting_functions import snapshot_output_state, render_output_images
+
+
+class OutputRenderer():
+    """
+    Renders and encodes the map/vision insets off the telemetry loop.
+
+    The telemetry handler sends its control command with the latest
+    finished images, then calls submit() to hand over a snapshot of the
+    Rover. Renders are throttled to rate (Hz) and at most one is in
+    flight: snapshots offered while the worker is busy are dropped rather
+    than queued, so the worker can never fall behind the simulator.
+
+    The worker is a plain OS thread; the event loop only ever polls the
+    pending future, so it never blocks on it.
+
+    """
+
+    def __init__(self, rate=5.0, executor=None, profiler=None):
+        self.period = 1./rate if rate > 0 else 0.
+        self.executor = executor or ThreadPoolExecutor(max_workers=1)
+        self.pending = None  # Future of the render in flight
+        self.last_submit = float('-inf')
+        self.latest = ('', '')  # Latest encoded (map, vision) images
+        self.dropped = 0  # Snapshots skipped because the worker was busy
+        self.profiler = profiler  # Optional StageProfiler timing the renders
+
+    def poll(self):
+        """Return the latest encoded images, collecting a finished render."""
+        if self.pending is not None and self.pending.done():
+            future, self.pending = self.pending, None
+            try:
+                self.latest = future.result()
+            except Exception as error:
+                print("Output rendering failed:", error)
+        return self.latest
+
+    def submit(self, Rover):
+        """Start rendering the current Rover state if a render is due."""
+        self.poll()
+        now = time.monotonic()
+        if now - self.last_submit < self.period:
+            return
+        if self.pending is not None:
+            self.dropped += 1
+            return
+        self.last_submit = now
+        self.pending = self.executor.submit(self.render,
+                                            snapshot_output_state(Rover))
+
+    def render(self, snapshot):
+        # Runs on the worker thread
+        if self.profiler is None:
+            return render_output_images(snapshot)
+        with self.profiler.stage('create_output_images'):
+            return render_output_images(snapshot)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,137 @@
+"""
+Offline mapping of recorded runs on a pool of processes.
+
+The frames of one or more robot logs are split into chunks. Each worker
+maps its chunks with the batched perception into a private occupancy
+grid and writes its integer log-odds transfer and rock evidence into its
+slot of a shared memory block, so no map is pickled back. The driver
+merges the slots in frame order into the final map, which is identical
+to mapping every frame in one process.
+Run from the code directory:
+
+    python parallel_mapping.py ../test_dataset/robot_log.csv --processes 4
+
+"""
+
+
+import os
+import json
+import time
+import argparse
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from replay import read_log, map_rows, map_report
+from perception import apply_map_update
+from rover_state import RoverState
+
+
+WORLD_SIZE = 200
+
+# Attached by each worker process to the shared block of partial grids
+_shared = None
+_partials = None
+
+
+def partials_shape(chunks):
+    # One (shift, floor, ceiling, rock_evidence) set of int32 grids per chunk
+    return (chunks, 4, WORLD_SIZE, WORLD_SIZE)
+
+
+def attach_partials(name, shape):
+    # Pool initializer: map the shared block into this worker
+    global _partials, _shared
+    _shared = SharedMemory(name=name)
+    _partials = np.ndarray(shape, dtype=np.int32, buffer=_shared.buf)
+
+
+def map_chunk(task):
+    """Worker: map the rows of one chunk into its slot of the partial grids."""
+    chunk, rows, batch_size = task
+    Rover = RoverState()
+    Rover.occupancy.track_transfer()
+    frames = map_rows(rows, Rover, batch_size, workers=1)
+    _partials[chunk, :3] = Rover.occupancy.transfer
+    _partials[chunk, 3] = Rover.occupancy.rock_evidence
+    return frames
+
+
+def split_chunks(rows, chunk_size):
+    return [rows[start:start + chunk_size] for start in range(0, len(rows), chunk_size)]
+
+
+def map_logs(log_paths, processes=None, chunk_size=None, batch_size=64,
+             Rover=None):
+    """
+    Map every frame of the given robot logs into Rover with a process pool.
+
+    Logs are read in order and split into chunks of chunk_size frames
+    (by default enough for four chunks per process, to balance the load).
+    Returns a report with the frame count, timings and map quality.
+
+    """
+    Rover = Rover or RoverState()
+    processes = processes or os.cpu_count() or 1
+    rows = [row for log_path in log_paths for row in read_log(log_path)]
+    if not rows:
+        return map_report(Rover, 0, 0.)
+    chunk_size = chunk_size or max(1, -(-len(rows)//(4*processes)))
+    chunks = split_chunks(rows, chunk_size)
+
+    start = time.perf_counter()
+    shape = partials_shape(len(chunks))
+    shared = SharedMemory(create=True, size=int(np.prod(shape))*4)
+    try:
+        partials = np.ndarray(shape, dtype=np.int32, buffer=shared.buf)
+        with Pool(processes, initializer=attach_partials,
+                  initargs=(shared.name, shape)) as pool:
+            tasks = [(chunk, chunk_rows, batch_size)
+                     for chunk, chunk_rows in enumerate(chunks)]
+            frames = sum(pool.imap_unordered(map_chunk, tasks))
+        # Log-odds saturate, so the chunks are merged in frame order
+        for partial in partials:
+            apply_map_update(Rover, Rover.occupancy.merge(*partial))
+        del partial, partials
+    finally:
+        shared.close()
+        shared.unlink()
+
+    report = map_report(Rover, frames, time.perf_counter() - start)
+    report['processes'] = processes
+    report['chunks'] = len(chunks)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Map recorded runs in parallel')
+    parser.add_argument('logs', nargs='*', default=['../test_dataset/robot_log.csv'],
+                        help='robot_log.csv files of the runs to map together.')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Worker processes (default: one per core).')
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help='Frames per work item.')
+    parser.add_argument('--batch', type=int, default=64,
+                        help='Frames per perception_batch call.')
+    parser.add_argument('--worldmap', default=None,
+                        help='Save the resulting worldmap to this .npy file.')
+    parser.add_argument('--json', default=None,
+                        help='Write the report to this JSON file.')
+    args = parser.parse_args()
+
+    Rover = RoverState()
+    report = map_logs(args.logs, processes=args.processes,
+                      chunk_size=args.chunk_size, batch_size=args.batch,
+                      Rover=Rover)
+    print('Frames mapped:     {} in {} chunks on {} processes'.format(
+        report['frames'], report['chunks'], report['processes']))
+    print('Wall time:         {:.2f} s ({:.1f} FPS)'.format(
+        report['wall_time_s'], report['fps']))
+    print('Mapped:            {}%'.format(report['perc_mapped']))
+    print('Fidelity:          {}%'.format(report['fidelity']))
+    if args.worldmap:
+        np.save(args.worldmap, Rover.worldmap)
+    if args.json:
+        with open(args.json, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
@@ -1,10 +1,44 @@
 from collections import namedtuple
+from functools import lru_cache
 
 import numpy as np
 import cv2
 
+from occupancy import reading_confidence, MIN_CONFIDENCE
+from clearance import steering_clearance
 
-def rock_thresh(img, low_levels=(130, 105, 0),high_levels=(220,190,70)):
+
+# Camera calibration: the source trapezoid in the rover camera image and the
+# size/offset of the 1 m x 1 m destination square in the overhead view
+CALIB_SRC = np.float32([[14, 140], [300, 140], [200, 96], [118, 96]])
+DST_SIZE = 5
+BOTTOM_OFFSET = 6
+
+# Class bits of the label image built by PixelClassifier. Pixels in the
+# camera field of view are either navigable or obstacle, rocks are also
+# obstacles, and out-of-view pixels keep label 0.
+NAVIGABLE = 1
+OBSTACLE = 2
+ROCK = 4
+
+# Only pixels closer than these distances (in warped-image pixels) from the
+# rover are mapped, since the perspective warp gets unreliable further out
+DISTANCE_LIMITS = {NAVIGABLE: 60, OBSTACLE: 80, ROCK: 70}
+
+# Color thresholds: navigable terrain is brighter than NAVIGABLE_THRESH in
+# every channel, rock samples lie strictly between the ROCK levels
+NAVIGABLE_THRESH = (160, 160, 160)
+ROCK_LOW_LEVELS = (130, 105, 0)
+ROCK_HIGH_LEVELS = (220, 190, 70)
+
+# Vision image color of every label: obstacles red, rocks green,
+# navigable terrain blue
+VISION_COLORS = np.float32([
+    [255 * bool(label & OBSTACLE), 255 * bool(label & ROCK),
+     255 * bool(label & NAVIGABLE)] for label in range(8)])
+
+
+def rock_thresh(img, low_levels=ROCK_LOW_LEVELS, high_levels=ROCK_HIGH_LEVELS):
     rockpix = ( (img[:,:,0] > low_levels[0])\
             & (img[:,:,1] > low_levels[1])  \
             & (img[:,:,2] > low_levels [2]) \
@@ -17,7 +51,7 @@ def rock_thresh(img, low_levels=(130, 105, 0),high_levels=(220,190,70)):
     return color_select
 
 
-def color_thresh(img, rgb_thresh=(160, 160, 160)):
+def color_thresh(img, rgb_thresh=NAVIGABLE_THRESH):
     # Create an array of zeros same xy size as img, but single channel
     color_select = np.zeros_like(img[:, :, 0])
     # Require that each pixel be above all three threshold values in RGB
@@ -32,6 +66,71 @@ def color_thresh(img, rgb_thresh=(160, 160, 160)):
     return color_select
 
 
+class PixelClassifier():
+    """
+    Single-pass pixel classifier backed by per-channel lookup tables.
+
+    The navigable and rock tests are both per-channel range checks
+    ANDed across R, G and B, so a 256-entry table of class bits for each
+    channel gives exactly the color_thresh/rock_thresh results.
+
+    The work buffers grow to the tallest image classified, so one
+    classifier serves stacks of any number of frames.
+
+    """
+
+    def __init__(self, img_shape, rgb_thresh, low_levels, high_levels):
+        levels = np.arange(256)
+        self.luts = []
+        for channel in range(3):
+            navigable = levels > rgb_thresh[channel]
+            rock = ((levels > low_levels[channel])
+                    & (levels < high_levels[channel]))
+            self.luts.append(np.uint8(NAVIGABLE * navigable | ROCK * rock))
+
+        self.allocate(img_shape)
+
+    def allocate(self, img_shape):
+        self.planes = [np.zeros(img_shape[:2], dtype=np.uint8) for _ in range(3)]
+        self.labels = np.zeros(img_shape[:2], dtype=np.uint8)
+        self.obstacle = np.zeros(img_shape[:2], dtype=np.uint8)
+
+    def classify(self, warped, mask):
+        rows = warped.shape[0]
+        if rows > self.labels.shape[0]:
+            self.allocate(warped.shape)
+        # Look up the class bits of every channel and AND them together
+        planes = cv2.split(warped, [plane[:rows] for plane in self.planes])
+        for plane, lut in zip(planes, self.luts):
+            cv2.LUT(plane, lut, dst=plane)
+        labels = cv2.bitwise_and(planes[0], planes[1], dst=self.labels[:rows])
+        cv2.bitwise_and(labels, planes[2], dst=labels)
+
+        # Obstacles are pixels in the field of view that are not navigable
+        # (mask is 0/1, so the saturating subtraction gives mask & ~navigable)
+        obstacle = cv2.bitwise_and(labels, NAVIGABLE, dst=self.obstacle[:rows])
+        cv2.subtract(mask, obstacle, dst=obstacle)
+        cv2.multiply(obstacle, OBSTACLE, dst=obstacle)
+        return cv2.bitwise_or(labels, obstacle, dst=labels)
+
+
+_pixel_classifiers = {}
+
+
+def classify_pixels(warped, mask, rgb_thresh=NAVIGABLE_THRESH,
+                    low_levels=ROCK_LOW_LEVELS, high_levels=ROCK_HIGH_LEVELS):
+    # Label image of the warped view using the cached classifier for
+    # this image width and these thresholds (a stack of frames is one
+    # tall image). The returned array is reused on the next call.
+    key = (warped.shape[1:], tuple(rgb_thresh), tuple(low_levels), tuple(high_levels))
+    classifier = _pixel_classifiers.get(key)
+    if classifier is None:
+        classifier = PixelClassifier(warped.shape, rgb_thresh,
+                                     low_levels, high_levels)
+        _pixel_classifiers[key] = classifier
+    return classifier.classify(warped, mask)
+
+
 def perspect_transform(img, src, dst):
     M = cv2.getPerspectiveTransform(src, dst)
     warped = cv2.warpPerspective(img, M, (img.shape[1], img.shape[0]))  # keep same size as input image
@@ -40,6 +139,53 @@ def perspect_transform(img, src, dst):
     return warped, mask
 
 
+def calibration_dst(img_shape, dst_size=DST_SIZE, bottom_offset=BOTTOM_OFFSET):
+    # Destination points of the calibration square for an image of img_shape
+    rows, cols = img_shape[0], img_shape[1]
+    return np.float32([
+        [cols / 2 - dst_size, rows - bottom_offset],
+        [cols / 2 + dst_size, rows - bottom_offset],
+        [cols / 2 + dst_size, rows - 2 * dst_size - bottom_offset],
+        [cols / 2 - dst_size, rows - 2 * dst_size - bottom_offset]])
+
+
+class WarpContext():
+    """
+    Perspective warp calibrated once for a fixed image size.
+
+    Holds the homography, the field-of-view mask and the output
+    buffer so every frame costs a single warpPerspective call.
+
+    """
+
+    def __init__(self, img_shape, dtype, src, dst):
+        self.size = (img_shape[1], img_shape[0])
+        self.M = cv2.getPerspectiveTransform(src, dst)
+        self.mask = cv2.warpPerspective(np.ones(img_shape[:2], dtype=dtype),
+                                        self.M, self.size)
+        self.warped = np.zeros(img_shape, dtype=dtype)
+        self.rois = {}  # MappingROI of this calibration, by crop flag
+
+    def warp(self, img):
+        # Warp into the preallocated buffer, which is reused on every call
+        return cv2.warpPerspective(img, self.M, self.size, dst=self.warped)
+
+
+_warp_contexts = {}
+
+
+def get_warp_context(img, src=CALIB_SRC, dst=None):
+    # Return the cached WarpContext for this image size and calibration
+    if dst is None:
+        dst = calibration_dst(img.shape)
+    key = (img.shape, img.dtype.str, src.tobytes(), dst.tobytes())
+    context = _warp_contexts.get(key)
+    if context is None:
+        context = WarpContext(img.shape, img.dtype, src, dst)
+        _warp_contexts[key] = context
+    return context
+
+
 def rover_coords(binary_img):
     # Identify nonzero pixels
     ypos, xpos = binary_img.nonzero()
@@ -61,6 +207,105 @@ def to_polar_coords(x_pixel, y_pixel):
     return dist, angles
 
 
+class PolarGrid():
+    """
+    Rover-frame geometry of every pixel of the warped image.
+
+    The warped image grid never changes, so the rover-frame x/y, distance
+    and angle of each pixel are computed once and a frame only gathers
+    the entries of its classified pixels. Arrays are flattened row-major,
+    matching the order of nonzero() on the label image.
+
+    """
+
+    def __init__(self, img_shape, limits=DISTANCE_LIMITS):
+        self.x, self.y = rover_coords(np.ones(img_shape[:2], dtype=np.uint8))
+        self.dists, self.angles = to_polar_coords(self.x, self.y)
+        self.points = np.column_stack((self.x, self.y))
+
+        # Class bits of the pixels within each class' mapping distance limit
+        self.in_range = np.zeros(self.dists.shape, dtype=np.uint8)
+        for flag, limit in limits.items():
+            self.in_range[self.dists < limit] |= flag
+
+        self.selected = np.zeros(self.dists.shape, dtype=np.uint8)
+
+    def pixels(self, labels, flag, limited=False):
+        # Flat indices of the pixels labeled with flag, optionally only
+        # those within the mapping distance limit of that class
+        selected = np.bitwise_and(labels.ravel(), flag, out=self.selected)
+        if limited:
+            np.bitwise_and(selected, self.in_range, out=selected)
+        return np.flatnonzero(selected)
+
+
+_polar_grids = {}
+
+
+def get_polar_grid(img_shape):
+    # Return the cached PolarGrid for this warped image shape
+    grid = _polar_grids.get(img_shape[:2])
+    if grid is None:
+        grid = PolarGrid(img_shape)
+        _polar_grids[img_shape[:2]] = grid
+    return grid
+
+
+class MappingROI():
+    """
+    Crop of the warped image holding every pixel that can be mapped.
+
+    Only pixels in the camera view and within the distance limit of some
+    class are ever projected to the world, so the mapping steps work on
+    views of the label image cropped to their bounding box, which is
+    computed once per calibration. The polar grid geometry is cropped
+    the same way. Flat indices are row-major within the crop, so pixels
+    come out in the same order as from the full image. With crop=False
+    the ROI is the full image (the reference path).
+
+    """
+
+    def __init__(self, mask, grid, crop=True):
+        rows, cols = mask.shape[:2]
+        if crop:
+            mappable = (mask > 0) & (grid.in_range.reshape(rows, cols) > 0)
+            row_idx = np.flatnonzero(mappable.any(axis=1))
+            col_idx = np.flatnonzero(mappable.any(axis=0))
+            # Keep the bottom row, where the rover sits, so rover-frame
+            # coordinates can still be measured from the bottom of the crop
+            self.rows = slice(row_idx[0], rows)
+            self.cols = slice(col_idx[0], col_idx[-1] + 1)
+        else:
+            self.rows, self.cols = slice(0, rows), slice(0, cols)
+        self.origin = (self.rows.start, self.cols.start)
+
+        self.in_range = np.ascontiguousarray(self.crop(grid.in_range.reshape(rows, cols)))
+        self.angles = self.crop(grid.angles.reshape(rows, cols)).ravel()
+        self.points = self.crop(grid.points.reshape(rows, cols, 2)).reshape(-1, 2)
+        self.shape = self.in_range.shape
+        self.selected = np.zeros(self.shape, dtype=np.uint8)
+
+    def crop(self, image):
+        # View of the ROI of a full-size image
+        return image[self.rows, self.cols]
+
+    def pixels(self, labels, flag):
+        # Flat ROI indices of the pixels of a full-size label image that
+        # are labeled with flag and within that class' distance limit
+        selected = np.bitwise_and(self.crop(labels), flag, out=self.selected)
+        np.bitwise_and(selected, self.in_range, out=selected)
+        return np.flatnonzero(selected)
+
+
+def get_mapping_roi(warp_context, grid, crop=True):
+    # Return the MappingROI of this calibration, cached in its WarpContext
+    roi = warp_context.rois.get(crop)
+    if roi is None:
+        roi = MappingROI(warp_context.mask, grid, crop)
+        warp_context.rois[crop] = roi
+    return roi
+
+
 def rotate_pixels(pixels, angle):
     
     deg2rad = np.pi/180.
@@ -102,94 +347,300 @@ def inv_translate_pixels(pixels, translation, scale_factor=10):
 
     return x_pixels_translated,y_pixels_translated
 
-def pix_to_world(pixels_rover, rover_pos, rover_yaw, world_size=200):
-    
-    # Apply rotation and translation
-    pixels_rotated = rotate_pixels(pixels_rover, rover_yaw)
-    pixels_translated_x, pixels_translated_y = translate_pixels(pixels_rotated, rover_pos)
+@lru_cache(maxsize=8)
+def rotation_matrix(yaw):
+    # 2x2 rotation for a yaw angle in degrees, cached since every class
+    # of pixel in a frame is projected with the same yaw
+    deg2rad = np.pi/180.
+    yaw_rad = yaw*deg2rad
+    cos_yaw, sin_yaw = np.cos(yaw_rad), np.sin(yaw_rad)
+    rotation = np.array([[cos_yaw, -sin_yaw], [sin_yaw, cos_yaw]])
+    rotation.setflags(write=False)
+    return rotation
+
+
+def rover_to_world(points, rover_pos, rover_yaw, world_size=200,
+                   scale_factor=10, out=None, work=None):
+    """
+    Map (N, 2) rover-frame pixel points to clipped integer world cells.
+
+    Rotation, translation, truncation and clipping are applied in one
+    pass. out (N, 2 integer) and work (N, 2 float64) are optional
+    preallocated buffers; the result is written into out.
+
+    """
+    rotation = rotation_matrix(rover_yaw)
+    if work is None:
+        work = np.empty(points.shape, dtype=np.float64)
+    if out is None:
+        out = np.empty(points.shape, dtype=np.intp)
+
+    x_pixels, y_pixels = points[:, 0], points[:, 1]
+    x_world, y_world = work[:, 0], work[:, 1]
+    # Rotate (kept as x*cos - y*sin etc. so results match rotate_pixels)
+    np.multiply(y_pixels, rotation[1, 0], out=y_world)
+    np.multiply(x_pixels, rotation[0, 0], out=x_world)
+    np.subtract(x_world, y_world, out=x_world)
+    np.multiply(x_pixels, rotation[1, 0], out=y_world)
+    y_world += y_pixels*rotation[1, 1]
+    # Scale and translate
+    np.divide(work, scale_factor, out=work)
+    np.add(work, rover_pos[:2], out=work)
+
+    # Truncate to integer cells like np.int_ and clip to the world size
+    np.copyto(out, work, casting='unsafe')
+    return np.clip(out, 0, world_size - 1, out=out)
+
+
+def world_to_rover(points, rover_pos, rover_yaw, scale_factor=10, out=None):
+    """
+    Map (N, 2) world points to rover-frame pixel points.
+
+    Inverse of rover_to_world without the binning. out is an optional
+    preallocated (N, 2) float64 buffer.
+
+    """
+    rotation = rotation_matrix(rover_yaw)
+    if out is None:
+        out = np.empty(np.shape(points), dtype=np.float64)
+
+    # Inverse translate and scale
+    np.subtract(points, rover_pos[:2], out=out)
+    np.multiply(out, scale_factor, out=out)
+    # Inverse rotate with the transposed rotation matrix
+    x_pixels, y_pixels = out[:, 0].copy(), out[:, 1]
+    np.multiply(x_pixels, rotation[0, 0], out=out[:, 0])
+    out[:, 0] += y_pixels*rotation[1, 0]
+    np.multiply(y_pixels, rotation[1, 1], out=y_pixels)
+    y_pixels -= x_pixels*rotation[1, 0]
+    return out
+
+
+class WorldProjector():
+    """
+    Reusable buffers for projecting a frame's pixels into the world map.
+
+    Buffers grow to the largest frame seen, so steady-state frames
+    project without allocating.
+
+    """
+
+    def __init__(self, world_size=200, scale_factor=10):
+        self.world_size = world_size
+        self.scale_factor = scale_factor
+        self.points = np.empty((0, 2), dtype=np.float32)
+        self.work = np.empty((0, 2), dtype=np.float64)
+        self.cells = np.empty((0, 2), dtype=np.intp)
+
+    def reserve(self, count):
+        # Grow the buffers (geometrically) to hold at least count points
+        if count > len(self.cells):
+            count = max(count, 2*len(self.cells))
+            self.points = np.empty((count, 2), dtype=np.float32)
+            self.work = np.empty((count, 2), dtype=np.float64)
+            self.cells = np.empty((count, 2), dtype=np.intp)
+
+    def project(self, grid_points, pixel_idx, rover_pos, rover_yaw):
+        # Gather the (N, 2) rover-frame points of the given pixels and map
+        # them to world cells. The result is valid until the next call.
+        count = len(pixel_idx)
+        self.reserve(count)
+        points = np.take(grid_points, pixel_idx, axis=0, out=self.points[:count])
+        return rover_to_world(points, rover_pos, rover_yaw, self.world_size,
+                              self.scale_factor, out=self.cells[:count],
+                              work=self.work[:count])
+
+
+_world_projector = WorldProjector()
+
+
+def frames_to_world(points, frame_idx, rover_pos, rover_yaw, world_size=200,
+                    scale_factor=10):
+    """
+    Map (N, 2) rover-frame points seen from several frames to world cells.
+
+    Point i was seen from frame frame_idx[i], whose pose is rover_pos
+    (F, 2) and rover_yaw (F,). Gives the same cells as rover_to_world
+    applied frame by frame.
+
+    """
+    # Per-frame rotations from the same cache as rover_to_world, so the
+    # sines and cosines are bit-identical
+    rotations = np.array([rotation_matrix(yaw) for yaw in rover_yaw])
+    cos_yaw = rotations[frame_idx, 0, 0]
+    sin_yaw = rotations[frame_idx, 1, 0]
+
+    x_pixels, y_pixels = points[:, 0], points[:, 1]
+    work = np.empty(points.shape, dtype=np.float64)
+    work[:, 0] = x_pixels*cos_yaw - y_pixels*sin_yaw
+    work[:, 1] = x_pixels*sin_yaw + y_pixels*cos_yaw
+    np.divide(work, scale_factor, out=work)
+    work += np.asarray(rover_pos, dtype=np.float64)[frame_idx, :2]
+
+    out = np.empty(points.shape, dtype=np.intp)
+    np.copyto(out, work, casting='unsafe')
+    return np.clip(out, 0, world_size - 1, out=out)
 
-    # Clip pixels to be within world size
-    x_pixels_world = np.clip(np.int_(pixels_translated_x), 0, world_size-1)
-    y_pixels_world = np.clip(np.int_(pixels_translated_y), 0, world_size-1)
 
-    return x_pixels_world, y_pixels_world
+def pix_to_world(pixels_rover, rover_pos, rover_yaw, world_size=200):
+    
+    # Apply rotation and translation, then clip to be within world size
+    points = np.column_stack(pixels_rover)
+    cells = rover_to_world(points, rover_pos, rover_yaw, world_size)
+    return cells[:, 0], cells[:, 1]
 
 
 def pix_to_rover(pixels_world, rover_pos, rover_yaw):
     
     # Apply inverse translation and rotation
-    pixels_rotated = inv_translate_pixels(pixels_world, rover_pos)
-    pixels_rover = inv_rotate_pixels(pixels_rotated, rover_yaw)
-
-    return pixels_rover
+    points = world_to_rover(np.column_stack(pixels_world), rover_pos, rover_yaw)
+    return points[:, 0], points[:, 1]
 
 
-def perception_step(Rover, R=0, G=1, B=2):
+def perception_step(Rover, R=0, G=1, B=2, crop=True):
     
     img = Rover.img
-    dst_size = 5
-    bottom_offset = 6
-
-    src = np.float32([[14, 140], [300, 140], [200, 96], [118, 96]])
-    dst = np.float32([
-        [img.shape[1] / 2 - dst_size, img.shape[0] - bottom_offset],
-        [img.shape[1] / 2 + dst_size, img.shape[0] - bottom_offset],
-        [img.shape[1] / 2 + dst_size, img.shape[0] - 2 * dst_size - bottom_offset],
-        [img.shape[1] / 2 - dst_size, img.shape[0] - 2 * dst_size - bottom_offset]])
     # Apply perspective transform to get 2D overhead view of rover cam
-    warped_img , mask = perspect_transform(img=img, src=src, dst=dst)
+    # (homography and mask are calibrated once per image size)
+    warp_context = get_warp_context(img)
+    warped_img = warp_context.warp(img)
+    mask = warp_context.mask
 
     Rover.vision_warped = warped_img
     Rover.vision_mask = mask
-    # Apply color thresholds to extract pixels of navigable/obstacles/rocks
-    navigable_pixels = color_thresh(warped_img)
-    Rover.vision_threshed = navigable_pixels
-    obstacle_pixels = np.abs(np.float32(navigable_pixels) - 1) * mask
-    rock_pixels = rock_thresh(img=warped_img)
+    # Label navigable/obstacle/rock pixels in a single classification pass
+    labels = classify_pixels(warped_img, mask)
+    Rover.vision_threshed = labels & NAVIGABLE
 
     # Update rover vision image with each ROI assigned to one of
     # the RGB color channels (to be displayed on left side of sim screen)
-    Rover.vision_image[:, :, R] = obstacle_pixels * 255
-    Rover.vision_image[:, :, G] = rock_pixels * 255
-    Rover.vision_image[:, :, B] = navigable_pixels * 255
-
-    # Transform pixel coordinates from perspective frame to rover frame
-    x_nav, y_nav = rover_coords(binary_img=navigable_pixels)
-    x_obs, y_obs = rover_coords(binary_img=obstacle_pixels)
-    x_rock, y_rock = rover_coords(binary_img=rock_pixels)
-
-    Rover.x_nav = x_nav
-    Rover.y_nav = y_nav
-
-    # Convert above cartesian coordinates to polar coordinates
-    Rover.nav_dists, Rover.nav_angles = to_polar_coords( x_nav, y_nav)
-    Rover.obs_dists, Rover.obs_angles = to_polar_coords(x_obs, y_obs)
-    Rover.rock_dists = to_polar_coords(x_rock, y_rock)[0]
+    vision_colors = VISION_COLORS[:, np.argsort((R, G, B))]
+    np.take(vision_colors, labels, axis=0, out=Rover.vision_image)
+
+    # Look up rover-frame coordinates of the classified pixels in the
+    # precomputed polar grid instead of recomputing them every frame
+    grid = get_polar_grid(labels.shape)
+    nav_idx = grid.pixels(labels, NAVIGABLE)
+    obs_idx = grid.pixels(labels, OBSTACLE)
+    rock_idx = grid.pixels(labels, ROCK)
+
+    # Gather into the Rover's preallocated buffers (views valid for
+    # this frame only)
+    buffers = Rover.buffers
+    Rover.x_nav = buffers.take('x_nav', grid.x, nav_idx)
+    Rover.y_nav = buffers.take('y_nav', grid.y, nav_idx)
+
+    Rover.nav_dists = buffers.take('nav_dists', grid.dists, nav_idx)
+    Rover.nav_angles = buffers.take('nav_angles', grid.angles, nav_idx)
+    Rover.obs_dists = buffers.take('obs_dists', grid.dists, obs_idx)
+    Rover.obs_angles = buffers.take('obs_angles', grid.angles, obs_idx)
+    Rover.rock_dists = buffers.take('rock_dists', grid.dists, rock_idx)
     # Extract subset of nav_angles that are left of rover angle
-    Rover.nav_angles_left = Rover.nav_angles[Rover.nav_angles > 0]
-
-    # Only include pixels within certain distances from rover (for fidelity)
-    nav_pixels_rover = [pts[Rover.nav_dists < 60] for pts in (x_nav, y_nav)]
-    obs_pixels_rover = [pts[Rover.obs_dists < 80] for pts in (x_obs, y_obs)]
-    rock_pixels_rover = [pts[Rover.rock_dists < 70] for pts in (x_rock, y_rock)]
-
-    # Convert rock cartesian coords to polar coords
-    rock_pixels_rover_x, rock_pixels_rover_y = rock_pixels_rover
-    Rover.rock_angles = to_polar_coords(rock_pixels_rover_x, rock_pixels_rover_y)[1]
-
-    # Transform pixel points of ROIs from rover frame to world frame
-    nav_pixels_world_x,nav_pixels_world_y = pix_to_world(nav_pixels_rover, Rover.pos, Rover.yaw)
-    obs_pixels_world_x,obs_pixels_world_y = pix_to_world(obs_pixels_rover, Rover.pos, Rover.yaw)
-    rock_pixels_world_x,rock_pixels_world_y = pix_to_world(rock_pixels_rover, Rover.pos, Rover.yaw)
-
-    # Only update worldmap (displayed on right) if rover has a stable drive
-    # High pitch/rolls cause inaccurate 3D to 2D mapping and low fidelity
-    is_stable = ((Rover.pitch > 359 or Rover.pitch < 0.25)
-                 and (Rover.roll > 359 or Rover.roll < 0.37))
-    
-    if is_stable:  # Update map with each ROI assigned to an RGB color channel
-        Rover.worldmap[obs_pixels_world_y, obs_pixels_world_x, R] = 255
-        Rover.worldmap[rock_pixels_world_y, rock_pixels_world_x, G] = 255
-        Rover.worldmap[nav_pixels_world_y, nav_pixels_world_x, B] = 255
+    Rover.nav_angles_left = buffers.compress('nav_angles_left',
+                                             Rover.nav_angles > 0, Rover.nav_angles)
+    # Free distance along each steering angle (view valid for this frame)
+    Rover.clearance = steering_clearance(labels, OBSTACLE, crop=crop)
+
+    # Only include pixels within certain distances from rover (for fidelity),
+    # selected within the ROI of the label image that can be mapped
+    roi = get_mapping_roi(warp_context, grid, crop)
+    nav_idx = roi.pixels(labels, NAVIGABLE)
+    obs_idx = roi.pixels(labels, OBSTACLE)
+    rock_idx = roi.pixels(labels, ROCK)
+    Rover.rock_angles = buffers.take('rock_angles', roi.angles, rock_idx)
+
+    # High pitch/rolls cause inaccurate 3D to 2D mapping, so such frames
+    # are weighted down in the sample tracks and the occupancy grid
+    confidence = reading_confidence(Rover.pitch, Rover.roll)
+    # Follow the in-range rock blobs in the world frame
+    if Rover.sample_tracker is not None:
+        Rover.sample_tracker.update(rock_idx, roi.shape, Rover.pos, Rover.yaw,
+                                    roi.origin, confidence)
+
+    # Transform pixel points of all ROIs from rover frame to world frame
+    # in one stacked pass, then split the cells back per ROI
+    pixel_idx = np.concatenate((nav_idx, obs_idx, rock_idx))
+    world_cells = _world_projector.project(roi.points, pixel_idx,
+                                           Rover.pos, Rover.yaw)
+    nav_end = len(nav_idx)
+    obs_end = nav_end + len(obs_idx)
+
+    # Accumulate the observations into the occupancy grid behind the
+    # worldmap (displayed on right)
+    apply_map_update(Rover, Rover.occupancy.update(world_cells[:nav_end],
+                                                   world_cells[nav_end:obs_end],
+                                                   world_cells[obs_end:],
+                                                   confidence))
+
+    return Rover
+
+
+def apply_map_update(Rover, map_update):
+    """
+    Record a MapUpdate of Rover's occupancy grid and pass it on to the
+    structures kept up to date from it (map stats, located samples, the
+    home planner and the frontiers).
+
+    """
+    Rover.map_update = map_update
+    Rover.map_stats.update(map_update)
+    if Rover.rock_index is not None:
+        Rover.rock_index.update(map_update.new_rock_cells)
+    if Rover.planner is not None:
+        Rover.planner.update(map_update)
+    if Rover.frontiers is not None:
+        Rover.frontiers.update(map_update)
+
+
+def perception_batch(images, poses, Rover):
+    """
+    Map a stack of recorded frames into Rover's occupancy grid at once.
+
+    images is an (N, rows, cols, 3) uint8 stack and poses holds arrays
+    'pos' (N, 2), 'yaw', 'pitch' and 'roll' (N,), e.g. a dict or a
+    structured array. The frames are warped one by one and cropped to
+    the MappingROI, then classified, projected and accumulated as a
+    batch with a single scatter-add.
+    The resulting map, map stats and located samples are identical to
+    running perception_step on each frame in turn. The per-frame vision
+    outputs (vision_image, nav_angles, ...) are not updated.
+
+    """
+    confidences = np.array([reading_confidence(pitch, roll) for pitch, roll
+                            in zip(poses['pitch'], poses['roll'])])
+    # Gated frames add no evidence, so they are not processed at all
+    frames = np.flatnonzero(confidences >= MIN_CONFIDENCE)
+    if len(frames) == 0:
+        return Rover
+
+    # Warp every frame and stack the ROIs that can be mapped
+    warp_context = get_warp_context(images[0])
+    grid = get_polar_grid(images[0].shape)
+    roi = get_mapping_roi(warp_context, grid)
+    rows, cols = roi.shape
+    warped = np.empty((len(frames), rows, cols, 3), dtype=np.uint8)
+    frame_warped = np.empty_like(images[0])
+    for slot, frame in enumerate(frames):
+        cv2.warpPerspective(images[frame], warp_context.M, warp_context.size,
+                            dst=frame_warped)
+        warped[slot] = roi.crop(frame_warped)
+
+    # Classify the stack as one tall image
+    labels = classify_pixels(warped.reshape(-1, cols, 3),
+                             np.tile(roi.crop(warp_context.mask), (len(frames), 1)))
+    labels = labels.reshape(len(frames), -1)
+
+    # Pixels of each class within its distance limit, with their frame
+    in_range = labels & roi.in_range.ravel()
+    observations = []
+    for flag in (NAVIGABLE, OBSTACLE, ROCK):
+        slots, pixel_idx = np.nonzero(in_range & flag)
+        cells = frames_to_world(roi.points[pixel_idx], slots,
+                                np.asarray(poses['pos'])[frames],
+                                np.asarray(poses['yaw'])[frames])
+        observations.append((slots, cells))
+
+    apply_map_update(Rover, Rover.occupancy.update_batch(*observations,
+                                                         confidences[frames]))
 
     return Rover
@@ -0,0 +1,363 @@
+"""
+Grid path planning over the occupancy grid, used to drive back home.
+
+"""
+import math
+import time
+
+import numpy as np
+
+from occupancy import LOG_ODDS_SCALE, OBSTACLE_HIT
+
+
+# Cost of leaving a cell, per cell of distance travelled. Unknown cells
+# and cells with weak obstacle evidence are allowed but cost more, so
+# mapped terrain is preferred while it exists. Cells with at least
+# BLOCKED_LOG_ODDS of obstacle evidence are not entered at all.
+NAVIGABLE_COST = 1.0
+UNKNOWN_COST = 3.0
+UNCERTAIN_COST = 10.0
+BLOCKED_LOG_ODDS = 2*OBSTACLE_HIT*LOG_ODDS_SCALE  # Two full obstacle readings
+BLOCKED = math.inf
+
+SQRT2 = math.sqrt(2)
+
+
+def cell_costs(log_odds):
+    """Traversal cost of cells from their log-odds (BLOCKED for obstacles)."""
+    return np.select([log_odds > 0, log_odds == 0, log_odds > -BLOCKED_LOG_ODDS],
+                     [NAVIGABLE_COST, UNKNOWN_COST, UNCERTAIN_COST], BLOCKED)
+
+
+def octile_distance(shape, goal):
+    """Octile distance (cells) of every cell of a grid to a flat goal cell."""
+    goal_y, goal_x = divmod(goal, shape[1])
+    dy, dx = np.abs(np.indices(shape) - np.array([goal_y, goal_x])[:, None, None])
+    return np.maximum(dx, dy) + (SQRT2 - 1)*np.minimum(dx, dy)
+
+
+# (dx, dy, step length) of the 8-connected moves
+MOVES = ((1, 0, 1.), (-1, 0, 1.), (0, 1, 1.), (0, -1, 1.),
+         (1, 1, SQRT2), (1, -1, SQRT2), (-1, 1, SQRT2), (-1, -1, SQRT2))
+
+_STEPS = np.array([step for _, _, step in MOVES])
+
+# Finite stand-in for a blocked move inside the scans, far above the cost
+# of any path over the grid; totals past UNREACHABLE never lower a cell
+NO_MOVE = 1e6
+UNREACHABLE = NO_MOVE/2
+# Least decrease (cost units) that counts as a change when relaxing
+TOLERANCE = 1e-6
+
+
+def move_lines(shape, dx, dy):
+    """
+    Flat cells of a grid laid out along the lines of a move.
+
+    Every cell of a row of the returned array moves to the one before it,
+    and the first cell's move leaves the grid. Diagonal lines wrap around
+    the sides of the grid, where the move before the wrap leaves the grid
+    too, so the array holds every cell once.
+
+    """
+    height, width = shape
+    if dy:
+        steps = np.arange(height)
+        y = height - 1 - steps if dy > 0 else steps
+        x = (np.arange(width)[:, None] - dx*steps) % width
+    else:
+        steps = np.arange(width)
+        x = width - 1 - steps if dx > 0 else steps
+        y = np.arange(height)[:, None]
+    return y*width + x
+
+
+# Straight moves whose cells a move passes by (the move itself if straight)
+_SIDES = np.array([[MOVES.index((dx, 0, 1.)) if dx and dy else move,
+                    MOVES.index((0, dy, 1.)) if dx and dy else move]
+                   for move, (dx, dy, _) in enumerate(MOVES)]).T
+
+
+class GridLines():
+    """
+    Neighbours of the cells of a grid along each move, and the lines of
+    each move with the line and position of every cell in them.
+
+    """
+
+    def __init__(self, shape):
+        self.size = shape[0]*shape[1]
+        cells = np.arange(self.size)
+        y, x = np.divmod(cells, shape[1])
+        # One past the grid for moves leaving it
+        self.neighbours = np.empty((len(MOVES), self.size), dtype=np.intp)
+        for move, (dx, dy, _) in enumerate(MOVES):
+            inside = (0 <= x + dx) & (x + dx < shape[1]) & (0 <= y + dy) & (y + dy < shape[0])
+            self.neighbours[move] = np.where(inside, cells + dy*shape[1] + dx, self.size)
+
+        self.lines, self.line_of, self.position = [], [], []
+        for dx, dy, _ in MOVES:
+            lines = move_lines(shape, dx, dy)
+            line_of = np.empty(self.size, dtype=np.intp)
+            position = np.empty(self.size, dtype=np.intp)
+            line_of[lines] = np.arange(len(lines))[:, None]
+            position[lines] = np.arange(lines.shape[1])
+            self.lines.append(lines)
+            self.line_of.append(line_of)
+            self.position.append(position)
+
+
+_grid_lines = {}
+
+
+class CostToGo():
+    """
+    Cost of the cheapest path to a goal cell from every cell of a grid,
+    kept up to date as the cell costs change.
+
+    Moving from a cell to one of its 8 neighbours costs the step length
+    times the cost of the cell left; a diagonal move may not cut the
+    corner of a blocked cell. The field is relaxed with scans along the
+    lines of each move direction: a prefix minimum over a line carries a
+    change down its whole length at once, and only the lines through
+    cells that changed since the direction was last scanned are scanned
+    again.
+
+    Lower costs only need relaxing from the current field. Where the best
+    move of a cell got dearer, the cells whose cheapest path goes through
+    it are found by pointer jumping up the tree of best moves, reset and
+    relaxed again from the cells around them.
+
+    """
+
+    def __init__(self, shape, goal, cost=UNKNOWN_COST):
+        grid = _grid_lines.get(shape)
+        if grid is None:
+            grid = GridLines(shape)
+            _grid_lines[shape] = grid
+        self.grid = grid
+        self.size = grid.size
+        self.goal = goal
+        self.neighbours = grid.neighbours
+
+        # Cell costs, with one blocked entry past the grid, and the move
+        # costs out of every cell, also laid out along the lines of each
+        # move. Over a grid of equal costs the cost to go is the octile
+        # distance.
+        self.costs = np.append(np.full(self.size, cost), BLOCKED)
+        self.move_costs = np.empty((len(MOVES), self.size))
+        self.allowed = np.empty((len(MOVES), self.size), dtype=bool)
+        self.line_steps = [np.empty(lines.shape) for lines in grid.lines]
+        self.update_moves(np.arange(self.size))
+        self.g = np.append(cost*octile_distance(shape, goal).ravel(), BLOCKED)
+        # Best move of every cell (-1 for the goal and unreachable cells)
+        totals = self.move_costs + self.g[self.neighbours]
+        self.best = np.argmin(totals, axis=0)
+        self.best[goal] = -1
+
+    def update_moves(self, cells):
+        # Cost of every move out of cells, and whether it is allowed
+        # whatever the cost of the cell left
+        blocked = self.costs == BLOCKED
+        blocked[self.goal] = False  # The goal can always be entered
+        ends = blocked[self.neighbours[:, cells]]
+        allowed = ~(ends | ends[_SIDES[0]] | ends[_SIDES[1]])
+        self.allowed[:, cells] = allowed
+        self.move_costs[:, cells] = np.where(allowed, _STEPS[:, None]*self.costs[cells], BLOCKED)
+        steps = np.minimum(self.move_costs[:, cells], NO_MOVE)
+        for move, line_steps in enumerate(self.line_steps):
+            line_steps[self.grid.line_of[move][cells], self.grid.position[move][cells]] = steps[move]
+
+    def set_costs(self, cells, costs):
+        """
+        Set the costs of flat cells and update the field; return the number
+        of line scans it took.
+
+        """
+        self.costs[cells] = costs
+        # The moves of the cells and their neighbours may have changed
+        around = np.unique(np.append(self.neighbours[:, cells], cells))
+        around = around[around < self.size]
+        before = self.move_costs[:, around]
+        self.update_moves(around)
+        after = self.move_costs[:, around]
+        changed = np.zeros(self.size, dtype=bool)
+        changed[around[np.any(after != before, axis=0)]] = True
+
+        best = self.best[around]
+        has_best = best >= 0
+        columns = np.arange(len(around))
+        raised = np.zeros(len(around), dtype=bool)
+        raised[has_best] = (after[best[has_best], columns[has_best]]
+                            > before[best[has_best], columns[has_best]])
+        if raised.any():
+            # Reset every cell whose cheapest path goes through a cell whose
+            # best move got dearer
+            cells = np.arange(self.size)
+            parents = np.where(self.best >= 0, self.neighbours[self.best, cells], cells)
+            affected = np.zeros(self.size, dtype=bool)
+            affected[around[raised]] = True
+            while True:
+                reached = affected | affected[parents]
+                if np.array_equal(reached, affected):
+                    break
+                affected = reached
+                parents = parents[parents]
+            self.g[:self.size][affected] = BLOCKED
+            self.best[affected] = -1
+            changed |= affected
+        return self.relax(changed)
+
+    def relax(self, changed):
+        """
+        Relax the field from a mask of cells whose cost to go or moves
+        changed; return the number of line scans it took.
+
+        """
+        g, grid = self.g, self.grid
+        # Scan at which every cell last changed and each direction was
+        # last scanned. Only the lines through cells changed since a
+        # direction's last scan can improve, from the cell before them on.
+        changed_at = changed.astype(np.intp)
+        scanned_at = [0]*len(MOVES)
+        scans = 0
+        while True:
+            settled = True
+            for move in range(len(MOVES)):
+                cells = np.flatnonzero(changed_at > scanned_at[move])
+                if not len(cells):
+                    continue
+                settled = False
+                scans += 1
+                scanned_at[move] = scans
+                rows = np.flatnonzero(np.bincount(grid.line_of[move][cells],
+                                                  minlength=len(grid.lines[move])))
+                window = slice(max(grid.position[move][cells].min() - 1, 0), None)
+                lines = grid.lines[move][rows, window]
+
+                line_g = g[lines]
+                # Cost of following the line from its start to each cell,
+                # as cumulative sums of the move costs (the first cell
+                # moves to one outside the scan). Blocked moves, and those
+                # where a line wraps, add NO_MOVE, so nothing gets lower
+                # through them.
+                steps = self.line_steps[move][rows, window]
+                steps[:, 0] = 0.
+                along = np.cumsum(steps, axis=1, out=steps)
+                best = np.subtract(line_g, along)
+                np.minimum.accumulate(best, axis=1, out=best)
+                best += along
+                lower = best < np.minimum(line_g - TOLERANCE, UNREACHABLE)
+                cells = lines[lower]
+                g[cells] = best[lower]
+                self.best[cells] = move
+                changed_at[cells] = scans
+            if settled:
+                return scans
+
+    def best_move(self, cell, leave_cost=None):
+        # (cost to go, neighbour) of the cheapest move out of cell;
+        # leave_cost overrides the cost of the cell's own moves
+        costs = self.move_costs[:, cell]
+        if leave_cost is not None:
+            costs = np.where(self.allowed[:, cell], _STEPS*leave_cost, BLOCKED)
+        neighbours = self.neighbours[:, cell]
+        totals = costs + self.g[neighbours]
+        move = int(np.argmin(totals))
+        return totals[move], int(neighbours[move])
+
+
+class HomePlanner():
+    """
+    Keeps the way home from anywhere over the occupancy grid.
+
+    The home cell never changes, so instead of searching a path from the
+    rover every time, a CostToGo field from home is kept and waypoint()
+    walks down its gradient from the rover. update() only marks the cells
+    of each MapUpdate; the field is repaired from the marked cells when
+    a path is next asked for, so mapping does not pay for it.
+
+    """
+
+    def __init__(self, occupancy, goal, lookahead=4):
+        self.occupancy = occupancy
+        self.width = occupancy.shape[1]
+        self.goal = self.cell(goal)
+        self.lookahead = lookahead  # Cells ahead of the rover to steer to
+
+        self.field = CostToGo(occupancy.shape, self.goal)
+        # Cells whose evidence changed since the field was last repaired
+        self.stale = np.ones(self.field.size, dtype=bool)
+        self.repairs = 0
+        self.last_repair_ms = 0.
+        self.total_repair_ms = 0.
+        self.max_repair_ms = 0.
+
+    def cell(self, point):
+        # Flat index of the world cell containing an (x, y) point
+        x, y = (min(max(int(value), 0), self.width - 1) for value in point[:2])
+        return y*self.width + x
+
+    def update(self, map_update):
+        """Mark the cells of a MapUpdate for the next repair of the field."""
+        self.stale[map_update.cells] = True
+
+    def repair(self):
+        """Bring the field up to date with the costs of the stale cells."""
+        cells = np.flatnonzero(self.stale)
+        if not len(cells):
+            return
+        begin = time.perf_counter()
+        self.stale[cells] = False
+        costs = cell_costs(self.occupancy.log_odds.ravel()[cells])
+        changed = costs != self.field.costs[cells]
+        if changed.any():
+            self.field.set_costs(cells[changed], costs[changed])
+
+        self.last_repair_ms = (time.perf_counter() - begin)*1e3
+        self.total_repair_ms += self.last_repair_ms
+        self.max_repair_ms = max(self.max_repair_ms, self.last_repair_ms)
+        self.repairs += 1
+
+    def stats(self):
+        """Return the field repair count and times (ms) as a dict."""
+        return {
+            'repairs': self.repairs,
+            'last_ms': self.last_repair_ms,
+            'mean_ms': self.total_repair_ms/self.repairs if self.repairs else 0.,
+            'max_ms': self.max_repair_ms,
+        }
+
+    def path(self, pos, max_cells=None):
+        """
+        Flat cells of the cheapest path from pos towards home (up to
+        max_cells moves), or None if home cannot be reached over the
+        current map.
+
+        """
+        self.repair()
+        field = self.field
+        cell = self.cell(pos)
+        # The rover may stand on a cell mapped blocked; it can still leave it
+        cost = min(field.costs[cell], UNCERTAIN_COST)
+        path = [cell]
+        while cell != self.goal and (max_cells is None or len(path) <= max_cells):
+            total, cell = field.best_move(cell, cost)
+            if total == BLOCKED:
+                return None
+            path.append(cell)
+            cost = None
+        return path
+
+    def waypoint(self, pos):
+        """
+        Return the (x, y) world point to steer to from pos, or None if the
+        goal cannot be reached over the current map.
+
+        """
+        path = self.path(pos, self.lookahead)
+        if path is None:
+            return None
+        y, x = divmod(path[-1], self.width)
+        # Centre of the target cell
+        return x + 0.5, y + 0.5
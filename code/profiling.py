@@ -0,0 +1,145 @@
+"""
+Per-stage timing of the telemetry loop.
+
+"""
+import json
+import time
+import threading
+from collections import deque
+
+import numpy as np
+
+
+FRAME_BUDGET_MS = 40.0  # The simulator sends telemetry at 25 Hz
+
+
+class StageTimer():
+    """
+    Context manager adding the time spent in its block to a stage.
+
+    Stages may be timed on other threads than the one reporting them
+    (the output renderer's worker), so the statistics are only read and
+    written under lock.
+
+    """
+
+    __slots__ = ('lock', 'samples', 'start', 'count', 'total_ns', 'max_ns')
+
+    def __init__(self, window, lock=None):
+        self.lock = threading.Lock() if lock is None else lock
+        self.samples = deque(maxlen=window)  # Latest durations (ns)
+        self.start = 0
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.add(time.perf_counter_ns() - self.start)
+        return False
+
+    def add(self, duration_ns):
+        with self.lock:
+            self.record(duration_ns)
+
+    def record(self, duration_ns):
+        # Called with lock held
+        self.samples.append(duration_ns)
+        self.count += 1
+        self.total_ns += duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+
+    def summary(self):
+        # Percentiles over the rolling window, totals over the whole run
+        with self.lock:
+            samples = list(self.samples)
+            count, total_ns, max_ns = self.count, self.total_ns, self.max_ns
+        window = np.array(samples, dtype=np.float64)*1e-6
+        p50, p95, p99 = np.percentile(window, (50, 95, 99)) if len(window) else (0., 0., 0.)
+        return {
+            'count': count,
+            'mean_ms': total_ns*1e-6/count if count else 0.,
+            'p50_ms': float(p50),
+            'p95_ms': float(p95),
+            'p99_ms': float(p99),
+            'max_ms': max_ns*1e-6,
+        }
+
+
+class FrameTimer(StageTimer):
+    """StageTimer of whole frames, counting those over the frame budget."""
+
+    __slots__ = ('budget_ns', 'overruns')
+
+    def __init__(self, window, budget_ms, lock=None):
+        StageTimer.__init__(self, window, lock)
+        self.budget_ns = int(budget_ms*1e6)
+        self.overruns = 0
+
+    def record(self, duration_ns):
+        StageTimer.record(self, duration_ns)
+        if duration_ns > self.budget_ns:
+            self.overruns += 1
+
+
+class StageProfiler():
+    """
+    Rolling latency statistics of named stages of a frame loop.
+
+    Wrap a whole frame in frame() and each step in stage(name):
+
+        with Profiler.frame():
+            with Profiler.stage('perception'):
+                perception_step(Rover)
+
+    Timers are created once per stage and reused, so timing a block
+    costs two perf_counter_ns() calls and a deque append under a lock
+    shared by all timers. Stages may be timed from any thread.
+
+    """
+
+    def __init__(self, budget_ms=FRAME_BUDGET_MS, window=1000):
+        self.budget_ms = budget_ms
+        self.window = window
+        self.lock = threading.Lock()
+        self.frames = FrameTimer(window, budget_ms, self.lock)
+        self.stages = {}
+
+    def frame(self):
+        return self.frames
+
+    def start_frame(self):
+        # Same as entering frame(), for loops whose body is not a block
+        self.frames.__enter__()
+
+    def end_frame(self):
+        self.frames.__exit__()
+
+    def stage(self, name):
+        timer = self.stages.get(name)
+        if timer is None:
+            with self.lock:
+                timer = self.stages.setdefault(name, StageTimer(self.window, self.lock))
+        return timer
+
+    def report(self):
+        """Return the statistics of the frames and every stage as a dict."""
+        with self.lock:
+            stages = list(self.stages.items())
+            overruns = self.frames.overruns
+        return {
+            'budget_ms': self.budget_ms,
+            'window': self.window,
+            'overruns': overruns,
+            'frame': self.frames.summary(),
+            'stages': {name: timer.summary() for name, timer in stages},
+        }
+
+    def dump(self, path):
+        """Write report() to a JSON file."""
+        with open(path, 'w') as report_file:
+            json.dump(self.report(), report_file, indent=2)
@@ -0,0 +1,215 @@
+"""
+Append-only recording of a run into memory-mapped segment files.
+
+A recording is a directory holding a run.json manifest and numbered
+segments. Each segment is a pair of files:
+
+    segment_0000.jpg.bin    camera JPEGs as received, back to back
+    segment_0000.index.npy  one RECORD_DTYPE record per frame
+
+The JPEGs are stored exactly as the simulator sent them, so recording
+never re-encodes an image. Records hold the byte range of their frame
+and the telemetry and decision state of that frame, so a RunReader can
+seek to any frame without scanning the directory.
+
+"""
+import os
+import json
+import time
+import queue
+import threading
+
+import numpy as np
+
+from supporting_functions import decode_camera_image
+
+
+RECORD_DTYPE = np.dtype([
+    ('time', np.float64),  # Capture time (s since the epoch)
+    ('offset', np.uint64),  # Byte offset of the JPEG in the segment blob
+    ('size', np.uint32),  # JPEG size in bytes (0: unused record)
+    ('pos', np.float64, (2,)),
+    ('yaw', np.float64),
+    ('pitch', np.float64),
+    ('roll', np.float64),
+    ('speed', np.float64),
+    ('steer', np.float64),
+    ('throttle', np.float64),
+    ('brake', np.float64),
+    ('state', 'S32'),  # Name of the decision state
+])
+
+MANIFEST = 'run.json'
+_STOP = object()  # Tells the writer thread to finish
+
+
+def segment_paths(path, segment):
+    base = os.path.join(path, 'segment_{:04d}'.format(segment))
+    return base + '.jpg.bin', base + '.index.npy'
+
+
+class RunRecorder():
+    """
+    Records camera frames and telemetry from a background writer thread.
+
+    record() only queues the frame, so the telemetry loop never waits on
+    the disk. When the writer falls more than queue_size frames behind,
+    new frames are dropped (and counted) instead of queued.
+
+    Segments are preallocated memory maps of frames_per_segment records
+    and segment_bytes of JPEG data; a new segment is started when either
+    fills. Call close() at the end of the run to flush the last segment.
+
+    """
+
+    def __init__(self, path, frames_per_segment=4096, segment_bytes=64 << 20,
+                 queue_size=256):
+        self.path = path
+        self.frames_per_segment = frames_per_segment
+        self.segment_bytes = segment_bytes
+        self.dropped = 0
+        self.segments = []  # Manifest entries
+        self.blob = self.index = None
+        self.frames = self.used = 0  # Of the current segment
+        os.makedirs(path, exist_ok=True)
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.writer = threading.Thread(target=self.run, name='RunRecorder',
+                                       daemon=True)
+        self.writer.start()
+
+    def record(self, jpeg, Rover, state=''):
+        """Queue one frame (JPEG bytes) with the current Rover telemetry."""
+        item = (time.time(), jpeg, Rover.snapshot(), state)
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Write the queued frames and finalize the recording."""
+        if self.writer.is_alive():
+            self.queue.put(_STOP)
+            self.writer.join()
+
+    def run(self):
+        # Writer thread
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                break
+            self.write(*item)
+        self.finish_segment()
+
+    def write(self, stamp, jpeg, snapshot, state):
+        size = len(jpeg)
+        if (self.index is None or self.frames == self.frames_per_segment
+                or self.used + size > self.segment_bytes):
+            self.start_segment(size)
+
+        self.blob[self.used:self.used + size] = np.frombuffer(jpeg, dtype=np.uint8)
+        # Fields in RECORD_DTYPE order ('S' truncates long state names)
+        self.index[self.frames] = (stamp, self.used, size, snapshot.pos[:2],
+                                   snapshot.yaw, snapshot.pitch, snapshot.roll,
+                                   snapshot.vel, snapshot.steer,
+                                   snapshot.throttle, snapshot.brake,
+                                   state.encode())
+        self.frames += 1
+        self.used += size
+
+    def start_segment(self, min_bytes=0):
+        self.finish_segment()
+        segment = len(self.segments)
+        blob_path, index_path = segment_paths(self.path, segment)
+        self.blob = np.memmap(blob_path, dtype=np.uint8, mode='w+',
+                              shape=(max(self.segment_bytes, min_bytes),))
+        self.index = np.lib.format.open_memmap(
+            index_path, mode='w+', dtype=RECORD_DTYPE,
+            shape=(self.frames_per_segment,))
+        self.frames = self.used = 0
+        # Listed before it is complete, so a crashed run stays readable
+        self.segments.append({'segment': segment, 'frames': None, 'bytes': None})
+        self.write_manifest()
+
+    def finish_segment(self):
+        if self.index is None:
+            return
+        self.index.flush()
+        self.blob.flush()
+        blob_path = self.blob.filename
+        self.blob = self.index = None
+        # Drop the unused preallocated tail of the JPEG blob
+        os.truncate(blob_path, self.used)
+        self.segments[-1].update(frames=self.frames, bytes=self.used)
+        self.write_manifest()
+
+    def write_manifest(self):
+        with open(os.path.join(self.path, MANIFEST), 'w') as manifest_file:
+            json.dump({'segments': self.segments, 'dropped': self.dropped},
+                      manifest_file, indent=2)
+
+
+class RunReader():
+    """
+    Random access to the frames and telemetry of a recording.
+
+    records is a RECORD_DTYPE array of every frame in recording order;
+    the JPEGs stay memory-mapped and are only read when asked for.
+
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, MANIFEST)) as manifest_file:
+            manifest = json.load(manifest_file)
+        self.blobs = []
+        records, segments = [], []
+        for entry in manifest['segments']:
+            blob_path, index_path = segment_paths(path, entry['segment'])
+            index = np.load(index_path, mmap_mode='r')
+            frames = entry['frames']
+            if frames is None:
+                # Unfinished segment: records are written in order
+                frames = int(np.count_nonzero(index['size']))
+            records.append(np.array(index[:frames]))
+            segments.append(np.full(frames, len(self.blobs)))
+            if os.path.getsize(blob_path):
+                self.blobs.append(np.memmap(blob_path, dtype=np.uint8, mode='r'))
+            else:
+                self.blobs.append(np.zeros(0, dtype=np.uint8))
+        self.records = np.concatenate(records) if records else np.zeros(0, RECORD_DTYPE)
+        self.segment = np.concatenate(segments) if segments else np.zeros(0, np.intp)
+
+    def __len__(self):
+        return len(self.records)
+
+    def jpeg(self, frame):
+        """Return the JPEG bytes of a frame (as a memory-mapped array)."""
+        record = self.records[frame]
+        offset = int(record['offset'])
+        return self.blobs[self.segment[frame]][offset:offset + int(record['size'])]
+
+    def image(self, frame, out=None):
+        """Decode a frame into an RGB uint8 array, reusing out if possible."""
+        return decode_camera_image(self.jpeg(frame), out)
+
+    def rows(self, start=0, stop=None):
+        """Yield the frames' telemetry in the dict layout of replay.read_log."""
+        for frame in range(start, len(self) if stop is None else stop):
+            record = self.records[frame]
+            yield {
+                'frame': frame,
+                'time': float(record['time']),
+                'steer': float(record['steer']),
+                'throttle': float(record['throttle']),
+                'brake': float(record['brake']),
+                'speed': float(record['speed']),
+                'pos': tuple(record['pos'].tolist()),
+                'pitch': float(record['pitch']),
+                'yaw': float(record['yaw']),
+                'roll': float(record['roll']),
+                'state': record['state'].decode(),
+            }
+
+    def decode_row(self, row, out=None):
+        # FrameLoader decode function for rows()
+        return self.image(row['frame'], out)
@@ -0,0 +1,316 @@
+"""
+Offline replay of a recorded run through perception and decision.
+
+Streams a robot_log.csv (semicolon-delimited image path and pose per frame)
+or a recording made by drive_rover.py into a RoverState and runs the same
+perception and decision steps as drive_rover.py, without the simulator.
+Run from the code directory:
+
+    python replay.py ../test_dataset/robot_log.csv
+    python replay.py path/to/recording
+
+"""
+
+
+import os
+import csv
+import json
+import time
+import argparse
+from datetime import datetime
+
+import numpy as np
+
+import decision
+from frame_loader import FrameLoader, decode_image
+from perception import perception_step, perception_batch
+import recorder
+import dataset_store
+from rover_state import RoverState
+from supporting_functions import convert_to_float, create_output_images
+
+
+STAGES = ('load', 'perception', 'decision', 'render')
+
+
+def frame_time(image_path):
+    """Return the capture time (s) encoded in a robocam image filename."""
+    stamp = os.path.splitext(os.path.basename(image_path))[0]
+    try:
+        return datetime.strptime(stamp[-23:], '%Y_%m_%d_%H_%M_%S_%f').timestamp()
+    except ValueError:
+        return None
+
+
+def resolve_image_path(log_dir, path):
+    # Log paths are relative to the code directory; try them relative to
+    # the log itself and then as an IMG/ folder next to the log
+    for candidate in (os.path.join(log_dir, path),
+                      os.path.join(log_dir, 'IMG', os.path.basename(path)),
+                      path):
+        if os.path.exists(candidate):
+            return candidate
+    return os.path.join(log_dir, path)
+
+
+def read_log(log_path):
+    """Yield one dict of telemetry per row of a robot log."""
+    log_dir = os.path.dirname(os.path.abspath(log_path))
+    with open(log_path, newline='') as log_file:
+        for row in csv.DictReader(log_file, delimiter=';'):
+            path = resolve_image_path(log_dir, row['Path'])
+            yield {
+                'path': path,
+                'time': frame_time(path),
+                'steer': convert_to_float(row['SteerAngle']),
+                'throttle': convert_to_float(row['Throttle']),
+                'brake': convert_to_float(row['Brake']),
+                'speed': convert_to_float(row['Speed']),
+                'pos': (convert_to_float(row['X_Position']),
+                        convert_to_float(row['Y_Position'])),
+                'pitch': convert_to_float(row['Pitch']),
+                'yaw': convert_to_float(row['Yaw']),
+                'roll': convert_to_float(row['Roll']),
+            }
+
+
+def open_run(log_path):
+    """
+    Return (rows, decode) for a robot log, a recording directory or a
+    converted dataset store.
+
+    rows yields telemetry dicts in the layout of read_log; decode(row, out)
+    decodes the image of a row (the FrameLoader decode function).
+
+    """
+    if os.path.isfile(os.path.join(log_path, recorder.MANIFEST)):
+        reader = recorder.RunReader(log_path)
+        return reader.rows(), reader.decode_row
+    if os.path.isfile(os.path.join(log_path, dataset_store.MANIFEST)):
+        store = dataset_store.DatasetStore(log_path)
+        return store.rows(), store.decode_row
+    return read_log(log_path), lambda row, out: decode_image(row['path'], out)
+
+
+def update_from_log(Rover, row):
+    # Copy one log row into the Rover the way update_rover does for
+    # live telemetry
+    Rover.vel = row['speed']
+    Rover.pos = row['pos']
+    Rover.yaw = row['yaw']
+    Rover.pitch = row['pitch']
+    Rover.roll = row['roll']
+    Rover.steer = row['steer']
+    Rover.throttle = row['throttle']
+    Rover.brake = row['brake']
+
+
+def replay(log_path, skip=0, max_frames=None, workers=None, readahead=None,
+           decide=True, render=False):
+    """
+    Replay a robot log and return a report of timings and map quality.
+
+    skip drops that many frames after every processed one; max_frames
+    bounds the number of processed frames. Images are decoded ahead of
+    perception by a FrameLoader with the given workers and readahead.
+
+    """
+    Rover = RoverState()
+    Decider = decision.DecisionMaker()
+    timings = {stage: [] for stage in STAGES}
+
+    rows, decode = open_run(log_path)
+    if skip:
+        rows = (row for idx, row in enumerate(rows) if idx % (skip + 1) == 0)
+
+    first_time = last_time = None
+    frames = 0
+    start = time.perf_counter()
+    load_start = start
+    frames_in = FrameLoader(rows, decode=decode,
+                            workers=workers, readahead=readahead)
+    for row, img in frames_in:
+        stamp = row['time']
+        if stamp is not None:
+            first_time = stamp if first_time is None else first_time
+            last_time = stamp
+            Rover.total_time = stamp - first_time
+
+        t0 = time.perf_counter()
+        timings['load'].append(t0 - load_start)
+        Rover.img = img
+        update_from_log(Rover, row)
+        perception_step(Rover)
+        t1 = time.perf_counter()
+        timings['perception'].append(t1 - t0)
+        if decide:
+            Decider.run(Rover)
+        t2 = time.perf_counter()
+        timings['decision'].append(t2 - t1)
+        if render:
+            create_output_images(Rover)
+            timings['render'].append(time.perf_counter() - t2)
+        load_start = time.perf_counter()
+
+        frames += 1
+        if max_frames is not None and frames >= max_frames:
+            break
+    wall_time = time.perf_counter() - start
+
+    report = {
+        'frames': frames,
+        'wall_time_s': wall_time,
+        'fps': frames/wall_time if wall_time > 0 else 0.,
+        'perc_mapped': Rover.map_stats.perc_mapped,
+        'fidelity': Rover.map_stats.fidelity,
+        'stages_ms': {},
+        'planner': Rover.planner.stats(),
+    }
+    if first_time is not None and last_time > first_time:
+        report['realtime_factor'] = (last_time - first_time)/wall_time
+    for stage, samples in timings.items():
+        if samples:
+            samples = np.array(samples)*1e3
+            report['stages_ms'][stage] = {
+                'mean': float(samples.mean()),
+                'p95': float(np.percentile(samples, 95)),
+                'max': float(samples.max()),
+            }
+    # How often each decision rule fired, most frequent first
+    report['transitions'] = {'{}: {}'.format(source, event): count
+                             for (source, event), count in Decider.fired.most_common()}
+    # Rate the pipeline could sustain if images were always ready
+    pipeline_time = sum(sum(timings[stage]) for stage in STAGES if stage != 'load')
+    report['fps_achievable'] = frames/pipeline_time if pipeline_time > 0 else 0.
+    return report
+
+
+def iter_batches(frames_in, batch_size):
+    # Group (row, image) frames into (rows, (N, rows, cols, 3) stack)
+    rows, images = [], None
+    for row, img in frames_in:
+        if images is None:
+            images = np.empty((batch_size,) + img.shape, dtype=img.dtype)
+        images[len(rows)] = img
+        rows.append(row)
+        if len(rows) == batch_size:
+            yield rows, images
+            rows = []
+    if rows:
+        yield rows, images[:len(rows)]
+
+
+def pose_arrays(rows):
+    # Poses of log rows as the arrays perception_batch takes
+    return {
+        'pos': np.array([row['pos'] for row in rows]),
+        'yaw': np.array([row['yaw'] for row in rows]),
+        'pitch': np.array([row['pitch'] for row in rows]),
+        'roll': np.array([row['roll'] for row in rows]),
+    }
+
+
+def map_rows(rows, Rover, batch_size=64, workers=None, decode=None):
+    """Map the frames of log rows into Rover with perception_batch."""
+    frames = 0
+    frames_in = FrameLoader(rows, path=lambda row: row['path'], workers=workers,
+                            decode=decode)
+    for batch_rows, images in iter_batches(frames_in, batch_size):
+        perception_batch(images, pose_arrays(batch_rows), Rover)
+        frames += len(batch_rows)
+    return frames
+
+
+def remap(log_path, batch_size=64, skip=0, max_frames=None, workers=None,
+          Rover=None):
+    """
+    Rebuild the worldmap of a robot log with batched perception only.
+
+    Gives the same map as replay() without the decision step, but maps
+    batch_size frames per perception_batch call. Returns a report with
+    the frame count, timings and map quality.
+
+    """
+    Rover = Rover or RoverState()
+    rows, decode = open_run(log_path)
+    if skip:
+        rows = (row for idx, row in enumerate(rows) if idx % (skip + 1) == 0)
+    if max_frames is not None:
+        rows = (row for idx, row in enumerate(rows) if idx < max_frames)
+
+    start = time.perf_counter()
+    frames = map_rows(rows, Rover, batch_size, workers, decode)
+    wall_time = time.perf_counter() - start
+    return map_report(Rover, frames, wall_time)
+
+
+def map_report(Rover, frames, wall_time):
+    # Report of a mapping-only run, in the layout of replay()'s report
+    return {
+        'frames': frames,
+        'wall_time_s': wall_time,
+        'fps': frames/wall_time if wall_time > 0 else 0.,
+        'fps_achievable': frames/wall_time if wall_time > 0 else 0.,
+        'perc_mapped': Rover.map_stats.perc_mapped,
+        'fidelity': Rover.map_stats.fidelity,
+        'stages_ms': {},
+        'planner': Rover.planner.stats(),
+        'transitions': {},
+    }
+
+
+def print_report(report):
+    print('Frames replayed:   {}'.format(report['frames']))
+    print('Wall time:         {:.2f} s ({:.1f} FPS)'.format(
+        report['wall_time_s'], report['fps']))
+    print('Achievable FPS:    {:.1f}'.format(report['fps_achievable']))
+    if 'realtime_factor' in report:
+        print('Realtime factor:   {:.1f}x'.format(report['realtime_factor']))
+    for stage, stats in report['stages_ms'].items():
+        print('  {:<12} mean {:7.3f} ms  p95 {:7.3f} ms  max {:7.3f} ms'.format(
+            stage, stats['mean'], stats['p95'], stats['max']))
+    planner = report['planner']
+    if planner['repairs']:
+        print('Home field repairs: {} (mean {:.3f} ms, max {:.3f} ms)'.format(
+            planner['repairs'], planner['mean_ms'], planner['max_ms']))
+    if report['transitions']:
+        print('Transitions fired:')
+        for rule, count in report['transitions'].items():
+            print('  {:<44} {:6d}'.format(rule, count))
+    print('Mapped:            {}%'.format(report['perc_mapped']))
+    print('Fidelity:          {}%'.format(report['fidelity']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a recorded run')
+    parser.add_argument('log', nargs='?', default='../test_dataset/robot_log.csv',
+                        help='Path to the robot_log.csv, recording or store of the run.')
+    parser.add_argument('--skip', type=int, default=0,
+                        help='Frames to skip after every processed frame.')
+    parser.add_argument('--max-frames', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Image decoding threads (default: one per core).')
+    parser.add_argument('--readahead', type=int, default=None,
+                        help='Number of images decoded ahead of perception.')
+    parser.add_argument('--no-decision', action='store_true',
+                        help='Only run the perception step.')
+    parser.add_argument('--render', action='store_true',
+                        help='Also render the output images every frame.')
+    parser.add_argument('--batch', type=int, default=0,
+                        help='Only rebuild the map, this many frames per batch.')
+    parser.add_argument('--json', default=None,
+                        help='Write the report to this JSON file.')
+    args = parser.parse_args()
+
+    if args.batch > 0:
+        report = remap(args.log, batch_size=args.batch, skip=args.skip,
+                       max_frames=args.max_frames, workers=args.workers)
+    else:
+        report = replay(args.log, skip=args.skip, max_frames=args.max_frames,
+                        workers=args.workers, readahead=args.readahead,
+                        decide=not args.no_decision,
+                        render=args.render)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
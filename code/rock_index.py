@@ -0,0 +1,61 @@
+"""
+Spatial index confirming rock detections against known sample positions.
+
+"""
+import numpy as np
+
+
+class RockSampleIndex():
+    """
+    Tracks which known rock samples have been located on the worldmap.
+
+    Samples are bucketed in a grid of cells the size of the match radius,
+    so each newly detected rock cell only tests the samples in its 3x3
+    neighbourhood of buckets. Once located, a sample stays located (rock
+    evidence in the occupancy grid never decreases), so it is dropped
+    from the buckets.
+
+    """
+
+    def __init__(self, samples_pos, radius=3, world_size=200):
+        self.samples_x = np.asarray(samples_pos[0])
+        self.samples_y = np.asarray(samples_pos[1])
+        self.radius = radius
+        self.world_size = world_size
+        self.located = np.zeros(len(self.samples_x), dtype=bool)
+
+        self.buckets = {}
+        for idx, (x, y) in enumerate(zip(self.samples_x, self.samples_y)):
+            self.buckets.setdefault(self.bucket(x, y), []).append(idx)
+
+    def bucket(self, x, y):
+        return int(x) // self.radius, int(y) // self.radius
+
+    def update(self, rock_cells):
+        """Check newly detected rock cells (flat world indices)."""
+        if self.located.all():
+            return
+        rock_y, rock_x = np.divmod(rock_cells, self.world_size)
+        for x, y in zip(rock_x, rock_y):
+            bucket_x, bucket_y = self.bucket(x, y)
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    samples = self.buckets.get((bucket_x + dx, bucket_y + dy))
+                    if samples:
+                        self.check(samples, x, y)
+
+    def check(self, samples, x, y):
+        # A detection within radius of a known sample confirms the sample
+        for idx in list(samples):
+            if np.hypot(self.samples_x[idx] - x,
+                        self.samples_y[idx] - y) < self.radius:
+                self.located[idx] = True
+                samples.remove(idx)
+
+    @property
+    def located_count(self):
+        return int(np.count_nonzero(self.located))
+
+    def located_positions(self):
+        """Return (x, y) of every located sample."""
+        return zip(self.samples_x[self.located], self.samples_y[self.located])
@@ -0,0 +1,212 @@
+"""
+Rover state container shared by the live controller and offline tools.
+"""
+
+
+import os
+from operator import attrgetter
+from collections import namedtuple
+
+import numpy as np
+import matplotlib.image as mpimg
+
+from occupancy import OccupancyGrid, MapStats
+from planner import HomePlanner
+from frontier import FrontierMap
+from sample_tracker import SampleTracker
+
+
+# Read in ground truth map and create 3-channel green version for overplotting
+# NOTE: images are read in by default with the origin (0, 0) in the upper left
+# and y-axis increasing downward.
+ground_truth = mpimg.imread(os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), '..', 'calibration_images', 'map_bw.png'))
+
+# This next line creates arrays of zeros in the red and blue channels
+# and puts the map into the green channel.  This is why the underlying
+# map output looks green in the display image
+ground_truth_3d = np.dstack(
+    (ground_truth*0, ground_truth*255, ground_truth*0)
+).astype(np.float32)
+
+
+# Tuning constants of the decision states, fixed for the whole run
+RoverConfig = namedtuple('RoverConfig', [
+    'MAX_VEL', 'MIN_VEL', 'MAX_STEER_RIGHT', 'MAX_STEER_LEFT', 'MAX_BRAKE',
+    'MIN_ANGLE_LEFT', 'MIN_ANGLE_RIGHT', 'MAX_STUCK_TIME'])
+
+DEFAULT_CONFIG = RoverConfig(
+    MAX_VEL=2.0,
+    MIN_VEL=0.2,
+    MAX_STEER_RIGHT=-15,
+    MAX_STEER_LEFT=15,
+    MAX_BRAKE=10,
+    MIN_ANGLE_LEFT=20,
+    MIN_ANGLE_RIGHT=-20,
+    MAX_STUCK_TIME=3,
+)
+
+
+# Scalars read and written every frame by telemetry, perception and the
+# decision states, slotted first in RoverState. These are the fields
+# captured by RoverState.snapshot()
+HOT_FIELDS = (
+    'total_time', 'pos', 'yaw', 'pitch', 'roll', 'vel', 'steer', 'throttle',
+    'brake', 'near_sample', 'picking_up', 'send_pickup', 'samples_collected',
+    'going_home', 'timer_on', 'start_stuck_time', 'distance_from_home',
+    'angle_from_home',
+)
+
+RoverSnapshot = namedtuple('RoverSnapshot', HOT_FIELDS)
+
+
+class PerceptionBuffers():
+    """
+    Fixed-capacity storage for the per-frame perception arrays.
+
+    Each array (x_nav, nav_angles, ...) is written into the front of a
+    preallocated buffer and handed out as a view of its current length,
+    so a frame does not allocate new arrays. The views are only valid
+    until the next frame; copy them to keep them.
+
+    """
+
+    FIELDS = ('x_nav', 'y_nav', 'nav_dists', 'nav_angles', 'nav_angles_left',
+              'obs_dists', 'obs_angles', 'rock_dists', 'rock_angles')
+
+    __slots__ = ('capacity', 'buffers')
+
+    def __init__(self, capacity, dtype=np.float32):
+        self.capacity = capacity
+        self.buffers = {name: np.zeros(capacity, dtype=dtype) for name in self.FIELDS}
+
+    def reserve(self, count):
+        # Grow every buffer (geometrically) to hold at least count values
+        if count > self.capacity:
+            self.capacity = max(count, 2*self.capacity)
+            self.buffers = {name: np.zeros(self.capacity, dtype=buf.dtype)
+                            for name, buf in self.buffers.items()}
+
+    def take(self, name, source, idx):
+        # Gather source[idx] into the named buffer and return the view
+        count = len(idx)
+        self.reserve(count)
+        return np.take(source, idx, out=self.buffers[name][:count])
+
+    def compress(self, name, condition, source):
+        # Gather source[condition] into the named buffer and return the view
+        count = int(np.count_nonzero(condition))
+        self.reserve(count)
+        return np.compress(condition, source, out=self.buffers[name][:count])
+
+
+class RoverState():
+    """
+    Create a class to be a container for rover state telemetry values.
+
+    This allows for tracking telemetry values and results from
+    perception analysis. Fields are slotted: hot per-frame scalars
+    first, then the perception arrays, then images, maps and other
+    long-lived objects. Tuning constants live in the frozen config.
+
+    """
+
+    __slots__ = HOT_FIELDS + PerceptionBuffers.FIELDS + (
+        'config', 'buffers', 'clearance', 'features', 'telemetry', 'start_time',
+        'samples_pos', 'rock_index', 'samples_to_find', 'img', 'vision_image',
+        'vision_warped', 'vision_threshed', 'vision_mask', 'occupancy',
+        'worldmap', 'map_update', 'ground_truth', 'map_stats',
+        'home_coords_world', 'planner', 'frontiers', 'sample_tracker',
+    )
+
+    def __init__(self, config=DEFAULT_CONFIG):
+        """
+        Initialize a RoverState instance to retain parameters.
+
+        NOTE: distances in meters and angles in degrees
+
+        """
+        self.config = config  # Frozen tuning constants (MAX_VEL, ...)
+        self.telemetry = None  # Parsed fields of the latest telemetry
+        self.start_time = None  # To record the start time of navigation
+        self.total_time = None  # To record total duration of navigation
+        self.img = np.zeros((160, 320, 3), dtype=np.uint8)  # Current camera image
+        self.pos = None  # Current position (x, y)
+        self.yaw = None  # Current yaw angle
+        self.pitch = None  # Current pitch angle
+        self.roll = None  # Current roll angle
+        self.vel = None  # Current velocity (m/s)
+        self.steer = 0  # Current steering angle
+        self.throttle = 0  # Current throttle value
+        self.brake = 0  # Current brake value
+
+        self.start_stuck_time = 0
+
+        # Preallocated storage of the per-frame perception arrays below,
+        # sized for one entry per camera pixel
+        self.buffers = PerceptionBuffers(self.img.shape[0]*self.img.shape[1])
+
+        self.nav_dists = None  # Distances to navigable terrain pixels
+        self.nav_angles = None  # Angles of navigable terrain pixels
+        self.nav_angles_left = None  # Nav terrain angles left of rover direction
+
+        self.obs_dists = None  # Distances to obstacle terrain pixels
+        self.obs_angles = None  # Angles of obstacle terrain pixels
+
+        self.rock_dists = None  # Distances to rock terrain pixels
+        self.rock_angles = None  # Angles of rock terrain pixels
+        self.samples_pos = None  # To store the actual sample positions
+        self.rock_index = None  # To track which samples have been located
+        self.sample_tracker = SampleTracker()  # World positions of rocks in view
+        self.samples_to_find = 0  # To store the initial count of samples
+        self.samples_collected = 0  # To count the number of samples collected
+        self.near_sample = 0  # To be set to TLM value data["near_sample"]
+        self.picking_up = 0  # To be set to TLM value data["picking_up"]
+        self.send_pickup = False  # Set to True to trigger rock pickup
+
+        self.x_nav = np.zeros(1)
+        self.y_nav = np.zeros(1)
+        self.clearance = None  # Free distance per steering angle bin
+        self.features = None  # FrameFeatures of the current frame
+
+        self.distance_from_home = None  # Current distance to starting location
+        self.angle_from_home = None  # Current angle to starting location
+        self.going_home = False  # Default rover configuration
+
+        self.timer_on = False  # Timer to determine duration of stuck
+        
+
+        # Rover vision image to be updated with displays of
+        # intermediate analysis steps on screen in autonomous mode
+        self.vision_image = np.zeros((160, 320, 3), dtype=np.float32)
+        self.vision_warped = np.zeros((160, 320, 3), dtype=float)
+        self.vision_threshed = np.zeros((160, 320), dtype=float)
+        self.vision_mask = np.zeros((160, 320), dtype=float)
+        # Occupancy grid accumulating navigable/obstacle/rock evidence and
+        # the worldmap image it keeps updated with the positions of
+        # ROIs navigable terrain, obstacles and rock samples
+        self.occupancy = OccupancyGrid(world_size=200)
+        self.worldmap = self.occupancy.worldmap
+        self.map_update = None  # Cells changed by the last perception step
+        self.ground_truth = ground_truth_3d  # Ground truth worldmap
+        # To track % of ground truth map successfully found and fidelity
+        self.map_stats = MapStats(ground_truth_3d[:, :, 1])
+
+        self.home_coords_world = np.array([[99.7, 85.6]])  # (N, 2) world points
+        # Path back home over the occupancy grid, followed by ReturningHome
+        self.planner = HomePlanner(self.occupancy, self.home_coords_world[0])
+        # Unexplored edges of the map, explored when wall following stalls
+        self.frontiers = FrontierMap(self.occupancy)
+
+    def snapshot(self):
+        """
+        Return the hot scalar fields as an immutable RoverSnapshot.
+
+        Used to hand the state of a frame to the recorder and the output
+        renderer, which keep it while the Rover moves on.
+
+        """
+        return RoverSnapshot._make(_get_hot_fields(self))
+
+
+_get_hot_fields = attrgetter(*HOT_FIELDS)
@@ -0,0 +1,166 @@
+"""
+World-frame tracking of rock samples seen by the rover camera.
+
+"""
+import numpy as np
+import cv2
+
+from occupancy import MIN_CONFIDENCE
+
+
+# Variance (m^2) a track's position gains per frame. Samples do not move,
+# so this only covers drift in the rover's own pose estimate.
+PROCESS_VAR = 0.01
+
+# Standard deviation (m) of a blob position, which grows with its
+# distance since the perspective warp stretches far pixels
+MEASUREMENT_STD = 0.2
+MEASUREMENT_STD_PER_M = 0.05
+
+
+def measurement_variance(dist):
+    # Variance (m^2) of a blob seen dist meters from the rover
+    return (MEASUREMENT_STD + MEASUREMENT_STD_PER_M*dist)**2
+
+
+def blob_positions(rock_mask, rover_pos, rover_yaw, origin=(0, 0),
+                   min_pixels=3, scale_factor=10):
+    """
+    World positions of the rock blobs of a warped-image mask.
+
+    Nonzero pixels of rock_mask are grouped into 8-connected blobs and
+    each blob of at least min_pixels is reduced to its centroid. The mask
+    may be a crop of the warped image whose top left pixel is at (row,
+    col) origin. Returns the (N, 2) world (x, y) points and their (N,)
+    distances in meters from the rover. Points are not binned into cells
+    like rover_to_world.
+
+    """
+    count, _, stats, centroids = cv2.connectedComponentsWithStats(
+        rock_mask, connectivity=8)
+    keep = stats[1:, cv2.CC_STAT_AREA] >= min_pixels
+    cols, rows = centroids[1:][keep].T
+    # Rover frame as in rover_coords: x forward, y left, in pixels from
+    # the bottom centre of the square warped image
+    img_rows = rock_mask.shape[0] + origin[0]
+    x_pixels = img_rows - (rows + origin[0])
+    y_pixels = img_rows - (cols + origin[1])
+
+    yaw_rad = np.deg2rad(rover_yaw)
+    cos_yaw, sin_yaw = np.cos(yaw_rad), np.sin(yaw_rad)
+    points = np.column_stack((x_pixels*cos_yaw - y_pixels*sin_yaw,
+                              x_pixels*sin_yaw + y_pixels*cos_yaw))
+    points = points/scale_factor + np.asarray(rover_pos[:2], dtype=np.float64)
+    return points, np.hypot(x_pixels, y_pixels)/scale_factor
+
+
+class SampleTrack():
+    """Constant-position Kalman estimate of one sample's world position."""
+
+    __slots__ = ('pos', 'var', 'hits', 'age')
+
+    def __init__(self, pos, var):
+        self.pos = pos  # (x, y) world position estimate
+        self.var = var  # Variance (m^2) of the estimate, same along x and y
+        self.hits = 1  # Frames the sample was seen in
+        self.age = 0  # Frames since it was last seen
+
+    def predict(self):
+        self.var += PROCESS_VAR
+        self.age += 1
+
+    def correct(self, pos, var):
+        gain = self.var/(self.var + var)
+        self.pos = self.pos + gain*(pos - self.pos)
+        self.var *= 1 - gain
+        self.hits += 1
+        self.age = 0
+
+
+class SampleTracker():
+    """
+    Tracks of the rock samples seen so far, kept in world coordinates.
+
+    Every frame the rock blobs in view are matched to the nearest track
+    within gate meters (or start a new one) and filter its position. A
+    track is confirmed once seen in min_hits frames; unconfirmed tracks
+    not seen again within max_unconfirmed_age frames are dropped as
+    noise, while confirmed ones are remembered until the sample is
+    picked up, so the rover can keep heading for a sample it lost sight
+    of. Like the occupancy grid, frames are weighted by their pitch/roll
+    confidence: blobs of tilted frames count as noisier measurements and
+    frames below MIN_CONFIDENCE are not measured at all.
+
+    """
+
+    def __init__(self, gate=2.0, min_hits=2, max_unconfirmed_age=10,
+                 min_pixels=3):
+        self.gate = gate
+        self.min_hits = min_hits
+        self.max_unconfirmed_age = max_unconfirmed_age
+        self.min_pixels = min_pixels
+        self.tracks = []
+        self.rock_mask = None  # Work image the rock pixels are drawn into
+
+    def update(self, rock_idx, img_shape, rover_pos, rover_yaw, origin=(0, 0),
+               confidence=1.):
+        """
+        Add one frame's rock pixels, given as flat indices into an image
+        of img_shape (the warped image, or a crop of it from origin that
+        reaches its bottom row), seen with the given reading confidence.
+
+        """
+        for track in self.tracks:
+            track.predict()
+        if confidence >= MIN_CONFIDENCE:
+            self.measure(rock_idx, img_shape, rover_pos, rover_yaw, origin,
+                         confidence)
+        self.tracks = [track for track in self.tracks
+                       if track.hits >= self.min_hits
+                       or track.age <= self.max_unconfirmed_age]
+
+    def measure(self, rock_idx, img_shape, rover_pos, rover_yaw, origin,
+                confidence):
+        # Match the frame's blobs to the tracks and filter them
+        if self.rock_mask is None or self.rock_mask.shape != tuple(img_shape[:2]):
+            self.rock_mask = np.zeros(img_shape[:2], dtype=np.uint8)
+        rock_mask = self.rock_mask
+        rock_mask.fill(0)
+        rock_mask.ravel()[rock_idx] = 1
+        points, dists = blob_positions(rock_mask, rover_pos, rover_yaw,
+                                       origin, self.min_pixels)
+        for point, dist in zip(points, dists):
+            var = measurement_variance(dist)/confidence
+            track = self.nearest(point, self.gate)
+            if track is None:
+                self.tracks.append(SampleTrack(point, var))
+            else:
+                track.correct(point, var)
+
+    def nearest(self, pos, max_dist, max_age=None, confirmed=False):
+        # Track nearest to pos within max_dist meters, or None
+        best, best_dist = None, max_dist
+        for track in self.tracks:
+            if confirmed and track.hits < self.min_hits:
+                continue
+            if max_age is not None and track.age > max_age:
+                continue
+            dist = np.hypot(*(track.pos - pos[:2]))
+            if dist < best_dist:
+                best, best_dist = track, dist
+        return best
+
+    def target(self, rover_pos, max_age=50, max_dist=10.0):
+        """
+        Return the world (x, y) position of the nearest confirmed sample
+        seen within max_age frames, or None.
+
+        """
+        track = self.nearest(np.asarray(rover_pos[:2]), max_dist, max_age,
+                             confirmed=True)
+        return None if track is None else track.pos
+
+    def forget_near(self, pos, radius=2.0):
+        # Drop the tracks of a sample that was picked up at pos
+        self.tracks = [track for track in self.tracks
+                       if np.hypot(*(track.pos - pos[:2])) > radius]
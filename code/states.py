@@ -1,7 +1,7 @@
 
 import numpy as np
 import math 
-from perception import pix_to_rover, to_polar_coords
+from perception import world_to_rover, to_polar_coords
 
 
 
@@ -11,9 +11,9 @@ def FollowingLeftWall(Rover):
     LARGE_WALL_OFFSET = -9
 
     # Add negative bias to nav angles left of rover to fnot hit wall
-    angle_to_wall = np.mean(Rover.nav_angles_left) + LARGE_WALL_OFFSET
+    angle_to_wall = Rover.features.left_mean + LARGE_WALL_OFFSET
     
-    if Rover.vel < Rover.MAX_VEL:
+    if Rover.vel < Rover.config.MAX_VEL:
         Rover.throttle = THROTTLE_SET
     else:
         Rover.throttle = 0
@@ -22,67 +22,92 @@ def FollowingLeftWall(Rover):
 
     #clip angle to be in steering range
     Rover.steer = np.clip(angle_to_wall,
-                              Rover.MAX_STEER_RIGHT, Rover.MAX_STEER_LEFT)
+                              Rover.config.MAX_STEER_RIGHT, Rover.config.MAX_STEER_LEFT)
 
 
 
 def TurningToLeftWall( Rover):
 
     # Stop before turning left
-    if Rover.vel > Rover.MIN_VEL:
+    if Rover.vel > Rover.config.MIN_VEL:
         Rover.throttle = 0
-        Rover.brake = Rover.MAX_BRAKE
+        Rover.brake = Rover.config.MAX_BRAKE
         Rover.steer = 0
     
     # Turn left towards wall
-    elif Rover.vel <= Rover.MIN_VEL:
+    elif Rover.vel <= Rover.config.MIN_VEL:
         Rover.throttle = 0
         Rover.brake = 0
-        Rover.steer = Rover.MAX_STEER_LEFT
+        Rover.steer = Rover.config.MAX_STEER_LEFT
     
 
 def AvoidingLeftWall(Rover):
 
     # Stop before turning right
-    if Rover.vel > Rover.MIN_VEL:
+    if Rover.vel > Rover.config.MIN_VEL:
         Rover.throttle = 0
-        Rover.brake = Rover.MAX_BRAKE
+        Rover.brake = Rover.config.MAX_BRAKE
         Rover.steer = 0
     
     # Turn right to avoid left wall
-    elif Rover.vel <= Rover.MIN_VEL:
+    elif Rover.vel <= Rover.config.MIN_VEL:
         Rover.throttle = 0
         Rover.brake = 0
-        Rover.steer = Rover.MAX_STEER_RIGHT
+        Rover.steer = Rover.config.MAX_STEER_RIGHT
     
 
 
+def clearer_side(Rover):
+
+    # Full steer to the side with more clearance
+    left, right = Rover.features.left_clearance, Rover.features.right_clearance
+    if left != right:
+        return Rover.config.MAX_STEER_LEFT if left > right else Rover.config.MAX_STEER_RIGHT
+
+    # Both sides as clear (or all rays blocked): turn towards the navigable
+    # terrain, and right if there is none
+    if Rover.features.nav_mean > 0:
+        return Rover.config.MAX_STEER_LEFT
+    return Rover.config.MAX_STEER_RIGHT
+
+
 def AvoidingObstacles(Rover):
 
-    nav_angle = np.mean(Rover.nav_angles)
-    
-    # Stop before avoiding obstacles
-    if Rover.vel > Rover.MIN_VEL:
+    THROTTLE_SET = 0.3
+    SLOW_VEL = 1.0
+    CLEAR_DIST = 30  # Warped pixels (3 m) free ahead to keep driving
+
+    # Keep driving slowly along the clearest steering angle if it has room
+    if Rover.features.clearest >= CLEAR_DIST:
+        if Rover.vel < SLOW_VEL:
+            Rover.throttle = THROTTLE_SET
+        else:
+            Rover.throttle = 0
+        Rover.brake = 0
+        Rover.steer = Rover.features.clearest_angle
+
+    # Otherwise stop before turning
+    elif Rover.vel > Rover.config.MIN_VEL:
         Rover.throttle = 0
-        Rover.brake = Rover.MAX_BRAKE
+        Rover.brake = Rover.config.MAX_BRAKE
         Rover.steer = 0
 
-    # check where navigable terrain is and turn left or right
-    elif Rover.vel <= Rover.MIN_VEL:
+    # Turn in place towards the side with more clearance
+    else:
         Rover.throttle = 0
         Rover.brake = 0
-        
-        # Turn right if nav terrain is more than 20 deg to the right
-        if nav_angle < Rover.MIN_ANGLE_RIGHT:
-            Rover.steer = Rover.MAX_STEER_RIGHT
-        
-        # Turn left if nav terrain is more than 20 deg to the left
-        elif nav_angle > Rover.MIN_ANGLE_LEFT:
-            Rover.steer = Rover.MAX_STEER_LEFT
-        
-        # if nav angles are undefined, back up and turn right
-        else:
-            Rover.steer = Rover.MAX_STEER_RIGHT
+        Rover.steer = clearer_side(Rover)
+
+
+def tracked_sample_angle(Rover):
+
+    # Angle to the nearest recently seen sample, or None
+    target = Rover.sample_tracker.target(Rover.pos)
+    if target is None:
+        return None
+    target_rf = world_to_rover(np.array([target]), Rover.pos, Rover.yaw)
+    _, target_angles = to_polar_coords(target_rf[:, 0], target_rf[:, 1])
+    return target_angles[0]
 
 
 def GoingToSample(Rover):
@@ -91,80 +116,76 @@ def GoingToSample(Rover):
     APPROACH_VEL = 1.0
     SMALL_WALL_OFFSET = -3.6
 
-    rock_pixs = len(Rover.rock_angles)
+    rock_pixs = Rover.features.rock_count
+    tracked_angle = tracked_sample_angle(Rover)
     
     # Stop before going to sample
     if Rover.vel > APPROACH_VEL:
         Rover.throttle = 0
-        Rover.brake = Rover.MAX_BRAKE
+        Rover.brake = Rover.config.MAX_BRAKE
         Rover.steer = 0
     
     # Drive to sample
     elif(Rover.vel <= APPROACH_VEL):
             
-        # If sample in view
-        if rock_pixs >= 1:
+        # If sample in view or tracked while briefly out of view
+        if rock_pixs >= 1 or tracked_angle is not None:
             
+            # Head for the tracked position when there is one, since it
+            # is filtered over frames and survives occlusion
+            if tracked_angle is not None:
+                angle_to_rock = tracked_angle
+            else:
+                angle_to_rock = Rover.features.rock_mean_angle
+
             # Add a right bias to angle to not hit left wall
-            angle_to_rock = np.mean(Rover.rock_angles) + SMALL_WALL_OFFSET
+            angle_to_rock += SMALL_WALL_OFFSET
             
             # turn left if rock sample to left more than 20 deg
-            if angle_to_rock >= Rover.MIN_ANGLE_LEFT:
+            if angle_to_rock >= Rover.config.MIN_ANGLE_LEFT:
                 Rover.throttle = 0
                 Rover.brake = 0
-                Rover.steer = Rover.MAX_STEER_LEFT
+                Rover.steer = Rover.config.MAX_STEER_LEFT
             
             # turn right if rock sample to right more than 20 deg
-            elif angle_to_rock <= Rover.MIN_ANGLE_RIGHT:
+            elif angle_to_rock <= Rover.config.MIN_ANGLE_RIGHT:
                 Rover.throttle = 0
                 Rover.brake = 0
-                Rover.steer = Rover.MAX_STEER_RIGHT
+                Rover.steer = Rover.config.MAX_STEER_RIGHT
             
             # Otherwise drive at average rock sample angle and clip it to steering range
-            elif (Rover.MIN_ANGLE_RIGHT < angle_to_rock < Rover.MIN_ANGLE_LEFT) or math.isnan(angle_to_rock):
+            elif (Rover.config.MIN_ANGLE_RIGHT < angle_to_rock < Rover.config.MIN_ANGLE_LEFT) or math.isnan(angle_to_rock):
                 Rover.brake = 0
                 Rover.throttle = THROTTLE_SET
                 Rover.steer = np.clip(angle_to_rock,
-                                          Rover.MAX_STEER_RIGHT,
-                                          Rover.MAX_STEER_LEFT)
-        # rock not in view, turn left
+                                          Rover.config.MAX_STEER_RIGHT,
+                                          Rover.config.MAX_STEER_LEFT)
+        # rock neither in view nor tracked, turn left
         else:  
             Rover.throttle = 0
             Rover.brake = 0
-            Rover.steer = Rover.MAX_STEER_LEFT
+            Rover.steer = Rover.config.MAX_STEER_LEFT
 
 
 
 def GettingUnstuck(Rover):
 
-    nav_angle = np.mean(Rover.nav_angles)
-    
     # Stopping before avoiding obstacles
-    if Rover.vel > Rover.MIN_VEL:
+    if Rover.vel > Rover.config.MIN_VEL:
             Rover.throttle = 0
-            Rover.brake = Rover.MAX_BRAKE
+            Rover.brake = Rover.config.MAX_BRAKE
             Rover.steer = 0
     
-    # check where navigable terrain is and turn left or right
-    elif Rover.vel <= Rover.MIN_VEL:
+    # Turn in place towards the side with more clearance
+    elif Rover.vel <= Rover.config.MIN_VEL:
             Rover.throttle = 0
             Rover.brake = 0
-
-            # Turn right if nav terrain is more than 20 deg to the right
-            if nav_angle < Rover.MAX_STEER_RIGHT:
-                Rover.steer = Rover.MAX_STEER_RIGHT
-            
-            # Turn left if nav terrain is more than 20 deg to the left
-            elif nav_angle > Rover.MAX_STEER_LEFT:
-                Rover.steer = Rover.MAX_STEER_LEFT
-            # if nav angles are undefined, back up and turn right
-            else:
-                Rover.steer = Rover.MAX_STEER_RIGHT
+            Rover.steer = clearer_side(Rover)
 
 def StoppingAtSample(Rover):
    
     Rover.throttle = 0
-    Rover.brake = Rover.MAX_BRAKE
+    Rover.brake = Rover.config.MAX_BRAKE
     Rover.steer = 0
 
 
@@ -176,9 +197,9 @@ def ReturningHome(Rover):
     SLOW_THROTTLE_SET = 0.2
     PARK_THROTTLE_SET = 0.3
 
-    home_pixpts_rf = pix_to_rover(Rover.home_coords_world,
-                                        Rover.pos, Rover.yaw)
-    xpix_pts, ypix_pts = home_pixpts_rf
+    home_pixpts_rf = world_to_rover(Rover.home_coords_world,
+                                    Rover.pos, Rover.yaw)
+    xpix_pts, ypix_pts = home_pixpts_rf[:, 0], home_pixpts_rf[:, 1]
     distances_from_home, angles_from_home = to_polar_coords(xpix_pts, ypix_pts)
     
     # Update Rover home polar coordinates
@@ -186,11 +207,18 @@ def ReturningHome(Rover):
     Rover.angle_from_home = np.mean(angles_from_home)
 
     # Drive at a weighted average of home and nav headings with a 3:7 ratio
-    nav_angle = np.mean(Rover.nav_angles)
+    nav_angle = Rover.features.nav_mean
     homenav_heading = 0.3*Rover.angle_from_home + (1 - 0.3)*nav_angle
 
+    # Follow the planned path over the map when there is one
+    waypoint = Rover.planner.waypoint(Rover.pos)
+    if waypoint is not None:
+        waypoint_rf = world_to_rover(np.array([waypoint]), Rover.pos, Rover.yaw)
+        _, waypoint_angles = to_polar_coords(waypoint_rf[:, 0], waypoint_rf[:, 1])
+        nav_angle = homenav_heading = waypoint_angles[0]
+
     # Keep within max velocity
-    if Rover.vel < Rover.MAX_VEL:
+    if Rover.vel < Rover.config.MAX_VEL:
             Rover.throttle = MAX_THROTTLE_SET
     else:
             Rover.throttle = 0
@@ -199,13 +227,13 @@ def ReturningHome(Rover):
     if Rover.distance_from_home > 450:
             Rover.brake = 0
             Rover.steer = np.clip(nav_angle,
-                                  Rover.MAX_STEER_RIGHT, Rover.MAX_STEER_LEFT)
+                                  Rover.config.MAX_STEER_RIGHT, Rover.config.MAX_STEER_LEFT)
     
     # Approach at the weighted average home and nav headings
     elif 200 < Rover.distance_from_home <= 450:
             Rover.brake = 0
             Rover.steer = np.clip(homenav_heading,
-                                  Rover.MAX_STEER_RIGHT, Rover.MAX_STEER_LEFT)
+                                  Rover.config.MAX_STEER_RIGHT, Rover.config.MAX_STEER_LEFT)
     
     # Slow down while keeping current angle
     elif 100 < Rover.distance_from_home <= 200:
@@ -215,30 +243,30 @@ def ReturningHome(Rover):
                 Rover.throttle = 0
             Rover.brake = 0
             Rover.steer = np.clip(homenav_heading,
-                                  Rover.MAX_STEER_RIGHT, Rover.MAX_STEER_LEFT)
+                                  Rover.config.MAX_STEER_RIGHT, Rover.config.MAX_STEER_LEFT)
     
     # Precisely approach at pure home angle and slow down for parking
     elif Rover.distance_from_home <= 100:
             if Rover.vel > PARK_VEL:
                 Rover.throttle = 0
-                Rover.brake = Rover.MAX_BRAKE
+                Rover.brake = Rover.config.MAX_BRAKE
                 Rover.steer = 0
             elif Rover.vel <= PARK_VEL:
                 Rover.brake = 0
                 # Turn left if home to the left more than 20 deg
-                if Rover.angle_from_home >= Rover.MIN_ANGLE_LEFT:
+                if Rover.angle_from_home >= Rover.config.MIN_ANGLE_LEFT:
                     Rover.throttle = 0
-                    Rover.steer = Rover.MAX_STEER_LEFT
+                    Rover.steer = Rover.config.MAX_STEER_LEFT
                 # Turn right if home to the right more than 20 deg
-                elif Rover.angle_from_home <= Rover.MIN_ANGLE_RIGHT:
+                elif Rover.angle_from_home <= Rover.config.MIN_ANGLE_RIGHT:
                     Rover.throttle = 0
-                    Rover.steer = Rover.MAX_STEER_RIGHT
+                    Rover.steer = Rover.config.MAX_STEER_RIGHT
                 # otherwise tread slowly at pure home angle
-                elif Rover.MIN_ANGLE_RIGHT < Rover.angle_from_home < Rover.MIN_ANGLE_LEFT:
+                elif Rover.config.MIN_ANGLE_RIGHT < Rover.angle_from_home < Rover.config.MIN_ANGLE_LEFT:
                     Rover.throttle = PARK_THROTTLE_SET
                     Rover.steer = np.clip(Rover.angle_from_home,
-                                          Rover.MAX_STEER_RIGHT,
-                                          Rover.MAX_STEER_LEFT)
+                                          Rover.config.MAX_STEER_RIGHT,
+                                          Rover.config.MAX_STEER_LEFT)
     
 
     
@@ -246,7 +274,31 @@ def ReturningHome(Rover):
 def ParkingAtHome(Rover):
     
     # Brake if still moving
-    if Rover.vel > Rover.MIN_VEL:
+    if Rover.vel > Rover.config.MIN_VEL:
             Rover.throttle = 0
-            Rover.brake = Rover.MAX_BRAKE
+            Rover.brake = Rover.config.MAX_BRAKE
             Rover.steer = 0
+
+
+def ExploringFrontier(Rover):
+
+    THROTTLE_SET = 0.8
+
+    nav_angle = Rover.features.nav_mean
+    heading = nav_angle
+
+    # Drive at a weighted average of frontier and nav headings with a 3:7 ratio
+    goal = Rover.frontiers.goal
+    if goal is not None:
+        goal_rf = world_to_rover(np.array([goal]), Rover.pos, Rover.yaw)
+        _, goal_angles = to_polar_coords(goal_rf[:, 0], goal_rf[:, 1])
+        heading = 0.3*goal_angles[0] + (1 - 0.3)*nav_angle
+
+    if Rover.vel < Rover.config.MAX_VEL:
+        Rover.throttle = THROTTLE_SET
+    else:
+        Rover.throttle = 0
+
+    Rover.brake = 0
+    Rover.steer = np.clip(heading,
+                          Rover.config.MAX_STEER_RIGHT, Rover.config.MAX_STEER_LEFT)
@@ -1,31 +1,66 @@
 import time
 import base64
 from io import BytesIO, StringIO
+from collections import namedtuple
 
 import cv2
 import numpy as np
 from PIL import Image
 
+from rock_index import RockSampleIndex
+from telemetry import parse_telemetry, parse_vector, RateLimitedPrinter
+
+
+# Status line of update_rover, printed at most once per second
+status_printer = RateLimitedPrinter(interval=1.0)
+
 
 def convert_to_float(string_to_convert):
     if ',' in string_to_convert:
-        float_value = np.float(string_to_convert.replace(',', '.'))
+        float_value = float(string_to_convert.replace(',', '.'))
     else:
-        float_value = np.float(string_to_convert)
+        float_value = float(string_to_convert)
     return float_value
 
 
+class CameraFrame():
+    """
+    Camera JPEG received with the telemetry.
+
+    Perception decodes it with decode_camera_image and the recorder
+    stores the JPEG bytes as they are.
+
+    """
+
+    def __init__(self, jpeg):
+        self.jpeg = jpeg
+
+
+def decode_camera_image(jpeg, out=None):
+    # Decode JPEG bytes straight into an RGB uint8 array, reusing out
+    # when it has the right shape and type
+    bgr = cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if out is None or out.shape != bgr.shape or out.dtype != np.uint8:
+        return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+    return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=out)
+
+
 def update_rover(Rover, data):
+    # Parse all numeric telemetry fields in one pass into a reused record
+    tlm = parse_telemetry(data, Rover.telemetry)
+    Rover.telemetry = tlm
+
     # Initialize start time and sample positions
     if Rover.start_time == None:
         Rover.start_time = time.time()
         Rover.total_time = 0
-        samples_xpos = np.int_([convert_to_float(pos.strip())
-                                for pos in data["samples_x"].split(';')])
-        samples_ypos = np.int_([convert_to_float(pos.strip())
-                                for pos in data["samples_y"].split(';')])
+        samples_xpos = np.int_(parse_vector(data["samples_x"]))
+        samples_ypos = np.int_(parse_vector(data["samples_y"]))
         Rover.samples_pos = (samples_xpos, samples_ypos)
-        Rover.samples_to_find = np.int(data["sample_count"])
+        # Index the samples and check any rock cells already mapped
+        Rover.rock_index = RockSampleIndex(Rover.samples_pos)
+        Rover.rock_index.update(np.flatnonzero(Rover.occupancy.rock_evidence))
+        Rover.samples_to_find = tlm.sample_count
     # Or just update elapsed time
     else:
         tot_time = time.time() - Rover.start_time
@@ -33,131 +68,110 @@ def update_rover(Rover, data):
             Rover.total_time = tot_time
     
     # The current speed of the rover in m/s
-    Rover.vel = convert_to_float(data["speed"])
+    Rover.vel = tlm.vel
     # The current position of the rover
-    Rover.pos = [convert_to_float(pos.strip()) for pos in data["position"].split(';')]
-    # The current yaw angle of the rover
-    Rover.yaw = convert_to_float(data["yaw"])
-    # The current yaw angle of the rover
-    Rover.pitch = convert_to_float(data["pitch"])
-    # The current yaw angle of the rover
-    Rover.roll = convert_to_float(data["roll"])
+    Rover.pos = tlm.pos
+    # The current yaw, pitch and roll angles of the rover
+    Rover.yaw = tlm.yaw
+    Rover.pitch = tlm.pitch
+    Rover.roll = tlm.roll
     # The current throttle setting
-    Rover.throttle = convert_to_float(data["throttle"])
+    Rover.throttle = tlm.throttle
     # The current steering angle
-    Rover.steer = convert_to_float(data["steering_angle"])
+    Rover.steer = tlm.steer
     # Near sample flag
-    Rover.near_sample = np.int32(data["near_sample"])
+    Rover.near_sample = tlm.near_sample
     # Picking up flag
-    Rover.picking_up = np.int32(data["picking_up"])
+    Rover.picking_up = tlm.picking_up
     # Update number of rocks collected
-    Rover.samples_collected = Rover.samples_to_find - np.int32(data["sample_count"])
+    Rover.samples_collected = Rover.samples_to_find - tlm.sample_count
 
-    print('speed =', Rover.vel, 'position =', Rover.pos, 'throttle =',
-          Rover.throttle, 'steer_angle =', Rover.steer, 'near_sample:', Rover.near_sample,
-          'picking_up:', data["picking_up"], 'sending pickup:', Rover.send_pickup,
-          'total time:', Rover.total_time, 'samples remaining:', data["sample_count"],
-          'samples collected:', Rover.samples_collected)
-          
-    # Get the current image from the center camera of the rover
-    imgString = data["image"]
-    image = Image.open(BytesIO(base64.b64decode(imgString)))
-    Rover.img = np.asarray(image)
+    if status_printer.ready():
+        status_printer('speed =', Rover.vel, 'position =', Rover.pos, 'throttle =',
+                       Rover.throttle, 'steer_angle =', Rover.steer, 'near_sample:', Rover.near_sample,
+                       'picking_up:', Rover.picking_up, 'sending pickup:', Rover.send_pickup,
+                       'total time:', Rover.total_time, 'samples remaining:', tlm.sample_count,
+                       'samples collected:', Rover.samples_collected)
 
-    # Return updated Rover and separate image for optional saving
-    return Rover, image
+    # Get the current image from the center camera of the rover,
+    # decoded into the Rover's image buffer
+    frame = CameraFrame(base64.b64decode(data["image"]))
+    Rover.img = decode_camera_image(frame.jpeg, out=Rover.img)
 
+    # Return updated Rover and the camera frame for optional saving
+    return Rover, frame
 
-def create_output_images(Rover):
 
-    # Create a scaled map for plotting and clean up obs/nav pixels a bit
-    if np.max(Rover.worldmap[:, :, 2]) > 0:
-        nav_pix = Rover.worldmap[:, :, 2] > 0
-        navigable = Rover.worldmap[:, :, 2] * (255 / np.mean(Rover.worldmap[nav_pix, 2]))
-    else:
-        navigable = Rover.worldmap[:, :, 2]
+# Everything create_output_images needs from the Rover, copied so the
+# images can be rendered on another thread while the Rover keeps updating
+OutputSnapshot = namedtuple('OutputSnapshot', [
+    'worldmap', 'ground_truth', 'vision_image', 'located_samples',
+    'perc_mapped', 'fidelity', 'rover'])
+
 
-    if np.max(Rover.worldmap[:, :, 0]) > 0:
-        obs_pix = Rover.worldmap[:, :, 0] > 0
-        obstacle = Rover.worldmap[:, :, 0] * (255 / np.mean(Rover.worldmap[obs_pix, 0]))
+def snapshot_output_state(Rover):
+    if Rover.rock_index is not None:
+        located_samples = list(Rover.rock_index.located_positions())
     else:
-        obstacle = Rover.worldmap[:, :, 0]
-
-    likely_nav = navigable >= obstacle
-    obstacle[likely_nav] = 0
-    plotmap = np.zeros_like(Rover.worldmap)
-    plotmap[:, :, 0] = obstacle
-    plotmap[:, :, 2] = navigable
-    plotmap = plotmap.clip(0, 255)
+        located_samples = []
+    return OutputSnapshot(
+        worldmap=Rover.worldmap.copy(),
+        ground_truth=Rover.ground_truth,  # Never modified, no copy needed
+        vision_image=Rover.vision_image.astype(np.uint8),
+        located_samples=located_samples,
+        perc_mapped=Rover.map_stats.perc_mapped,
+        fidelity=Rover.map_stats.fidelity,
+        rover=Rover.snapshot())
+
+
+def encode_jpeg(img):
+    # Encode a uint8 image as a base64 JPEG string for sending to server
+    buff = BytesIO()
+    Image.fromarray(img).save(buff, format="JPEG")
+    return base64.b64encode(buff.getvalue()).decode("utf-8")
+
+
+def render_output_images(snapshot):
+
+    # The occupancy grid keeps the worldmap's obstacle/navigable channels
+    # mutually exclusive, so they can be plotted as they are
+    plotmap = snapshot.worldmap
+    plotmap[:, :, 1] = 0
     # Overlay obstacle and navigable terrain map with ground truth map
-    map_add = cv2.addWeighted(plotmap, 1, Rover.ground_truth, 0.5, 0)
-
-    # Check whether any rock detections are present in worldmap
-    rock_world_pos = Rover.worldmap[:, :, 1].nonzero()
-    # If there are, we'll step through the known sample positions
-    # to confirm whether detections are real
-    samples_located = 0
-    if rock_world_pos[0].any():
-        rock_size = 2
-        for idx in range(len(Rover.samples_pos[0])):
-            test_rock_x = Rover.samples_pos[0][idx]
-            test_rock_y = Rover.samples_pos[1][idx]
-            rock_sample_dists = np.sqrt((test_rock_x - rock_world_pos[1])**2 +
-                                        (test_rock_y - rock_world_pos[0])**2)
-            # If rocks were detected within 3 meters of known sample positions
-            # consider it a success and plot the location of the known
-            # sample on the map
-            if np.min(rock_sample_dists) < 3:
-                samples_located += 1
-                map_add[test_rock_y-rock_size:test_rock_y+rock_size,
-                        test_rock_x-rock_size:test_rock_x+rock_size, :] = 255
-
-    # Calculate some statistics on the map results
-    # First get the total number of pixels in the navigable terrain map
-    tot_nav_pix = np.float32(len((plotmap[:, :, 2].nonzero()[0])))
-    # Next figure out how many of those correspond to ground truth pixels
-    good_nav_pix = np.float32(
-        len(((plotmap[:, :, 2] > 0) & (Rover.ground_truth[:, :, 1] > 0)).nonzero()[0]))
-    # Next find how many do not correspond to ground truth pixels
-    bad_nav_pix = np.float(
-        len(((plotmap[:, :, 2] > 0) & (Rover.ground_truth[:, :, 1] == 0)).nonzero()[0]))
-    # Grab the total number of map pixels
-    tot_map_pix = np.float32(len((Rover.ground_truth[:, :, 1].nonzero()[0])))
-    # Calculate the percentage of ground truth map that has been successfully found
-    perc_mapped = round(100*good_nav_pix/tot_map_pix, 1)
-    Rover.perc_mapped = perc_mapped
-    # Calculate the number of good map pixel detections divided by total pixels
-    # found to be navigable terrain
-    if tot_nav_pix > 0:
-        fidelity = round(100*good_nav_pix/(tot_nav_pix), 1)
-    else:
-        fidelity = 0
+    map_add = cv2.addWeighted(plotmap, 1, snapshot.ground_truth, 0.5, 0,
+                              dtype=cv2.CV_8U)
+
+    # Plot the location of every known sample that has been confirmed by
+    # a rock detection within 3 meters (tracked by the rock sample index)
+    rock_size = 2
+    for test_rock_x, test_rock_y in snapshot.located_samples:
+        map_add[test_rock_y-rock_size:test_rock_y+rock_size,
+                test_rock_x-rock_size:test_rock_x+rock_size, :] = 255
 
     # Flip the map for plotting so that the y-axis points upward in the display
-    map_add = np.flipud(map_add).astype(np.float32)\
+    map_add = np.ascontiguousarray(np.flipud(map_add))
 
     # Add some text about map and rock sample detection results
-    cv2.putText(map_add, "Time: "+str(np.round(Rover.total_time, 1))+' s', (0, 10),
+    cv2.putText(map_add, "Time: "+str(np.round(snapshot.rover.total_time, 1))+' s', (0, 10),
                 cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-    cv2.putText(map_add, "Mapped: "+str(perc_mapped)+'%', (0, 25),
+    cv2.putText(map_add, "Mapped: "+str(snapshot.perc_mapped)+'%', (0, 25),
                 cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-    cv2.putText(map_add, "Fidelity: "+str(fidelity)+'%', (0, 40),
+    cv2.putText(map_add, "Fidelity: "+str(snapshot.fidelity)+'%', (0, 40),
                 cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
     cv2.putText(map_add, "Rocks", (0, 55),
                 cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-    cv2.putText(map_add, "  Located: "+str(samples_located), (0, 70),
+    cv2.putText(map_add, "  Located: "+str(len(snapshot.located_samples)), (0, 70),
                 cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-    cv2.putText(map_add, "  Collected: "+str(Rover.samples_collected), (0, 85),
+    cv2.putText(map_add, "  Collected: "+str(snapshot.rover.samples_collected), (0, 85),
                 cv2.FONT_HERSHEY_COMPLEX, 0.4, (255, 255, 255), 1)
-    # Convert map and vision image to base64 strings for sending to server
-    pil_img = Image.fromarray(map_add.astype(np.uint8))
-    buff = BytesIO()
-    pil_img.save(buff, format="JPEG")
-    encoded_string1 = base64.b64encode(buff.getvalue()).decode("utf-8")
 
-    pil_img = Image.fromarray(Rover.vision_image.astype(np.uint8))
-    buff = BytesIO()
-    pil_img.save(buff, format="JPEG")
-    encoded_string2 = base64.b64encode(buff.getvalue()).decode("utf-8")
+    # Convert map and vision image to base64 strings for sending to server
+    encoded_string1 = encode_jpeg(map_add)
+    encoded_string2 = encode_jpeg(snapshot.vision_image)
 
     return encoded_string1, encoded_string2
+
+
+def create_output_images(Rover):
+    # Render the inset images synchronously
+    return render_output_images(snapshot_output_state(Rover))
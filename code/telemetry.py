@@ -0,0 +1,83 @@
+"""
+Schema-driven parsing of the telemetry sent by the simulator.
+
+"""
+import time
+
+
+def parse_number(text):
+    # Float that may use a locale decimal comma
+    return float(text.replace(',', '.'))
+
+
+def parse_vector(text):
+    # ';'-separated floats that may use locale decimal commas
+    return tuple(map(float, text.replace(',', '.').split(';')))
+
+
+def parse_flag(text):
+    return int(text)
+
+
+# (telemetry key, record field, parser) of every per-frame scalar field
+TELEMETRY_SCHEMA = (
+    ('speed', 'vel', parse_number),
+    ('position', 'pos', parse_vector),
+    ('yaw', 'yaw', parse_number),
+    ('pitch', 'pitch', parse_number),
+    ('roll', 'roll', parse_number),
+    ('throttle', 'throttle', parse_number),
+    ('steering_angle', 'steer', parse_number),
+    ('near_sample', 'near_sample', parse_flag),
+    ('picking_up', 'picking_up', parse_flag),
+    ('sample_count', 'sample_count', parse_flag),
+)
+
+
+class TelemetryRecord():
+    """Typed values of one telemetry message, one slot per schema field."""
+
+    __slots__ = tuple(field for _, field, _ in TELEMETRY_SCHEMA)
+
+    def __repr__(self):
+        return 'TelemetryRecord({})'.format(', '.join(
+            '{}={}'.format(field, getattr(self, field)) for field in self.__slots__))
+
+
+def parse_telemetry(data, record=None):
+    """
+    Parse the numeric fields of a telemetry message in one pass.
+
+    Fills and returns record (a new TelemetryRecord by default), so the
+    same record can be reused from frame to frame.
+
+    """
+    if record is None:
+        record = TelemetryRecord()
+    for key, field, parse in TELEMETRY_SCHEMA:
+        setattr(record, field, parse(data[key]))
+    return record
+
+
+class RateLimitedPrinter():
+    """
+    print() that emits at most once every interval seconds.
+
+    Printing every frame to a busy terminal measurably lowers the FPS
+    of the telemetry loop.
+
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.last_print = float('-inf')
+
+    def ready(self):
+        # Whether a message would be printed now
+        return time.monotonic() - self.last_print >= self.interval
+
+    def __call__(self, *args, **kwargs):
+        now = time.monotonic()
+        if now - self.last_print >= self.interval:
+            self.last_print = now
+            print(*args, **kwargs)
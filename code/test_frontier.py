@@ -0,0 +1,24 @@
+"""
+Tests of the exploration frontiers on a replayed map. Run from the code
+directory:
+
+    python -m pytest -q
+
+"""
+import replay
+from rover_state import RoverState
+
+
+LOG_PATH = '../test_dataset/robot_log.csv'
+
+
+def test_goal_chosen_on_replayed_map():
+    rows = list(replay.read_log(LOG_PATH))[:200]
+    Rover = RoverState()
+    replay.map_rows(rows, Rover)
+    pos = rows[-1]['pos']
+
+    goal = Rover.frontiers.choose_goal(pos, rows[-1]['time'])
+    assert goal is not None
+    assert Rover.frontiers.frontier[int(goal[1]), int(goal[0])]
+    assert Rover.frontiers.reachable_from(pos)[int(goal[1]), int(goal[0])]
@@ -0,0 +1,68 @@
+"""
+Tests of the occupancy grid evidence. Run from the code directory:
+
+    python -m pytest -q
+
+"""
+import numpy as np
+
+from occupancy import (OccupancyGrid, LOG_ODDS_BOUND, NAVIGABLE_HIT,
+                       LOG_ODDS_SCALE)
+
+
+CELL = np.array([[10, 20]])
+NONE = np.zeros((0, 2), dtype=np.intp)
+
+
+def test_log_odds_saturate():
+    grid = OccupancyGrid()
+    for _ in range(50):
+        grid.update(NONE, CELL, NONE)
+    assert grid.log_odds[20, 10] == -LOG_ODDS_BOUND
+    for _ in range(50):
+        grid.update(CELL, NONE, NONE)
+    assert grid.log_odds[20, 10] == LOG_ODDS_BOUND
+
+
+def test_false_obstacle_flips_back_after_a_few_frames():
+    grid = OccupancyGrid()
+    for _ in range(50):
+        grid.update(NONE, CELL, NONE)
+    frames = int(np.ceil(LOG_ODDS_BOUND/(NAVIGABLE_HIT*LOG_ODDS_SCALE))) + 1
+    for _ in range(frames):
+        grid.update(CELL, NONE, NONE)
+    assert grid.is_navigable(10, 20)
+
+
+def random_frames(rng, frames=40, cells=6):
+    # Per-frame (N, 2) navigable/obstacle cells out of a few world cells
+    return [(rng.integers(0, cells, (rng.integers(0, 8), 2)),
+             rng.integers(0, cells, (rng.integers(0, 8), 2)))
+            for _ in range(frames)]
+
+
+def test_batch_and_merge_match_sequential_updates():
+    rng = np.random.default_rng(0)
+    frames = random_frames(rng)
+    confidences = rng.uniform(0., 1., len(frames))
+
+    sequential = OccupancyGrid()
+    for (nav, obs), confidence in zip(frames, confidences):
+        sequential.update(nav, obs, NONE, confidence)
+
+    batch = OccupancyGrid()
+    observations = [(np.concatenate([np.full(len(frame[kind]), idx)
+                                     for idx, frame in enumerate(frames)]),
+                     np.concatenate([frame[kind] for frame in frames]))
+                    for kind in (0, 1)]
+    batch.update_batch(*observations, (np.zeros(0, np.intp), NONE), confidences)
+    assert np.array_equal(batch.log_odds, sequential.log_odds)
+
+    merged = OccupancyGrid()
+    for part in (slice(0, 15), slice(15, None)):
+        partial = OccupancyGrid()
+        partial.track_transfer()
+        for (nav, obs), confidence in zip(frames[part], confidences[part]):
+            partial.update(nav, obs, NONE, confidence)
+        merged.merge(*partial.transfer, partial.rock_evidence)
+    assert np.array_equal(merged.log_odds, sequential.log_odds)
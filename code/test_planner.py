@@ -0,0 +1,59 @@
+"""
+Tests of the cost-to-go field of the home planner. Run from the code
+directory:
+
+    python -m pytest -q
+
+"""
+import heapq
+
+import numpy as np
+
+from planner import (CostToGo, MOVES, BLOCKED, NAVIGABLE_COST, UNKNOWN_COST,
+                     UNCERTAIN_COST)
+
+
+SHAPE = (24, 30)
+
+
+def dijkstra(costs, goal):
+    # Cost to go of every cell by Dijkstra from the goal, over the moves
+    # of CostToGo
+    height, width = SHAPE
+    blocked = (costs == BLOCKED) & (np.arange(costs.size) != goal)
+    g = np.full(costs.size, BLOCKED)
+    g[goal] = 0.
+    queue = [(0., goal)]
+    while queue:
+        total, cell = heapq.heappop(queue)
+        if total > g[cell]:
+            continue
+        y, x = divmod(cell, width)
+        for dx, dy, step in MOVES:
+            # Cells whose (dx, dy) move ends in cell
+            px, py = x - dx, y - dy
+            if not (0 <= px < width and 0 <= py < height) or blocked[cell]:
+                continue
+            if dx and dy and (blocked[py*width + x] or blocked[y*width + px]):
+                continue
+            before = py*width + px
+            if total + step*costs[before] < g[before]:
+                g[before] = total + step*costs[before]
+                heapq.heappush(queue, (g[before], before))
+    return g
+
+
+def test_field_follows_cost_changes():
+    rng = np.random.default_rng(0)
+    goal = 7*SHAPE[1] + 11
+    field = CostToGo(SHAPE, goal)
+    costs = np.full(SHAPE[0]*SHAPE[1], UNKNOWN_COST)
+    choices = np.array([NAVIGABLE_COST, UNKNOWN_COST, UNCERTAIN_COST, BLOCKED])
+    for _ in range(30):
+        cells = np.unique(rng.integers(0, costs.size, rng.integers(1, 60)))
+        costs[cells] = rng.choice(choices, len(cells), p=[0.4, 0.1, 0.2, 0.3])
+        field.set_costs(cells, costs[cells])
+        expected = dijkstra(costs, goal)
+        assert np.array_equal(np.isfinite(field.g[:-1]), np.isfinite(expected))
+        reachable = np.isfinite(expected)
+        assert np.allclose(field.g[:-1][reachable], expected[reachable])
@@ -1,112 +1,119 @@
+from collections import namedtuple
 
 import events
+import states
 
 
-def following_left_wall_transitions(Decider, Rover):
- 
-    if events.deviated_from_left_wall(Rover=Rover):        
-        Rover.timer_on = False
-        Decider.switch_to_state(Rover, Decider.state[1])  # TurningToLeftWall
+# A rule fires when its event holds: action(Rover) runs, then the rover
+# switches to target (None keeps the current state, a callable picks it)
+Transition = namedtuple('Transition', ['event', 'action', 'target'])
 
-    elif events.obstacle_on_left(Rover=Rover):
-        Rover.timer_on = False
-        Decider.switch_to_state(Rover, Decider.state[2])  # AvoidingLeftWall
 
-    elif events.sample_located(Rover=Rover):
-        Rover.timer_on = False
-        Decider.switch_to_state(Rover, Decider.state[4])  # GoingToSample
+def stop_timer(Rover):
+    Rover.timer_on = False
 
-    elif events.completed_mission(Rover=Rover):
-        Rover.going_home = True
-        Decider.switch_to_state(Rover, Decider.state[7])  # ReturningHome
 
-    elif events.is_stuck(Rover=Rover):
-        Rover.timer_on = False
-        Decider.switch_to_state(Rover, Decider.state[6])  # GettingUnstuck
-    else:
-        Decider.switch_to_state(Rover, Decider.curr_state)
+def start_going_home(Rover):
+    Rover.going_home = True
 
 
-def turning_to_left_wall_transitions(Decider, Rover):
-
-    if events.pointed_along_wall(Rover=Rover):
-        Decider.switch_to_state(Rover, Decider.state[0])  # FollowingLeftWall
-    else:
-        Decider.switch_to_state(Rover, Decider.curr_state)
-
-def avoiding_left_wall_transitions(Decider, Rover):
-
-    if events.pointed_along_wall(Rover=Rover):
-        Decider.switch_to_state(Rover, Decider.state[0])  # FollowingLeftWall
-    else:
-        Decider.switch_to_state(Rover, Decider.curr_state)
-
-def avoiding_obstacles_transitions(Decider, Rover):
-
-    if events.completed_mission(Rover=Rover):
-        Decider.switch_to_state(Rover, Decider.state[7])  # ReturningHome
-    elif events.pointed_along_wall(Rover=Rover):
-        Decider.switch_to_state(Rover, Decider.state[0])  # FollowingLeftWall
-    else:
-        Decider.switch_to_state(Rover, Decider.curr_state)
-
-def going_to_sample_transitions(Decider, Rover):
-    
-    if Rover.near_sample:
-        Rover.timer_on = False
-        Decider.switch_to_state(Rover, Decider.state[5])  # StoppingAtSample
-
-    elif events.is_stuck(Rover=Rover):
-        Rover.timer_on = False
-        Decider.switch_to_state(Rover, Decider.state[6])  # GettingUnstuck
-    else:
-        Decider.switch_to_state(Rover, Decider.curr_state)
-
-def getting_unstuck_transitions(Decider, Rover):
-
-    if Rover.vel >= 1.0:
-        if Rover.going_home:
-            Decider.switch_to_state(Rover, Decider.state[7])  # ReturningHome
-        else:
-            Decider.switch_to_state(Rover, Decider.state[0])  # FollowingLeftWall
-
-    elif events.is_stuck(Rover=Rover):
-        Rover.timer_on = False
-        if Rover.going_home:
-            Decider.switch_to_state(Rover, Decider.state[7])  # ReturningHome
-        else:
-            Decider.switch_to_state(Rover, Decider.state[0])  # FollowingLeftWall
-    else:
-        Decider.switch_to_state(Rover, Decider.curr_state)
-
-def stopping_at_sample_transitions(Decider, Rover):
-
+def request_pickup(Rover):
     Rover.send_pickup = True
-    if Rover.picking_up == 0:
-        Decider.switch_to_state(Rover, Decider.state[2])  # AvoidingLeftWall
-    else:
-        Decider.switch_to_state(Rover, Decider.curr_state)
-
-
-
-
-def returning_home_transitions(Decider, Rover):
-
-    if events.obstacle_at_front(Rover=Rover):
-        Rover.timer_on = False
-        Decider.switch_to_state(Rover, Decider.state[3])  # AvoidingObstacles
-
-    elif events.reached_home(Rover=Rover):        
-        Rover.timer_on = False
-        Decider.switch_to_state(Rover, Decider.state[8])  # ParkingAtHome
-
-    elif events.is_stuck(Rover=Rover):
-        Rover.timer_on = False
-        Decider.switch_to_state(Rover, Decider.state[6])  # GettingUnstuck
-    else:
-        Decider.switch_to_state(Rover, Decider.curr_state)
 
 
-def parking_at_home_transitions(Decider, Rover):
-    
-    Decider.switch_to_state(Rover, Decider.state[8])  # Remain in ParkingAtHome
+def pick_up_sample(Rover):
+    # The picked up sample is no longer a target
+    request_pickup(Rover)
+    Rover.sample_tracker.forget_near(Rover.pos)
+
+
+def start_exploring(Rover):
+    # Head for the nearest frontier; coverage is measured afresh from now
+    Rover.frontiers.choose_goal(Rover.pos, Rover.total_time)
+    Rover.frontiers.reset_coverage()
+
+
+def give_up_frontier(Rover):
+    Rover.frontiers.abandon_goal()
+
+
+def resume_target(Rover):
+    # Resume the task that was interrupted by getting stuck
+    if Rover.going_home:
+        return states.ReturningHome
+    return states.FollowingLeftWall
+
+
+# Rules of each state, checked in order; the first one whose event holds
+# fires. When none does the rover stays in its current state.
+TRANSITIONS = {
+    states.FollowingLeftWall: (
+        Transition(events.deviated_from_left_wall, stop_timer, states.TurningToLeftWall),
+        Transition(events.obstacle_on_left, stop_timer, states.AvoidingLeftWall),
+        Transition(events.sample_located, stop_timer, states.GoingToSample),
+        Transition(events.completed_mission, start_going_home, states.ReturningHome),
+        Transition(events.coverage_stalled, start_exploring, states.ExploringFrontier),
+        Transition(events.is_stuck, stop_timer, states.GettingUnstuck),
+    ),
+    states.ExploringFrontier: (
+        Transition(events.sample_located, stop_timer, states.GoingToSample),
+        Transition(events.completed_mission, start_going_home, states.ReturningHome),
+        Transition(events.frontier_reached, None, states.FollowingLeftWall),
+        Transition(events.exploring_too_long, give_up_frontier, states.FollowingLeftWall),
+        Transition(events.is_stuck, stop_timer, states.GettingUnstuck),
+    ),
+    states.TurningToLeftWall: (
+        Transition(events.pointed_along_wall, None, states.FollowingLeftWall),
+    ),
+    states.AvoidingLeftWall: (
+        Transition(events.pointed_along_wall, None, states.FollowingLeftWall),
+    ),
+    states.AvoidingObstacles: (
+        Transition(events.completed_mission, None, states.ReturningHome),
+        Transition(events.pointed_along_wall, None, states.FollowingLeftWall),
+    ),
+    states.GoingToSample: (
+        Transition(events.near_sample, stop_timer, states.StoppingAtSample),
+        Transition(events.is_stuck, stop_timer, states.GettingUnstuck),
+    ),
+    states.StoppingAtSample: (
+        Transition(events.pickup_finished, pick_up_sample, states.AvoidingLeftWall),
+        Transition(events.always, request_pickup, None),
+    ),
+    states.GettingUnstuck: (
+        Transition(events.moving_again, None, resume_target),
+        Transition(events.is_stuck, stop_timer, resume_target),
+    ),
+    states.ReturningHome: (
+        Transition(events.obstacle_at_front, stop_timer, states.AvoidingObstacles),
+        Transition(events.reached_home, stop_timer, states.ParkingAtHome),
+        Transition(events.is_stuck, stop_timer, states.GettingUnstuck),
+    ),
+    states.ParkingAtHome: (),
+}
+
+
+def fire(Rover, rules):
+    """
+    Return the first rule of rules whose event holds, after running its
+    action, or None.
+
+    Events are evaluated lazily in order, since some of them (is_stuck)
+    update the Rover as a side effect.
+
+    """
+    for rule in rules:
+        if rule.event(Rover):
+            if rule.action is not None:
+                rule.action(Rover)
+            return rule
+    return None
+
+
+def next_state(Rover, curr_state, rule):
+    # State the rover switches to after rule fired (or none did)
+    if rule is None or rule.target is None:
+        return curr_state
+    if rule.target in TRANSITIONS:
+        return rule.target
+    return rule.target(Rover)